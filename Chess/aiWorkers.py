@@ -0,0 +1,353 @@
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from typing import Any, Callable, Deque, Dict, NamedTuple, Optional
+import chessEngine, smartMoveFinder
+
+MAX_QUEUE: int = 64  # searches queued or running at once before new ones are rejected
+LATENCY_WINDOW: int = 1000  # number of recent jobs the latency statistics cover
+PONDER_TIME_FACTOR: int = 10  # a ponder search of a timed game stops after this many times the game's time limit
+
+
+class SearchResult(NamedTuple):
+    """
+    What a worker sends back: the move in coordinate notation (e.g. 'e2e4'), its score for the side to move and how the search went,
+    with the full search statistics (see smartMoveFinder.Searcher.statistics) in info.
+    """
+    move: Optional[str]
+    score: float
+    depth: int
+    nodes: int
+    searchSeconds: float
+    info: Optional[Dict[str, Any]] = None
+
+
+class AIQueueFull(Exception):
+    """Raised by AIWorkerPool.submit when MAX_QUEUE searches are already pending."""
+    pass
+
+
+def searchPosition(fen: str, depth: Optional[int], timeLimit: Optional[int], gameId: Optional[str] = None,
+                   infoQueue: Optional[Any] = None, stopEvent: Optional[Any] = None, ponder: bool = False) -> SearchResult:
+    """
+    Run one AI search in a worker process.
+    The position arrives as a FEN string, so a job is a few dozen bytes to send instead of a pickled GameState.
+    With an infoQueue, the statistics of every completed iteration are put on it as (gameId, info) while the search runs.
+    The search stops early when stopEvent is set. A ponder search of a timed game deepens for up to
+    PONDER_TIME_FACTOR times timeLimit instead, so an opponent who never moves does not hold the worker.
+    """
+    game_state = chessEngine.GameState.fromFEN(fen)
+    valid_moves = game_state.getValidMoves()
+    on_info = (lambda info: infoQueue.put((gameId, info))) if infoQueue is not None else None
+    searcher = smartMoveFinder.Searcher(smartMoveFinder.transpositionTable, stopEvent, onInfo=on_info)
+    start = time.perf_counter()
+    if timeLimit is not None:
+        limit = timeLimit * PONDER_TIME_FACTOR if ponder else timeLimit
+        move, depth = searcher.findBestMoveTimed(game_state, valid_moves, limit, depth or smartMoveFinder.MAX_DEPTH)
+    else:
+        move = searcher.findBestMove(game_state, valid_moves, depth)
+    if move is None and valid_moves:
+        move = smartMoveFinder.findRandomMove(valid_moves)
+    return SearchResult(move.getChessNotation() if move is not None else None, searcher.bestScore, depth, searcher.nodes,
+                        time.perf_counter() - start, searcher.statistics())
+
+
+class _Job:
+    __slots__ = ('gameId', 'future', 'submitted', 'cancelled', 'fen', 'stopEvent', 'onResult', 'pondering', 'result', 'timer')
+
+    def __init__(self, gameId: str, future: Future, submitted: float, fen: str, stopEvent: Optional[Any],
+                 onResult: Optional[Callable[[SearchResult], None]], pondering: bool):
+        self.gameId: str = gameId
+        self.future: Future = future
+        self.submitted: float = submitted
+        self.cancelled: bool = False
+        self.fen: str = fen
+        self.stopEvent: Optional[Any] = stopEvent
+        self.onResult: Optional[Callable[[SearchResult], None]] = onResult
+        self.pondering: bool = pondering
+        self.result: Optional[SearchResult] = None  # result of a ponder search that finished before its ponder hit
+        self.timer: Optional[threading.Timer] = None  # stops a ponder search once its time budget is used up
+
+
+class AIWorkerPool:
+    """
+    Runs AI searches in a pool of worker processes so they do not hold the server's GIL.
+    At most one search per game is in flight; a new search for the same game cancels the previous one.
+    Results are handed to the callback given at submit time, on a pool thread, unless the job was cancelled.
+    A search that fails in its worker is reported as a result without a move.
+    If onInfo is given, it is called with (gameId, statistics) after every completed iteration of every search,
+    on a forwarding thread, while the search is still running.
+    With ponder, the pool can also search the position expected after the opponent's reply while the opponent
+    thinks (see ponder and ponderHit), and cancelled searches are stopped in their workers instead of finishing there.
+    Ponder searches only start on an idle worker, and give way to searches for moves when every worker is busy.
+    """
+
+    def __init__(self, numWorkers: Optional[int] = None, maxQueue: int = MAX_QUEUE,
+                 onInfo: Optional[Callable[[str, Dict[str, Any]], None]] = None, ponder: bool = False):
+        # Workers are spawned rather than forked, because forking a process that runs server threads is unsafe.
+        context = multiprocessing.get_context('spawn')
+        self.numWorkers: int = numWorkers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.numWorkers, mp_context=context)
+        # Iteration reports and stop events travel through a manager, whose queues and events, unlike plain
+        # multiprocessing ones, can be passed to pool jobs.
+        self.manager = context.Manager() if onInfo is not None or ponder else None
+        self.infoQueue = self.manager.Queue() if onInfo is not None else None
+        if onInfo is not None:
+            threading.Thread(target=self._forwardInfo, args=(onInfo,), daemon=True).start()
+        self.maxQueue: int = maxQueue
+        self.jobs: Dict[str, _Job] = {}
+        self.lock = threading.Lock()
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.searchTimes: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.searchNodes: Deque[int] = deque(maxlen=LATENCY_WINDOW)
+        self.completed: int = 0
+        self.cancelled: int = 0
+        self.rejected: int = 0
+        self.failed: int = 0
+        self.pondersStarted: int = 0
+        self.ponderHits: int = 0
+        self.ponderMisses: int = 0
+        self.pondersPreempted: int = 0
+        self.ponderSavedSeconds: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def submit(self, gameId: str, fen: str, depth: Optional[int], timeLimit: Optional[int],
+               onResult: Callable[[SearchResult], None]) -> None:
+        """
+        Queue a search of the position for a game. Raises AIQueueFull if the queue is at capacity.
+        If every worker is busy, running ponder searches of other games are stopped to make room for it.
+        """
+        self.cancel(gameId)
+        with self.lock:
+            busy = [job for job in self.jobs.values() if not job.future.done()]
+            ponders = sorted((job for job in busy if job.pondering), key=lambda job: job.submitted, reverse=True)
+            preempted = ponders[:max(0, len(busy) - self.numWorkers + 1)]
+            self.pondersPreempted += len(preempted)
+        for job in preempted:
+            self.cancel(job.gameId)
+        self._start(gameId, fen, depth, timeLimit, onResult, False)
+
+    def ponder(self, gameId: str, fen: str, depth: Optional[int], timeLimit: Optional[int]) -> bool:
+        """
+        Start searching, for a game, the position expected after the opponent's reply, until ponderHit or cancel.
+        A timed search deepens for up to PONDER_TIME_FACTOR times timeLimit meanwhile, and a finished search keeps
+        its result until then. Returns False, starting nothing, if no worker is idle or the queue is at capacity.
+        """
+        if self.manager is None:
+            raise RuntimeError("AIWorkerPool was created without ponder")
+        self.cancel(gameId)
+        with self.lock:
+            if sum(1 for job in self.jobs.values() if not job.future.done()) >= self.numWorkers:
+                return False
+        try:
+            self._start(gameId, fen, depth, timeLimit, None, True)
+        except AIQueueFull:
+            return False
+        with self.lock:
+            self.pondersStarted += 1
+        return True
+
+    def ponderHit(self, gameId: str, fen: str, timeLimit: Optional[int], onResult: Callable[[SearchResult], None]) -> bool:
+        """
+        Called when it is the AI's turn in a game at the position given as fen.
+        If the game's ponder search is of that position, it carries on as the search for the move: a timed one is
+        stopped once it has run timeLimit milliseconds in all, and the result goes to onResult as with submit.
+        Otherwise a ponder search of the game is cancelled. Returns whether the ponder search was kept.
+        """
+        with self.lock:
+            job = self.jobs.get(gameId)
+            if job is None or not job.pondering:
+                return False
+            if job.fen == fen:
+                now = time.perf_counter()
+                elapsed = now - job.submitted
+                result = job.result
+                # The time saved is the part of the search already done, as the move goes out that much sooner.
+                saved = elapsed if result is None else result.searchSeconds
+                if timeLimit is not None:
+                    saved = min(saved, timeLimit / 1000)
+                self.ponderHits += 1
+                self.ponderSavedSeconds.append(saved)
+                job.pondering = False
+                job.onResult = onResult
+                job.submitted = now
+                if result is None:
+                    if timeLimit is not None:
+                        job.timer = threading.Timer(max(0.0, timeLimit / 1000 - elapsed), job.stopEvent.set)
+                        job.timer.daemon = True
+                        job.timer.start()
+                    return True
+                self._complete(job, result)
+            else:
+                self.ponderMisses += 1
+                result = None
+        if result is None:
+            self.cancel(gameId)
+            return False
+        onResult(result)
+        return True
+
+    def cancel(self, gameId: str) -> bool:
+        """
+        Cancel the search of a game, e.g. when it is abandoned or restarted.
+        A queued search is dropped; a running one is told to stop if the pool has a manager (see ponder and onInfo),
+        and otherwise finishes in its worker. Either way its result is discarded.
+        """
+        with self.lock:
+            job = self.jobs.pop(gameId, None)
+            if job is None:
+                return False
+            job.cancelled = True
+            self.cancelled += 1
+        job.future.cancel()
+        if job.timer is not None:
+            job.timer.cancel()
+        if job.stopEvent is not None:
+            job.stopEvent.set()
+        return True
+
+    def queueDepth(self) -> int:
+        """Number of searches queued or running."""
+        return len(self.jobs)
+
+    def statistics(self) -> dict:
+        """
+        Queue depth, job counters, latency (submit to result) and search time over recent jobs in milliseconds,
+        and their search speed in nodes per second.
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            searchTimes = list(self.searchTimes)
+            searchNodes = sum(self.searchNodes)
+            stats = {
+                'queueDepth': len(self.jobs),
+                'maxQueue': self.maxQueue,
+                'completed': self.completed,
+                'cancelled': self.cancelled,
+                'rejected': self.rejected,
+                'failed': self.failed,
+            }
+        if latencies:
+            stats['latencyMs'] = {
+                'mean': 1000 * sum(latencies) / len(latencies),
+                'p50': 1000 * latencies[len(latencies) // 2],
+                'p95': 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'max': 1000 * latencies[-1],
+            }
+            stats['searchMs'] = {'mean': 1000 * sum(searchTimes) / len(searchTimes)}
+            stats['nps'] = searchNodes / sum(searchTimes) if sum(searchTimes) > 0 else 0.0
+        if self.pondersStarted:
+            saved = list(self.ponderSavedSeconds)
+            resolved = self.ponderHits + self.ponderMisses
+            stats['ponder'] = {
+                'started': self.pondersStarted,
+                'hits': self.ponderHits,
+                'misses': self.ponderMisses,
+                'hitRate': self.ponderHits / resolved if resolved else 0.0,
+                'preempted': self.pondersPreempted,
+                'savedMs': {'mean': 1000 * sum(saved) / len(saved) if saved else 0.0, 'total': 1000 * sum(saved)},
+            }
+        return stats
+
+    def shutdown(self) -> None:
+        """Stop the worker processes, dropping queued searches and stopping running ones."""
+        for gameId in list(self.jobs):
+            self.cancel(gameId)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.manager is not None:
+            if self.infoQueue is not None:
+                self.infoQueue.put(None)
+            self.manager.shutdown()
+
+    def _start(self, gameId: str, fen: str, depth: Optional[int], timeLimit: Optional[int],
+               onResult: Optional[Callable[[SearchResult], None]], pondering: bool) -> None:
+        """Queue a search job for a game. Raises AIQueueFull if the queue is at capacity."""
+        with self.lock:
+            if len(self.jobs) >= self.maxQueue:
+                if not pondering:
+                    self.rejected += 1
+                raise AIQueueFull(f"{len(self.jobs)} AI searches pending")
+            stopEvent = self.manager.Event() if self.manager is not None else None
+            future = self.executor.submit(searchPosition, fen, depth, timeLimit, gameId, self.infoQueue, stopEvent, pondering)
+            job = _Job(gameId, future, time.perf_counter(), fen, stopEvent, onResult, pondering)
+            self.jobs[gameId] = job
+        future.add_done_callback(lambda done: self._finish(job))
+
+    def _finish(self, job: _Job) -> None:
+        with self.lock:
+            if job.timer is not None:
+                job.timer.cancel()
+            if job.cancelled:
+                return
+            try:
+                result = job.future.result()
+            except CancelledError:
+                return
+            except Exception:
+                self.failed += 1
+                if self.jobs.get(job.gameId) is job:
+                    del self.jobs[job.gameId]
+                if job.pondering:
+                    # Nothing was promised yet, so the move will simply be searched afresh.
+                    return
+                # A crashed worker still answers with no move, so the game does not wait forever.
+                result = SearchResult(None, 0.0, 0, 0, 0.0)
+            else:
+                if job.pondering:
+                    # Kept for ponderHit; the job stays registered so a new search of the game still cancels it.
+                    job.result = result
+                    return
+                self._complete(job, result)
+        job.onResult(result)
+
+    def _complete(self, job: _Job, result: SearchResult) -> None:
+        """Unregister a job that finished and count its result. Called with the lock held."""
+        if self.jobs.get(job.gameId) is job:
+            del self.jobs[job.gameId]
+        self.completed += 1
+        self.latencies.append(time.perf_counter() - job.submitted)
+        self.searchTimes.append(result.searchSeconds)
+        self.searchNodes.append(result.nodes)
+
+    def _forwardInfo(self, onInfo: Callable[[str, Dict[str, Any]], None]) -> None:
+        """Hand iteration reports from the workers to onInfo until shutdown."""
+        while True:
+            try:
+                report = self.infoQueue.get()
+            except (EOFError, OSError):
+                return
+            if report is None:
+                return
+            onInfo(*report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that searches for moves are not held up by ponder searches of idle games.")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="worker processes")
+    parser.add_argument("-t", "--time", type=int, default=500, help="time limit of each search in milliseconds")
+    args = parser.parse_args()
+
+    pool = AIWorkerPool(args.workers, ponder=True)
+    fen = "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"
+    try:
+        # Warm up every worker, so process start-up is not counted against the search.
+        for i in range(args.workers):
+            done = threading.Event()
+            pool.submit(f"warmup{i}", fen, 1, None, lambda result, done=done: done.set())
+            done.wait()
+        # One game more than there are workers ponders, as if its player had left the tab open.
+        started = sum(pool.ponder(f"idle{i}", fen, None, args.time) for i in range(args.workers + 1))
+        time.sleep(1)
+        done = threading.Event()
+        start = time.perf_counter()
+        pool.submit("active", fen, None, args.time, lambda result: done.set())
+        answered = done.wait(10 * args.time / 1000)
+        elapsed = 1000 * (time.perf_counter() - start)
+        print(f"{started} of {args.workers + 1} ponder searches started; search for a move "
+              f"{'answered' if answered else 'not answered'} in {elapsed:.0f} ms with a {args.time} ms limit; "
+              f"ponder statistics {pool.statistics().get('ponder')}")
+    finally:
+        pool.shutdown()
@@ -0,0 +1,108 @@
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+MAX_ENTRIES: int = 200000  # analysed positions kept on disk before the least recently used are evicted
+EVICT_FRACTION: float = 0.1  # share of the entries dropped at once when the cap is exceeded
+
+
+class CachedAnalysis(NamedTuple):
+    """A stored search result: best move in coordinate notation, score for the side to move and search depth."""
+    move: str
+    score: float
+    depth: int
+
+
+def _signedKey(key: int) -> int:
+    """Map an unsigned 64-bit Zobrist key into SQLite's signed 64-bit INTEGER range."""
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class AnalysisCache:
+    """
+    Disk-backed cache of search results keyed by Zobrist key and depth, kept in an SQLite file
+    so analysis survives server restarts and is shared by all games.
+    A lookup for depth d is answered by the deepest stored search of at least depth d.
+    Beyond maxEntries the least recently used entries are evicted.
+    Results depend on the evaluation weights and search settings, so the file records the version they were
+    stored under (see smartMoveFinder.settingsVersion); opening it with another version clears it.
+    """
+
+    def __init__(self, path: str, maxEntries: int = MAX_ENTRIES, version: Optional[str] = None):
+        self.path: str = path
+        self.maxEntries: int = maxEntries
+        self.version: Optional[str] = version
+        self.lock = threading.Lock()
+        # One connection shared by the server threads, serialised by the lock.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS analysis ("
+            "key INTEGER NOT NULL, depth INTEGER NOT NULL, move TEXT NOT NULL, score REAL NOT NULL, "
+            "lastUsed REAL NOT NULL, PRIMARY KEY (key, depth))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS analysisLastUsed ON analysis (lastUsed)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        if version is not None:
+            stored = self.connection.execute("SELECT value FROM settings WHERE name = 'version'").fetchone()
+            if stored is None or stored[0] != version:
+                self.connection.execute("DELETE FROM analysis")
+                self.connection.execute("INSERT OR REPLACE INTO settings (name, value) VALUES ('version', ?)", (version,))
+        self.connection.commit()
+        self.entries: int = self.connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def lookup(self, key: int, depth: int) -> Optional[CachedAnalysis]:
+        """Return the deepest stored result for the position searched to at least depth, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT depth, move, score FROM analysis WHERE key = ? AND depth >= ? ORDER BY depth DESC LIMIT 1",
+                (_signedKey(key), depth)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE analysis SET lastUsed = ? WHERE key = ? AND depth = ?",
+                                    (time.time(), _signedKey(key), row[0]))
+            self.connection.commit()
+        return CachedAnalysis(row[1], row[2], row[0])
+
+    def store(self, key: int, depth: int, move: str, score: float) -> None:
+        """Record the result of a completed search, replacing an earlier one of the same position and depth."""
+        with self.lock:
+            exists = self.connection.execute("SELECT 1 FROM analysis WHERE key = ? AND depth = ?",
+                                             (_signedKey(key), depth)).fetchone() is not None
+            self.connection.execute(
+                "INSERT OR REPLACE INTO analysis (key, depth, move, score, lastUsed) VALUES (?, ?, ?, ?, ?)",
+                (_signedKey(key), depth, move, score, time.time()))
+            if not exists:
+                self.entries += 1
+            if self.entries > self.maxEntries:
+                self._evict()
+            self.connection.commit()
+
+    def statistics(self) -> dict:
+        """Entry count, cap, settings version, and hits and misses since the server started."""
+        lookups = self.hits + self.misses
+        return {
+            'entries': self.entries,
+            'version': self.version,
+            'maxEntries': self.maxEntries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        """Close the database file."""
+        with self.lock:
+            self.connection.close()
+
+    def _evict(self) -> None:
+        """Drop the least recently used entries down to below the cap. Caller holds the lock."""
+        excess = self.entries - self.maxEntries + int(self.maxEntries * EVICT_FRACTION)
+        self.connection.execute(
+            "DELETE FROM analysis WHERE rowid IN (SELECT rowid FROM analysis ORDER BY lastUsed LIMIT ?)", (excess,))
+        self.entries -= excess
@@ -1,21 +1,83 @@
 from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 import chessEngine, smartMoveFinder
+import aiWorkers
+import analysisCache
+import gameSessions
+import openingBook
+import os
+import threading
 import time
+from typing import Optional
 
 # Initialize Flask application and SocketIO for real-time communication
 app = Flask(__name__)
 socketio = SocketIO(app)
 
-playerOne: bool = True  # Indicates if player one is a human
-playerTwo: bool = False  # Indicates if player two is a human (for two-player mode)
-DEPTH: int = 2  # AI search depth
-game_state: chessEngine.GameState = chessEngine.GameState()  
-valid_moves: list[chessEngine.Move] = game_state.getValidMoves() 
-move_made: bool = False
-animate: bool = False
-game_over: bool = False
-ai_thinking: bool = False
+AI_RETRY_SECONDS: float = 0.5  # wait before resubmitting a search the full AI queue rejected
+ANALYSIS_CACHE_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analysis_cache.sqlite3')
+OPENING_BOOK_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.bin')  # built with openingBook.py
+EMIT_SEARCH_INFO: bool = True  # send the statistics of each AI search iteration to the game's players as 'searchInfo' events
+SEARCH_LOG_PATH: Optional[str] = os.environ.get('CHESS_SEARCH_LOG')  # JSON lines file the statistics are also appended to, if set
+PONDER: bool = True  # after each AI move, search the human's expected reply while they think (hit rate at /ai_stats)
+
+# AI searches run in worker processes, created on first use so worker processes importing this module do not start their own.
+ai_pool: Optional[aiWorkers.AIWorkerPool] = None
+ai_pool_lock: threading.Lock = threading.Lock()
+
+def get_ai_pool() -> aiWorkers.AIWorkerPool:
+    """Return the AI worker pool, starting it if needed."""
+    global ai_pool
+    with ai_pool_lock:
+        if ai_pool is None:
+            ai_pool = aiWorkers.AIWorkerPool(onInfo=forward_search_info if EMIT_SEARCH_INFO or SEARCH_LOG_PATH else None,
+                                             ponder=PONDER)
+        return ai_pool
+
+log_search_info = smartMoveFinder.searchInfoLogger(SEARCH_LOG_PATH) if SEARCH_LOG_PATH else None
+
+def forward_search_info(game_id: str, info: dict) -> None:
+    """Pass the statistics of a completed AI search iteration to the game's room and the search log."""
+    if EMIT_SEARCH_INFO:
+        socketio.emit('searchInfo', info, to=game_id)
+    if log_search_info is not None:
+        log_search_info(dict(info, gameId=game_id))
+
+# Search results of all games, on disk so they outlive the server. Opened on first use like the pool.
+analysis_cache: Optional[analysisCache.AnalysisCache] = None
+
+def get_analysis_cache() -> analysisCache.AnalysisCache:
+    """Return the analysis cache, opening its file if needed."""
+    global analysis_cache
+    with ai_pool_lock:
+        if analysis_cache is None:
+            # The AI workers import smartMoveFinder with the same weights file, so its version is theirs too.
+            analysis_cache = analysisCache.AnalysisCache(ANALYSIS_CACHE_PATH, version=smartMoveFinder.settingsVersion())
+        return analysis_cache
+
+# Opening book, if OPENING_BOOK_PATH exists. Opened on first use.
+opening_book: Optional[openingBook.OpeningBook] = None
+opening_book_checked: bool = False
+
+def get_opening_book() -> Optional[openingBook.OpeningBook]:
+    """Return the opening book, or None if there is no book file."""
+    global opening_book, opening_book_checked
+    with ai_pool_lock:
+        if not opening_book_checked:
+            opening_book_checked = True
+            if os.path.exists(OPENING_BOOK_PATH):
+                opening_book = openingBook.OpeningBook(OPENING_BOOK_PATH)
+        return opening_book
+
+def cancel_ai_search(game_id: str) -> None:
+    """Cancel the AI search of a game, if one is running."""
+    if ai_pool is not None:
+        ai_pool.cancel(game_id)
+
+# Every game lives in its own session, keyed by a game ID that is also its Socket.IO room.
+# Searches of evicted games are cancelled so they do not occupy workers.
+games: gameSessions.GameRegistry = gameSessions.GameRegistry(onRemove=cancel_ai_search)
+socket_games: dict[str, str] = {}  # Socket.IO session ID -> game ID of the connected client
 
 @app.route('/')
 def menu() -> str:
@@ -25,41 +87,73 @@ def menu() -> str:
 @app.route('/start_game', methods=['POST'])
 def start_game() -> jsonify:
     """
-    Start a new game with specified settings.
-    Resets the game state and updates player modes and AI depth.
+    Start a new game with specified settings and return its game ID.
+    Sets the player modes, AI depth and AI time budget of the new game.
+    With 'timeLimit' (milliseconds per move) the AI deepens until the budget runs out, capped at 'depth' if both are given.
     """
-    global playerOne, playerTwo, DEPTH, game_state, valid_moves, move_made, animate, game_over
     data = request.json
-    playerOne = data['playerOne']
-    playerTwo = data['playerTwo']
-    DEPTH = data['depth']
-
+    depth = data.get('depth')
+    time_limit = data.get('timeLimit')
+    if depth is None and time_limit is None:
+        return jsonify(success=False, error="depth or timeLimit is required"), 400
 
-    game_state = chessEngine.GameState()
-    valid_moves = game_state.getValidMoves()
-    move_made = False
-    animate = False
-    game_over = False
-    return jsonify(success=True)
+    session = games.create(data['playerOne'], data['playerTwo'], depth, time_limit)
+    return jsonify(success=True, gameId=session.gameId)
 
 @app.route('/game')
 def game() -> str:
     """Render the game board."""
     return render_template('index.html')
 
+@app.route('/ai_stats')
+def ai_stats() -> jsonify:
+    """Return the AI queue depth, job counters, per-job latency and pondering statistics, and the analysis cache hit rate."""
+    stats = ai_pool.statistics() if ai_pool is not None else {'queueDepth': 0}
+    if analysis_cache is not None:
+        stats['analysisCache'] = analysis_cache.statistics()
+    return jsonify(stats)
+
 @socketio.on('connect')
 def handle_connect() -> None:
     """
     Handle a new connection to the server.
-    Emit the initial board state and player information to the client.
+    Join the room of the game named in the connection query and emit its board state and player information.
+    Restart the AI if it is its turn and its search was cancelled when the last client left.
     """
-    global game_state
+    session = games.get(request.args.get('gameId'))
+    if session is None:
+        emit('gameNotFound', {})
+        return
+    socket_games[request.sid] = session.gameId
+    join_room(session.gameId)
     emit('initialBoard', {
-        'board': game_state.board,
-        'whiteToMove': game_state.whiteToMove,
-        'playerOne': playerOne,
-        'playerTwo': playerTwo
+        'board': session.game_state.board,
+        'whiteToMove': session.game_state.whiteToMove,
+        'playerOne': session.playerOne,
+        'playerTwo': session.playerTwo
     })
+    if is_ai_turn(session) and not session.game_over and not session.ai_thinking:
+        start_ai_move(session)
+
+@socketio.on('disconnect')
+def handle_disconnect() -> None:
+    """
+    Forget which game the client was in. The game itself stays until it expires.
+    When the last client of a game leaves, its AI search is cancelled.
+    """
+    game_id = socket_games.pop(request.sid, None)
+    if game_id is not None and game_id not in socket_games.values():
+        cancel_ai_search(game_id)
+        session = games.get(game_id)
+        if session is not None:
+            session.ai_thinking = False
+
+def current_session() -> Optional[gameSessions.GameSession]:
+    """Return the game of the client sending the current event, or None if it has none or it was evicted."""
+    session = games.get(socket_games.get(request.sid))
+    if session is None:
+        emit('gameNotFound', {})
+    return session
 
 @socketio.on('getValidMoves')
 def handle_get_valid_moves(data: dict) -> None:
@@ -67,7 +161,10 @@ def handle_get_valid_moves(data: dict) -> None:
     Handle request for valid moves for a selected piece.
     Emit valid moves to the client.
     """
-    global valid_moves, game_state
+    session = current_session()
+    if session is None:
+        return
+    game_state = session.game_state
     row: int = data['row']
     col: int = data['col']
     piece_color: str = 'w' if game_state.whiteToMove else 'b'
@@ -76,7 +173,7 @@ def handle_get_valid_moves(data: dict) -> None:
     if piece.startswith(piece_color):
         moves = [
             (move.endRow, move.endColumn)
-            for move in valid_moves
+            for move in session.valid_moves
             if move.startRow == row and move.startColumn == col
         ]
         emit('validMoves', {'moves': moves})
@@ -87,17 +184,20 @@ def handle_make_move(data: dict) -> None:
     Handle a move made by the player.
     Validate the move and update the game state, then emit the updated board state.
     """
-    global game_state, valid_moves, move_made, animate, game_over, ai_thinking
+    session = current_session()
+    if session is None:
+        return
+    game_state = session.game_state
 
     move = chessEngine.Move(data['startSquare'], data['endSquare'], game_state.board)
     
-    for valid_move in valid_moves:
+    for valid_move in session.valid_moves:
         if move == valid_move:
             is_capture: bool = game_state.board[valid_move.endRow][valid_move.endColumn] != '--' or valid_move.isEnpassantMove
             game_state.makeMove(valid_move)
-            move_made = True
-            animate = True
-            valid_moves = game_state.getValidMoves()
+            session.move_made = True
+            session.animate = True
+            session.valid_moves = game_state.getValidMoves()
             is_promotion: bool = valid_move.isPawnPromotion
             in_check: bool = game_state.inCheck
             checkmate: bool = game_state.checkmate
@@ -117,37 +217,95 @@ def handle_make_move(data: dict) -> None:
                     'checkmate': checkmate,
                     'stalemate': stalemate
                 }
-            })
-            check_game_over_conditions()
+            }, to=session.gameId)
+            check_game_over_conditions(session)
             break
 
     # Initiate AI move if it's AI's turn in one-player mode
-    if move_made and not game_state.whiteToMove and playerOne and not playerTwo and not ai_thinking:
-        ai_thinking = True
-        socketio.emit('aiThinking', {'thinking': True})
-        socketio.start_background_task(delayed_ai_move)
+    if session.move_made and is_ai_turn(session) and not session.ai_thinking:
+        start_ai_move(session)
 
-def delayed_ai_move() -> None:
-    """Introduce a delay before the AI calculates its move, that way the animation can finish."""
+def is_ai_turn(session: gameSessions.GameSession) -> bool:
+    """Return True if the AI is to move, i.e. black in one-player mode."""
+    return not session.game_state.whiteToMove and session.playerOne and not session.playerTwo
+
+def start_ai_move(session: gameSessions.GameSession) -> None:
+    """Tell the game's room the AI is thinking and start its search in the background."""
+    session.ai_thinking = True
+    socketio.emit('aiThinking', {'thinking': True}, to=session.gameId)
+    socketio.start_background_task(delayed_ai_move, session)
+
+def delayed_ai_move(session: gameSessions.GameSession) -> None:
+    """
+    Introduce a delay before the AI calculates its move, that way the animation can finish.
+    While the AI queue is full, keep waiting and resubmitting, unless the search is cancelled meanwhile.
+    """
     time.sleep(0.3)
-    handle_ai_move()
+    while session.ai_thinking and not handle_ai_move(session):
+        time.sleep(AI_RETRY_SECONDS)
 
-def handle_ai_move() -> None:
+def handle_ai_move(session: gameSessions.GameSession) -> bool:
     """
-    Calculate and make the AI's move.
-    Update the game state and emit the updated board state.
+    Submit the AI's search for a game to the worker pool. The move is made by apply_ai_move when the result arrives.
+    If the game's ponder search guessed the human's move, it becomes the search for the move. Otherwise the opening
+    book is consulted first, then for a fixed-depth search the analysis cache, and completed searches are written
+    back to the cache.
+    Returns False if the queue is full and the search must be submitted again later.
     """
-    global game_state, valid_moves, move_made, animate, ai_thinking
-    ai_move = smartMoveFinder.findBestMove(game_state, valid_moves, DEPTH)
-    
+    game_state = session.game_state
+    position_key = game_state.zobristKey
+
+    def on_result(result: aiWorkers.SearchResult) -> None:
+        if result.move is not None and result.depth > 0:
+            cache.store(position_key, result.depth, result.move, result.score)
+        # Drop results for a position that is no longer on the board, e.g. after the game was abandoned and reloaded.
+        if session.ai_thinking and game_state.zobristKey == position_key:
+            apply_ai_move(session, result.move, expected_reply(result))
+
+    cache = get_analysis_cache()
+    fen = game_state.boardToFEN()
+    if ai_pool is not None and ai_pool.ponderHit(session.gameId, fen, session.timeLimit, on_result):
+        return True
+    book = get_opening_book()
+    if book is not None:
+        book_move = book.chooseMove(game_state, session.valid_moves)
+        if book_move is not None:
+            apply_ai_move(session, book_move.getChessNotation())
+            return True
+    if session.timeLimit is None:
+        cached = cache.lookup(position_key, session.depth)
+        if cached is not None:
+            apply_ai_move(session, cached.move)
+            return True
+
+    try:
+        get_ai_pool().submit(session.gameId, fen, session.depth, session.timeLimit, on_result)
+    except aiWorkers.AIQueueFull:
+        return False
+    return True
+
+def expected_reply(result: aiWorkers.SearchResult) -> Optional[str]:
+    """Return the reply to the AI's move its search expects, the second move of its principal variation, if known."""
+    pv = result.info.get('pv', []) if result.info else []
+    return pv[1] if len(pv) > 1 and pv[0] == result.move else None
+
+def apply_ai_move(session: gameSessions.GameSession, move_text: Optional[str], ponder_move: Optional[str] = None) -> None:
+    """
+    Make the AI's move, given in coordinate notation, for a game.
+    Update the game state and emit the updated board state to the game's room.
+    With PONDER, start searching the position after ponder_move, the human's expected reply, if one is given.
+    """
+    game_state = session.game_state
+    valid_moves = session.valid_moves
+    ai_move = next((move for move in valid_moves if move.getChessNotation() == move_text), None)
     if ai_move is None:
         ai_move = smartMoveFinder.findRandomMove(valid_moves)
-    
+
     is_capture: bool = game_state.board[ai_move.endRow][ai_move.endColumn] != '--' or ai_move.isEnpassantMove
     game_state.makeMove(ai_move)
-    move_made = True
-    animate = True
-    valid_moves = game_state.getValidMoves()
+    session.move_made = True
+    session.animate = True
+    session.valid_moves = game_state.getValidMoves()
 
     is_promotion: bool = ai_move.isPawnPromotion
     in_check: bool = game_state.inCheck
@@ -168,20 +326,41 @@ def handle_ai_move() -> None:
             'checkmate': checkmate,
             'stalemate': stalemate
         }
-    })
-    check_game_over_conditions()
-    socketio.emit('aiThinking', {'thinking': False})
-    ai_thinking = False
+    }, to=session.gameId)
+    check_game_over_conditions(session)
+    # Worked out while the human still cannot move, as their move may come as soon as ai_thinking is cleared.
+    ponder_fen = position_after(game_state, ponder_move) if PONDER and ponder_move is not None and not session.game_over else None
+    socketio.emit('aiThinking', {'thinking': False}, to=session.gameId)
+    session.ai_thinking = False
+    if ponder_fen is not None:
+        # Search the position after the human's expected reply while they think. handle_ai_move uses the search
+        # if the human plays that move; any other move, or the game ending, cancels it.
+        get_ai_pool().ponder(session.gameId, ponder_fen, session.depth, session.timeLimit)
+
+def position_after(game_state: chessEngine.GameState, move_text: str) -> Optional[str]:
+    """
+    Return the FEN of the position after a move given in coordinate notation, or None if it is not legal.
+    The move is made on a copy, so the game's own state and logs are never changed.
+    """
+    copy = chessEngine.GameState.fromFEN(game_state.boardToFEN())
+    move = next((move for move in copy.getValidMoves() if move.getChessNotation() == move_text), None)
+    if move is None:
+        return None
+    copy.makeMove(move)
+    return copy.boardToFEN()
 
-def check_game_over_conditions() -> None:
-    global game_state, game_over
+def check_game_over_conditions(session: gameSessions.GameSession) -> None:
+    game_state = session.game_state
     if game_state.checkmate:
-        game_over = True
+        session.game_over = True
         winner = "White" if not game_state.whiteToMove else "Black"
-        socketio.emit('gameOver', {'message': f'{winner} wins by checkmate'})
+        socketio.emit('gameOver', {'message': f'{winner} wins by checkmate'}, to=session.gameId)
     elif game_state.stalemate:
-        game_over = True
-        socketio.emit('gameOver', {'message': 'Draw by stalemate'})
+        session.game_over = True
+        socketio.emit('gameOver', {'message': 'Draw by stalemate'}, to=session.gameId)
+    if session.game_over:
+        # Stops a ponder search of a reply the human no longer has to make.
+        cancel_ai_search(session.gameId)
 
 # Start the Flask app with SocketIO support in debug mode
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+import argparse
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import chessEngine, smartMoveFinder
+
+# Piece codes of the packed boards: 0 is an empty square, then the white and the black pieces.
+PIECES: Tuple[str, ...] = ("--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+PIECE_CODES: Dict[str, int] = {piece: code for code, piece in enumerate(PIECES)}
+SQUARES: np.ndarray = np.arange(64)
+
+# Board squares are packed from the two characters of their names, e.g. "wN", so whole boards are translated at once:
+# characterCodes[color character, piece character] is the code of a square.
+characterCodes: np.ndarray = np.zeros((128, 128), dtype=np.int8)
+for _piece, _code in PIECE_CODES.items():
+    characterCodes[ord(_piece[0]), ord(_piece[1])] = _code
+_fenCodes: Dict[str, str] = {"P": "wp", "N": "wN", "B": "wB", "R": "wR", "Q": "wQ", "K": "wK",
+                             "p": "bp", "n": "bN", "b": "bB", "r": "bR", "q": "bQ", "k": "bK"}
+
+# Value tables built by valueTable, by the id of the per-piece values they were built from.
+_valueTables: Dict[int, Tuple[Dict[str, List[float]], np.ndarray]] = {}
+
+
+# Function to pack boards (GameState.board lists) into an (N, 64) int8 array of piece codes, index row * 8 + column.
+def packBoards(boards: Sequence[List[List[str]]]) -> np.ndarray:
+    if not boards:
+        return np.zeros((0, 64), dtype=np.int8)
+    text: bytes = "".join(square for board in boards for row in board for square in row).encode("ascii")
+    characters: np.ndarray = np.frombuffer(text, dtype=np.uint8).reshape(len(boards), 64, 2)
+    return characterCodes[characters[:, :, 0], characters[:, :, 1]]
+
+
+# Function to pack the piece placements of FEN strings, without building a GameState for each.
+# Returns the (N, 64) int8 piece codes and whether white is to move in each position.
+def packFENs(fens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    boards: List[List[Tuple[str, ...]]] = []
+    whiteToMove: List[bool] = []
+    for fen in fens:
+        fields: List[str] = fen.split()
+        ranks: List[str] = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError(f"Invalid FEN piece placement: {fields[0]}")
+        boards.append([chessEngine.fenRanks[rank] for rank in ranks])
+        whiteToMove.append(len(fields) < 2 or fields[1] == "w")
+    return packBoards(boards), np.array(whiteToMove, dtype=bool)
+
+
+# Function to turn per-piece square values (see smartMoveFinder.buildPieceSquareValues) into a (13, 64) array
+# indexed by piece code and square, with zeros for empty squares. Cached while the values dict is alive.
+def valueTable(pieceSquareValues: Optional[Dict[str, List[float]]] = None) -> np.ndarray:
+    if pieceSquareValues is None:
+        pieceSquareValues = smartMoveFinder.pieceSquareValues
+    cached = _valueTables.get(id(pieceSquareValues))
+    if cached is not None and cached[0] is pieceSquareValues:
+        return cached[1]
+    table: np.ndarray = np.zeros((len(PIECES), 64))
+    for piece, code in PIECE_CODES.items():
+        if piece in pieceSquareValues:
+            table[code] = pieceSquareValues[piece]
+    _valueTables[id(pieceSquareValues)] = (pieceSquareValues, table)
+    return table
+
+
+# Function to score packed boards the way smartMoveFinder.scoreBoardFull does, material plus position, white positive.
+# Results agree with it up to floating point rounding, as the values are summed in a different order.
+def evaluateBatch(codes: np.ndarray, pieceSquareValues: Optional[Dict[str, List[float]]] = None) -> np.ndarray:
+    return valueTable(pieceSquareValues)[codes, SQUARES].sum(axis=1)
+
+
+# Function to score game states the way smartMoveFinder.scoreBoard does, checkmate and stalemate included.
+def scoreBoards(gamestates: Sequence[chessEngine.GameState]) -> np.ndarray:
+    scores: np.ndarray = evaluateBatch(packBoards([gamestate.board for gamestate in gamestates]))
+    checkmate: np.ndarray = np.array([gamestate.checkmate for gamestate in gamestates], dtype=bool)
+    stalemate: np.ndarray = np.array([gamestate.stalemate for gamestate in gamestates], dtype=bool)
+    whiteToMove: np.ndarray = np.array([gamestate.whiteToMove for gamestate in gamestates], dtype=bool)
+    scores[stalemate] = smartMoveFinder.STALEMATE
+    scores[checkmate] = np.where(whiteToMove[checkmate], -smartMoveFinder.CHECKMATE, smartMoveFinder.CHECKMATE)
+    return scores
+
+
+# Function to collect the boards of random games, as sample positions for the benchmark.
+def randomBoards(count: int, seed: int = 0) -> List[List[List[str]]]:
+    rng: random.Random = random.Random(seed)
+    boards: List[List[List[str]]] = []
+    while len(boards) < count:
+        gamestate: chessEngine.GameState = chessEngine.GameState()
+        for _ in range(rng.randint(10, 120)):
+            validMoves: List[chessEngine.Move] = gamestate.getValidMoves()
+            if not validMoves:
+                break
+            gamestate.makeMove(rng.choice(validMoves))
+        boards.append([row[:] for row in gamestate.board])
+    return boards
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the batch evaluator with scoreBoardFull on positions from random games.")
+    parser.add_argument("-n", "--positions", type=int, default=2000, help="distinct positions to sample and check")
+    parser.add_argument("--batch", type=int, default=1000000, help="positions per batch when timing the batch evaluator")
+    args = parser.parse_args()
+
+    sample = randomBoards(args.positions)
+    gamestate = chessEngine.GameState()
+    start = time.perf_counter()
+    expected = []
+    for board in sample:
+        gamestate.board = board
+        expected.append(smartMoveFinder.scoreBoardFull(gamestate))
+    loopSeconds = (time.perf_counter() - start) / len(sample)
+    packed = packBoards(sample)
+    difference = float(np.max(np.abs(evaluateBatch(packed) - np.array(expected))))
+    print(f"{len(sample)} positions, largest difference from scoreBoardFull {difference:.3g}")
+
+    batch = np.resize(packed, (args.batch, 64))
+    start = time.perf_counter()
+    evaluateBatch(batch)
+    batchSeconds = (time.perf_counter() - start) / args.batch
+    start = time.perf_counter()
+    packBoards(sample)
+    packSeconds = (time.perf_counter() - start) / len(sample)
+    print(f"scoreBoardFull {1e6 * loopSeconds:.2f} us/position, batch {1e6 * batchSeconds:.3f} us/position "
+          f"({loopSeconds / batchSeconds:.0f}x), packing {1e6 * packSeconds:.2f} us/position")
@@ -0,0 +1,303 @@
+from typing import Dict, Iterator, List, Tuple
+
+# Bitboard backend for GameState move generation.
+# Squares are indexed as row * 8 + column, so bit 0 is a8 and bit 63 is h1, matching the layout of GameState.board.
+
+pieceNames: Tuple[str, ...] = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+pieceIndex: Dict[str, int] = {name: i for i, name in enumerate(pieceNames)}
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 0, 1, 2, 3, 4, 5
+WHITE, BLACK = 0, 6
+
+# Flags stored in the top bits of an encoded move.
+NORMAL: int = 0
+ENPASSANT: int = 1
+CASTLE: int = 2
+
+
+# Function to pack a move into a single int: from square, to square and flag.
+def encodeMove(startSq: int, endSq: int, flag: int = NORMAL) -> int:
+    return startSq | (endSq << 6) | (flag << 12)
+
+
+# Function to unpack a move created by encodeMove.
+def decodeMove(move: int) -> Tuple[int, int, int]:
+    return move & 63, (move >> 6) & 63, move >> 12
+
+
+# Function to iterate over the square indexes of the set bits of a bitboard.
+def squares(bb: int) -> Iterator[int]:
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+# Function to build a table of attacks for a piece that moves by fixed steps.
+def _stepAttacks(steps: Tuple[Tuple[int, int], ...]) -> List[int]:
+    table: List[int] = []
+    for sq in range(64):
+        row, column = divmod(sq, 8)
+        bb = 0
+        for dr, dc in steps:
+            r, c = row + dr, column + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                bb |= 1 << (r * 8 + c)
+        table.append(bb)
+    return table
+
+
+knightAttacks: List[int] = _stepAttacks(((1, 2), (-1, 2), (1, -2), (-1, -2), (2, 1), (-2, 1), (2, -1), (-2, -1)))
+kingAttacks: List[int] = _stepAttacks(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# Squares attacked by a pawn of each color standing on a square; white pawns move towards row 0.
+pawnAttacks: Tuple[List[int], List[int]] = (_stepAttacks(((-1, -1), (-1, 1))), _stepAttacks(((1, -1), (1, 1))))
+
+
+# Function to list the squares along a ray from a square, nearest first.
+def _path(sq: int, dr: int, dc: int) -> List[int]:
+    row, column = divmod(sq, 8)
+    path: List[int] = []
+    r, c = row + dr, column + dc
+    while 0 <= r < 8 and 0 <= c < 8:
+        path.append(r * 8 + c)
+        r, c = r + dr, c + dc
+    return path
+
+
+# Function to get the squares a slider on sq reaches along one ray, stopping after the first occupied square.
+def _ray(sq: int, dr: int, dc: int, occupancy: int) -> int:
+    bb = 0
+    for target in _path(sq, dr, dc):
+        bb |= 1 << target
+        if occupancy & (1 << target):
+            break
+    return bb
+
+
+# Function to build the sliding attack tables for one line direction (rank, file, diagonal or anti-diagonal).
+# Like kindergarten bitboards, each line only depends on the occupancy of its inner squares, so the table for a
+# square is a dict from that masked occupancy to the attack set and a lookup is a single AND plus a dict hit.
+def _lineTables(dr: int, dc: int) -> Tuple[List[int], List[Dict[int, int]]]:
+    masks: List[int] = []
+    tables: List[Dict[int, int]] = []
+    for sq in range(64):
+        # The last square of each ray never blocks anything beyond itself, so it is left out of the mask.
+        inner = 0
+        for target in _path(sq, dr, dc)[:-1] + _path(sq, -dr, -dc)[:-1]:
+            inner |= 1 << target
+        table: Dict[int, int] = {}
+        subset = 0
+        while True:
+            table[subset] = _ray(sq, dr, dc, subset) | _ray(sq, -dr, -dc, subset)
+            subset = (subset - inner) & inner
+            if subset == 0:
+                break
+        masks.append(inner)
+        tables.append(table)
+    return masks, tables
+
+
+rankMasks, rankTables = _lineTables(0, 1)
+fileMasks, fileTables = _lineTables(1, 0)
+diagonalMasks, diagonalTables = _lineTables(1, 1)
+antiDiagonalMasks, antiDiagonalTables = _lineTables(1, -1)
+
+
+# Function to get the squares a rook on sq attacks given the board occupancy.
+def rookAttacks(sq: int, occupancy: int) -> int:
+    return rankTables[sq][occupancy & rankMasks[sq]] | fileTables[sq][occupancy & fileMasks[sq]]
+
+
+# Function to get the squares a bishop on sq attacks given the board occupancy.
+def bishopAttacks(sq: int, occupancy: int) -> int:
+    return diagonalTables[sq][occupancy & diagonalMasks[sq]] | antiDiagonalTables[sq][occupancy & antiDiagonalMasks[sq]]
+
+
+# Table of the squares strictly between two squares on a shared line, 0 when they are not aligned.
+def _betweenTable() -> List[List[int]]:
+    table: List[List[int]] = [[0] * 64 for _ in range(64)]
+    directions = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+    for sq in range(64):
+        row, column = divmod(sq, 8)
+        for dr, dc in directions:
+            bb = 0
+            r, c = row + dr, column + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                table[sq][r * 8 + c] = bb
+                bb |= 1 << (r * 8 + c)
+                r, c = r + dr, c + dc
+    return table
+
+
+betweenMasks: List[List[int]] = _betweenTable()
+
+# Rows a pawn of each color promotes on.
+promotionRows: Tuple[int, int] = (0xFF, 0xFF << 56)
+
+# Rook start and end squares of a castling move, keyed by the king's destination square.
+castleRookSquares: Dict[int, Tuple[int, int]] = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+
+
+# Class holding the twelve piece bitboards of a position and generating legal moves from them.
+class BitboardPosition:
+    def __init__(self, board: List[List[str]]):
+        self.pieces: List[int] = [0] * 12
+        self.occupancy: List[int] = [0, 0]
+        for row in range(8):
+            for column in range(8):
+                square = board[row][column]
+                if square != "--":
+                    self.togglePiece(square, row * 8 + column)
+
+    # Method to add or remove a piece on a square (XOR, so the same call undoes itself).
+    def togglePiece(self, piece: str, sq: int) -> None:
+        bit = 1 << sq
+        self.pieces[pieceIndex[piece]] ^= bit
+        self.occupancy[0 if piece[0] == "w" else 1] ^= bit
+
+    # Method to apply or revert a Move. Every change is an XOR, so makeMove and undoMove share it.
+    def applyMove(self, move) -> None:
+        startSq = move.startRow * 8 + move.startColumn
+        endSq = move.endRow * 8 + move.endColumn
+        self.togglePiece(move.pieceMoved, startSq)
+        if move.isPawnPromotion:
+            self.togglePiece(move.pieceMoved[0] + "Q", endSq)
+        else:
+            self.togglePiece(move.pieceMoved, endSq)
+        if move.pieceCaptured != "--":
+            if move.isEnpassantMove:
+                self.togglePiece(move.pieceCaptured, move.startRow * 8 + move.endColumn)
+            else:
+                self.togglePiece(move.pieceCaptured, endSq)
+        if move.isCastleMove:
+            rookStart, rookEnd = castleRookSquares[endSq]
+            rook = move.pieceMoved[0] + "R"
+            self.togglePiece(rook, rookStart)
+            self.togglePiece(rook, rookEnd)
+
+    # Method to get the pieces of the given side that attack sq, for a given occupancy.
+    def attackersTo(self, sq: int, white: bool, occupancy: int) -> int:
+        p = self.pieces
+        base = WHITE if white else BLACK
+        # A white pawn attacks sq if a black pawn standing on sq would attack the pawn's square, and vice versa.
+        attackers = pawnAttacks[1 if white else 0][sq] & p[base + PAWN]
+        attackers |= knightAttacks[sq] & p[base + KNIGHT]
+        attackers |= kingAttacks[sq] & p[base + KING]
+        attackers |= bishopAttacks(sq, occupancy) & (p[base + BISHOP] | p[base + QUEEN])
+        attackers |= rookAttacks(sq, occupancy) & (p[base + ROOK] | p[base + QUEEN])
+        return attackers
+
+    # Method to determine if a square is attacked by the given side.
+    def isSquareAttacked(self, sq: int, white: bool) -> bool:
+        return self.attackersTo(sq, white, self.occupancy[0] | self.occupancy[1]) != 0
+
+    # Method to generate all legal moves as encoded ints. Returns (moves, inCheck).
+    # With capturesOnly, only captures and promotions are generated, and with quietOnly only the other moves,
+    # unless in check where all evasions are returned.
+    def generateLegalMoves(self, whiteToMove: bool, castleRights, enpassantPossible: Tuple[int, ...], capturesOnly: bool = False,
+                           quietOnly: bool = False) -> Tuple[List[int], bool]:
+        p = self.pieces
+        us = WHITE if whiteToMove else BLACK
+        them = BLACK if whiteToMove else WHITE
+        ourOccupancy = self.occupancy[0 if whiteToMove else 1]
+        theirOccupancy = self.occupancy[1 if whiteToMove else 0]
+        occupancy = ourOccupancy | theirOccupancy
+        kingSq = p[us + KING].bit_length() - 1
+        moves: List[int] = []
+
+        checkers = self.attackersTo(kingSq, not whiteToMove, occupancy)
+        inCheck = checkers != 0
+        capturesOnly = capturesOnly and not inCheck
+        quietOnly = quietOnly and not inCheck
+
+        # King moves, tested against the occupancy without the king so it cannot hide behind itself.
+        withoutKing = occupancy ^ (1 << kingSq)
+        for to in squares(kingAttacks[kingSq] & (theirOccupancy if capturesOnly else ~occupancy if quietOnly else ~ourOccupancy)):
+            if not self.attackersTo(to, not whiteToMove, withoutKing):
+                moves.append(kingSq | (to << 6))
+        if checkers & (checkers - 1):
+            return moves, inCheck
+
+        if inCheck:
+            checkerSq = checkers.bit_length() - 1
+            targetMask = betweenMasks[kingSq][checkerSq] | checkers
+        else:
+            targetMask = ~ourOccupancy
+            if not capturesOnly:
+                self._castleMoves(kingSq, whiteToMove, castleRights, occupancy, moves)
+
+        # Pinned pieces may only move along the line between the king and the pinner.
+        pinRays: Dict[int, int] = {}
+        snipers = rookAttacks(kingSq, 0) & (p[them + ROOK] | p[them + QUEEN])
+        snipers |= bishopAttacks(kingSq, 0) & (p[them + BISHOP] | p[them + QUEEN])
+        for sniperSq in squares(snipers):
+            blockers = betweenMasks[kingSq][sniperSq] & occupancy
+            if blockers and not (blockers & (blockers - 1)) and blockers & ourOccupancy:
+                pinRays[blockers.bit_length() - 1] = betweenMasks[kingSq][sniperSq] | (1 << sniperSq)
+
+        targetMask &= ~ourOccupancy
+        pieceMask = targetMask & theirOccupancy if capturesOnly else targetMask & ~occupancy if quietOnly else targetMask
+        for piece, attacks in ((KNIGHT, None), (BISHOP, bishopAttacks), (ROOK, rookAttacks), (QUEEN, None)):
+            for sq in squares(p[us + piece]):
+                if piece == KNIGHT:
+                    if sq in pinRays:
+                        continue
+                    targets = knightAttacks[sq]
+                elif piece == QUEEN:
+                    targets = rookAttacks(sq, occupancy) | bishopAttacks(sq, occupancy)
+                else:
+                    targets = attacks(sq, occupancy)
+                targets &= pieceMask
+                if sq in pinRays:
+                    targets &= pinRays[sq]
+                for to in squares(targets):
+                    moves.append(sq | (to << 6))
+
+        pushMask = promotionRows[0 if whiteToMove else 1] if capturesOnly else ~promotionRows[0 if whiteToMove else 1] if quietOnly else -1
+        self._pawnMoves(whiteToMove, kingSq, occupancy, theirOccupancy, targetMask, pushMask, pinRays, enpassantPossible, moves, not quietOnly)
+        return moves, inCheck
+
+    # Method to add the castling moves. Only called when the side to move is not in check.
+    def _castleMoves(self, kingSq: int, whiteToMove: bool, castleRights, occupancy: int, moves: List[int]) -> None:
+        kingSide = castleRights.wks if whiteToMove else castleRights.bks
+        queenSide = castleRights.wqs if whiteToMove else castleRights.bqs
+        if kingSide and not occupancy & (0b11 << (kingSq + 1)):
+            if not self.isSquareAttacked(kingSq + 1, not whiteToMove) and not self.isSquareAttacked(kingSq + 2, not whiteToMove):
+                moves.append(kingSq | ((kingSq + 2) << 6) | (CASTLE << 12))
+        if queenSide and not occupancy & (0b111 << (kingSq - 3)):
+            if not self.isSquareAttacked(kingSq - 1, not whiteToMove) and not self.isSquareAttacked(kingSq - 2, not whiteToMove):
+                moves.append(kingSq | ((kingSq - 2) << 6) | (CASTLE << 12))
+
+    # Method to add the pawn pushes (restricted to pushMask), and captures and en passant captures unless captures is False.
+    def _pawnMoves(self, whiteToMove: bool, kingSq: int, occupancy: int, theirOccupancy: int, targetMask: int, pushMask: int,
+                   pinRays: Dict[int, int], enpassantPossible: Tuple[int, ...], moves: List[int], captures: bool = True) -> None:
+        p = self.pieces
+        us = WHITE if whiteToMove else BLACK
+        them = BLACK if whiteToMove else WHITE
+        forward = -8 if whiteToMove else 8
+        startRow = 6 if whiteToMove else 1
+        attackTable = pawnAttacks[0 if whiteToMove else 1]
+        enpassantSq = enpassantPossible[0] * 8 + enpassantPossible[1] if enpassantPossible else -1
+        for sq in squares(p[us + PAWN]):
+            allowed = targetMask & pinRays.get(sq, -1)
+            to = sq + forward
+            if not occupancy & (1 << to):
+                if allowed & pushMask & (1 << to):
+                    moves.append(sq | (to << 6))
+                if sq >> 3 == startRow:
+                    to2 = to + forward
+                    if not occupancy & (1 << to2) and allowed & pushMask & (1 << to2):
+                        moves.append(sq | (to2 << 6))
+            if not captures:
+                continue
+            for to in squares(attackTable[sq] & theirOccupancy & allowed):
+                moves.append(sq | (to << 6))
+            if enpassantSq >= 0 and attackTable[sq] & (1 << enpassantSq):
+                # En passant removes two pieces from the board, so its legality is tested directly.
+                capturedSq = enpassantSq - forward
+                after = occupancy ^ (1 << sq) ^ (1 << capturedSq) ^ (1 << enpassantSq)
+                p[them + PAWN] ^= 1 << capturedSq
+                exposed = self.attackersTo(kingSq, not whiteToMove, after)
+                p[them + PAWN] ^= 1 << capturedSq
+                if not exposed:
+                    moves.append(sq | (enpassantSq << 6) | (ENPASSANT << 12))
@@ -1,9 +1,36 @@
-from typing import List, Tuple
+from typing import Dict, List, Optional, Set, Tuple
+import random
+import bitboardEngine
+
+# Zobrist keys: one random 64-bit number per (piece, square), for the side to move, for each of the 16 castling
+# rights combinations and for each en passant file. The generator is seeded so keys are identical in every process.
+_zobristRandom: random.Random = random.Random(0x5EED)
+zobristPieceKeys: Dict[str, List[int]] = {piece: [_zobristRandom.getrandbits(64) for _ in range(64)] for piece in bitboardEngine.pieceNames}
+zobristBlackToMoveKey: int = _zobristRandom.getrandbits(64)
+zobristCastleKeys: List[int] = [_zobristRandom.getrandbits(64) for _ in range(16)]
+zobristEnpassantKeys: List[int] = [_zobristRandom.getrandbits(64) for _ in range(8)]
+
+# Function to list, for every square as [row][column], the on-board squares at the given offsets.
+def offsetSquares(offsets: Tuple[Tuple[int, int], ...]) -> List[List[List[Tuple[int, int]]]]:
+    return [[[(row + dr, column + dc) for dr, dc in offsets if 0 <= row + dr < 8 and 0 <= column + dc < 8]
+             for column in range(8)] for row in range(8)]
+
+# Function to list, for every square as [row][column], the ray of squares in each direction, ordered outward.
+def raySquares(directions: Tuple[Tuple[int, int], ...]) -> List[List[List[List[Tuple[int, int]]]]]:
+    return [[[[(row + dr * i, column + dc * i) for i in range(1, 8) if 0 <= row + dr * i < 8 and 0 <= column + dc * i < 8]
+              for dr, dc in directions] for column in range(8)] for row in range(8)]
+
+# Squares seen from each square, used to scan outward from a square when testing whether it is attacked.
+knightSquares: List[List[List[Tuple[int, int]]]] = offsetSquares(((1, 2), (-1, 2), (1, -2), (-1, -2), (2, 1), (-2, 1), (2, -1), (-2, -1)))
+kingSquares: List[List[List[Tuple[int, int]]]] = offsetSquares(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+rookRays: List[List[List[List[Tuple[int, int]]]]] = raySquares(((-1, 0), (0, -1), (1, 0), (0, 1)))
+bishopRays: List[List[List[List[Tuple[int, int]]]]] = raySquares(((-1, -1), (-1, 1), (1, -1), (1, 1)))
 
 # Class to represent the current state of the chess game.
 # Also responsible for determining the valid moves at current state and keeps a move log.
+# The move generator is selected with backend: "mailbox" scans the 2D board, "bitboard" uses bitboardEngine.
 class GameState:
-    def __init__(self):
+    def __init__(self, backend: str = "mailbox"):
         # The board is represented by a 2D list where each element is a string indicating the piece or an empty square.
         self.board: List[List[str]] = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
@@ -46,32 +73,167 @@ class GameState:
         # List to keep track of the castling rights history.
         self.castleRightsLog: List[CastleRights] = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks, self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)]
 
+        # Halfmove clock (moves since the last capture or pawn move) with its history, and the fullmove number.
+        self.halfmoveClock: int = 0
+        self.halfmoveClockLog: List[int] = [self.halfmoveClock]
+        self.fullmoveNumber: int = 1
+
+        if backend not in ("mailbox", "bitboard"):
+            raise ValueError(f"Unknown move generator backend: {backend}")
+        self.backend: str = backend
+
+        # Piece bitboards kept in sync with the board by makeMove/undoMove when the bitboard backend is selected.
+        self.bitboards: Optional[bitboardEngine.BitboardPosition] = bitboardEngine.BitboardPosition(self.board) if backend == "bitboard" else None
+
+        # Number of pieces on the board, kings included, so the search can tell cheaply when tablebases apply.
+        self.pieceCount: int = 32
+
+        # Zobrist key of the current position, updated incrementally, and its history for undoMove.
+        self.zobristKey: int = self.computeZobristKey()
+        self.zobristKeyLog: List[int] = [self.zobristKey]
+        # Last attack map built by getAttackMap: ((zobristKey, byWhite), map).
+        self.attackMapCache: Optional[Tuple[Tuple[int, bool], List[List[bool]]]] = None
+        # Pins and checks found by getPinsAndChecks, by the length of zobristKeyLog: (zobristKey, (inCheck, pins, checks)).
+        self.pinsAndChecksCache: Dict[int, Tuple[int, Tuple[bool, List[Tuple[int, int, int, int]], List[Tuple[int, int, int, int]]]]] = {}
+
+        # Incremental evaluation, off until setEvaluation attaches per-piece square values (white positive).
+        self.pieceSquareValues: Optional[Dict[str, List[float]]] = None
+        self.evaluation: float = 0.0
+
+    # Method to attach per-piece square values and keep their sum over the board up to date in makeMove/undoMove.
+    def setEvaluation(self, pieceSquareValues: Dict[str, List[float]]) -> None:
+        self.pieceSquareValues = pieceSquareValues
+        self.evaluation = self.computeEvaluation()
+
+    # Method to compute the sum of the attached square values from scratch.
+    def computeEvaluation(self) -> float:
+        evaluation: float = 0.0
+        for row in range(8):
+            for column in range(8):
+                square: str = self.board[row][column]
+                if square != "--":
+                    evaluation += self.pieceSquareValues[square][row * 8 + column]
+        return evaluation
+
+    # Method to get the change in evaluation caused by a move, including promotion, en passant and the castling rook.
+    def evaluationDelta(self, move: 'Move') -> float:
+        values: Dict[str, List[float]] = self.pieceSquareValues
+        endSq: int = move.endRow * 8 + move.endColumn
+        placed: str = move.pieceMoved[0] + "Q" if move.isPawnPromotion else move.pieceMoved
+        delta: float = values[placed][endSq] - values[move.pieceMoved][move.startRow * 8 + move.startColumn]
+        if move.isEnpassantMove:
+            delta -= values[move.pieceCaptured][move.startRow * 8 + move.endColumn]
+        elif move.pieceCaptured != "--":
+            delta -= values[move.pieceCaptured][endSq]
+        if move.isCastleMove:
+            rookStart, rookEnd = bitboardEngine.castleRookSquares[endSq]
+            rook: str = move.pieceMoved[0] + "R"
+            delta += values[rook][rookEnd] - values[rook][rookStart]
+        return delta
+
+    # Method to compute the Zobrist key of the current position from scratch.
+    def computeZobristKey(self) -> int:
+        key: int = 0
+        for row in range(8):
+            for column in range(8):
+                square: str = self.board[row][column]
+                if square != "--":
+                    key ^= zobristPieceKeys[square][row * 8 + column]
+        if not self.whiteToMove:
+            key ^= zobristBlackToMoveKey
+        key ^= zobristCastleKeys[self.currentCastlingRights.index()]
+        if self.enpassantPossible:
+            key ^= zobristEnpassantKeys[self.enpassantPossible[1]]
+        return key
+
+    # Method to build a game state directly from a FEN string.
+    @classmethod
+    def fromFEN(cls, fen: str, backend: str = "mailbox") -> 'GameState':
+        gamestate: GameState = cls(backend)
+        gamestate.loadFEN(fen)
+        return gamestate
+
+    # Method to set up the position from a FEN string, including castling rights, en passant square and move clocks.
+    def loadFEN(self, fen: str) -> None:
+        fields: List[str] = fen.split()
+        if not 1 <= len(fields) <= 6:
+            raise ValueError(f"Invalid FEN: {fen}")
+        rankTexts: List[str] = fields[0].split("/")
+        if len(rankTexts) != 8:
+            raise ValueError(f"Invalid FEN piece placement: {fields[0]}")
+        self.board = [list(fenRanks[rankText]) for rankText in rankTexts]
+        side: str = fields[1] if len(fields) > 1 else "w"
+        if side not in ("w", "b"):
+            raise ValueError(f"Invalid FEN side to move: {side}")
+        self.whiteToMove = side == "w"
+        castling: str = fields[2] if len(fields) > 2 else "-"
+        if castling != "-" and castling.strip("KQkq"):
+            raise ValueError(f"Invalid FEN castling rights: {castling}")
+        self.currentCastlingRights = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+        enpassant: str = fields[3] if len(fields) > 3 else "-"
+        if enpassant == "-":
+            self.enpassantPossible = ()
+        elif len(enpassant) == 2 and enpassant[0] in Move.filesToCols and enpassant[1] == ("6" if self.whiteToMove else "3"):
+            # The square a pawn of the side that just moved skipped: on rank 6 if white is to move, rank 3 if black is.
+            self.enpassantPossible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        else:
+            raise ValueError(f"Invalid FEN en passant square: {enpassant}")
+        try:
+            self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError(f"Invalid FEN move clocks: {fen}") from None
+        self.resetDerivedState()
+
+    # Method to rebuild everything derived from the board after it was set up directly (logs, king squares, hashes).
+    def resetDerivedState(self) -> None:
+        for row in range(8):
+            for column in range(8):
+                if self.board[row][column] == "wK":
+                    self.whiteKingLocation = (row, column)
+                elif self.board[row][column] == "bK":
+                    self.blackKingLocation = (row, column)
+        self.moveLog = []
+        self.halfmoveClockLog = [self.halfmoveClock]
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.castleRightsLog = [CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks, self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)]
+        self.inCheck = self.checkmate = self.stalemate = False
+        self.pins, self.checks = [], []
+        self.pieceCount = sum(square != "--" for rank in self.board for square in rank)
+        if self.bitboards is not None:
+            self.bitboards = bitboardEngine.BitboardPosition(self.board)
+        self.zobristKey = self.computeZobristKey()
+        self.zobristKeyLog = [self.zobristKey]
+        self.pinsAndChecksCache = {}
+        if self.pieceSquareValues is not None:
+            self.evaluation = self.computeEvaluation()
+
     # Method to convert the board state to FEN notation.
     def boardToFEN(self) -> str:
-        fen: str = ""
+        ranks: List[str] = []
         for row in self.board:
+            rankText: str = ""
             emptyCount: int = 0
             for square in row:
                 if square == "--":
                     emptyCount += 1
                 else:
                     if emptyCount > 0:
-                        fen += str(emptyCount)
+                        rankText += str(emptyCount)
                         emptyCount = 0
-                    fen += square[1] if square[0] == "w" else square[1].lower()
+                    rankText += square[1].upper() if square[0] == "w" else square[1].lower()
             if emptyCount > 0:
-                fen += str(emptyCount)
-            fen += '/'
-        fen = fen[:-1]
-        
-        # Add other FEN components (active color, castling availability, en passant target square, halfmove clock, fullmove number)
-        fen += ' b ' if not self.whiteToMove else ' w '
-        fen += '-'  # castling availability placeholder
-        fen += ' - 0 1'  # en passant, halfmove clock, fullmove number placeholder
-        return fen
+                rankText += str(emptyCount)
+            ranks.append(rankText)
+        rights: CastleRights = self.currentCastlingRights
+        castling: str = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        enpassant: str = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]] if self.enpassantPossible else "-"
+        return f"{'/'.join(ranks)} {'w' if self.whiteToMove else 'b'} {castling or '-'} {enpassant} {self.halfmoveClock} {self.fullmoveNumber}"
 
     # Method to make a move on the board.
     def makeMove(self, move: 'Move') -> None:
+        previousCastleIndex: int = self.currentCastlingRights.index()
+        previousEnpassant: Tuple[int, int] = self.enpassantPossible
         self.board[move.startRow][move.startColumn] = "--"
         self.board[move.endRow][move.endColumn] = move.pieceMoved
         self.moveLog.append(move)
@@ -96,8 +258,44 @@ class GameState:
                 self.board[move.endRow][move.endColumn + 1] = self.board[move.endRow][move.endColumn - 2]
                 self.board[move.endRow][move.endColumn - 2] = "--"
         self.enpassantPossibleLog.append(self.enpassantPossible)
+        self.halfmoveClock = 0 if move.pieceMoved[1] == "p" or move.isCapture else self.halfmoveClock + 1
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if move.isCapture:
+            self.pieceCount -= 1
+        if self.whiteToMove:
+            self.fullmoveNumber += 1
+        if self.bitboards is not None:
+            self.bitboards.applyMove(move)
         self.updateCastleRights(move)
         self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks, self.currentCastlingRights.wqs, self.currentCastlingRights.bqs))
+        self.zobristKey = self.updatedZobristKey(move, previousCastleIndex, previousEnpassant)
+        self.zobristKeyLog.append(self.zobristKey)
+        if self.pieceSquareValues is not None:
+            self.evaluation += self.evaluationDelta(move)
+
+    # Method to get the Zobrist key after a move by XOR-ing out what changed, instead of rehashing the board.
+    def updatedZobristKey(self, move: 'Move', previousCastleIndex: int, previousEnpassant: Tuple[int, int]) -> int:
+        startSq: int = move.startRow * 8 + move.startColumn
+        endSq: int = move.endRow * 8 + move.endColumn
+        key: int = self.zobristKey ^ zobristBlackToMoveKey ^ zobristPieceKeys[move.pieceMoved][startSq]
+        if move.isPawnPromotion:
+            key ^= zobristPieceKeys[move.pieceMoved[0] + "Q"][endSq]
+        else:
+            key ^= zobristPieceKeys[move.pieceMoved][endSq]
+        if move.isEnpassantMove:
+            key ^= zobristPieceKeys[move.pieceCaptured][move.startRow * 8 + move.endColumn]
+        elif move.pieceCaptured != "--":
+            key ^= zobristPieceKeys[move.pieceCaptured][endSq]
+        if move.isCastleMove:
+            rookStart, rookEnd = bitboardEngine.castleRookSquares[endSq]
+            rook: str = move.pieceMoved[0] + "R"
+            key ^= zobristPieceKeys[rook][rookStart] ^ zobristPieceKeys[rook][rookEnd]
+        key ^= zobristCastleKeys[previousCastleIndex] ^ zobristCastleKeys[self.currentCastlingRights.index()]
+        if previousEnpassant:
+            key ^= zobristEnpassantKeys[previousEnpassant[1]]
+        if self.enpassantPossible:
+            key ^= zobristEnpassantKeys[self.enpassantPossible[1]]
+        return key
 
     # Method to undo the last move made.
     def undoMove(self) -> None:
@@ -115,6 +313,14 @@ class GameState:
                 self.board[move.startRow][move.endColumn] = move.pieceCaptured
             self.enpassantPossibleLog.pop()
             self.enpassantPossible = self.enpassantPossibleLog[-1]
+            self.zobristKeyLog.pop()
+            self.zobristKey = self.zobristKeyLog[-1]
+            self.halfmoveClockLog.pop()
+            self.halfmoveClock = self.halfmoveClockLog[-1]
+            if move.isCapture:
+                self.pieceCount += 1
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
             self.castleRightsLog.pop()
             newRights: CastleRights = self.castleRightsLog[-1]
             self.currentCastlingRights = CastleRights(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs)
@@ -125,6 +331,31 @@ class GameState:
                 else:
                     self.board[move.endRow][move.endColumn-2] = self.board[move.endRow][move.endColumn+1]
                     self.board[move.endRow][move.endColumn+1] = '--'
+            if self.bitboards is not None:
+                self.bitboards.applyMove(move)
+            if self.pieceSquareValues is not None:
+                self.evaluation -= self.evaluationDelta(move)
+        self.checkmate = False
+        self.stalemate = False
+
+    # Method to pass the turn without moving, for null-move pruning in the search. Clears en passant but leaves
+    # the move log alone, so it must be undone with undoNullMove before the move that preceded it is undone.
+    def makeNullMove(self) -> None:
+        if self.enpassantPossible:
+            self.zobristKey ^= zobristEnpassantKeys[self.enpassantPossible[1]]
+        self.zobristKey ^= zobristBlackToMoveKey
+        self.enpassantPossible = ()
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        self.zobristKeyLog.append(self.zobristKey)
+        self.whiteToMove = not self.whiteToMove
+
+    # Method to undo a null move.
+    def undoNullMove(self) -> None:
+        self.whiteToMove = not self.whiteToMove
+        self.enpassantPossibleLog.pop()
+        self.enpassantPossible = self.enpassantPossibleLog[-1]
+        self.zobristKeyLog.pop()
+        self.zobristKey = self.zobristKeyLog[-1]
         self.checkmate = False
         self.stalemate = False
 
@@ -163,6 +394,8 @@ class GameState:
 
     # Method to get all valid moves considering checks and pins.
     def getValidMoves(self) -> List['Move']:
+        if self.bitboards is not None:
+            return self.getBitboardValidMoves()
         checkCastleRights: CastleRights = CastleRights(self.currentCastlingRights.wks, self.currentCastlingRights.bks, self.currentCastlingRights.wqs, self.currentCastlingRights.bqs)
         checkEnpassantPossible: Tuple[int, int] = self.enpassantPossible
         moves: List[Move] = []
@@ -177,28 +410,29 @@ class GameState:
             kingColumn: int = self.blackKingLocation[1]
         if self.inCheck:
             if len(self.checks) == 1:
-                moves = moves + self.getAllPossibleMoves()
+                moves.extend(self.getAllPossibleMoves())
                 check: Tuple[int, int, int, int] = self.checks[0]
                 checkRow: int = check[0]
                 checkColumn: int = check[1]
                 pieceChecking: str = self.board[checkRow][checkColumn]
-                validSquares: List[Tuple[int, int]] = []
+                validSquares: Set[Tuple[int, int]] = set()
                 if pieceChecking[1] == "N":
-                    validSquares = [(checkRow, checkColumn)]
+                    validSquares = {(checkRow, checkColumn)}
                 else:
                     for i in range(1, 8):
                         validSquare: Tuple[int, int] = (kingRow + check[2]*i, kingColumn + check[3]*i)
-                        validSquares.append(validSquare)
+                        validSquares.add(validSquare)
                         if validSquare[0] == checkRow and validSquare[1] == checkColumn:
                             break
-                for i in range(len(moves)-1, -1, -1):
-                    if moves[i].pieceMoved[1] != "K":
-                        if not (moves[i].endRow, moves[i].endColumn) in validSquares:
-                            moves.remove(moves[i])
+                # Keep king moves, moves that block or capture the checker, and an en passant capture of a
+                # checking pawn, which is not on its end square. Filtering into a new list avoids an O(n) remove per move.
+                moves = [move for move in moves
+                         if move.pieceMoved[1] == "K" or (move.endRow, move.endColumn) in validSquares
+                         or (move.isEnpassantMove and (move.startRow, move.endColumn) == (checkRow, checkColumn))]
             else:
                 self.getKingMoves(kingRow, kingColumn, moves)
         else:
-            moves = moves + self.getAllPossibleMoves()
+            moves.extend(self.getAllPossibleMoves())
         self.currentCastlingRights = checkCastleRights
         self.enpassantPossible = checkEnpassantPossible
         if len(moves) == 0:
@@ -208,6 +442,223 @@ class GameState:
                 self.stalemate = True
         return moves
 
+    # Method to get all valid moves from the bitboard backend, materialized as Move objects for callers.
+    def getBitboardValidMoves(self) -> List['Move']:
+        encodedMoves, self.inCheck = self.bitboards.generateLegalMoves(self.whiteToMove, self.currentCastlingRights, self.enpassantPossible)
+        moves: List[Move] = self.decodeBitboardMoves(encodedMoves)
+        if len(moves) == 0:
+            if self.inCheck:
+                self.checkmate = True
+            else:
+                self.stalemate = True
+        return moves
+
+    # Method to turn encoded bitboard moves into Move objects.
+    def decodeBitboardMoves(self, encodedMoves: List[int]) -> List['Move']:
+        moves: List[Move] = []
+        for encoded in encodedMoves:
+            startSq, endSq, flag = bitboardEngine.decodeMove(encoded)
+            moves.append(Move(divmod(startSq, 8), divmod(endSq, 8), self.board, isEnpassantMove=flag == bitboardEngine.ENPASSANT, isCastleMove=flag == bitboardEngine.CASTLE))
+        return moves
+
+    # Method to get the legal captures and promotions for quiescence search, without generating quiet moves.
+    # When in check all legal evasions are returned instead (and checkmate is set if there are none).
+    def getCaptureMoves(self) -> List['Move']:
+        if self.bitboards is not None:
+            encodedMoves, self.inCheck = self.bitboards.generateLegalMoves(self.whiteToMove, self.currentCastlingRights, self.enpassantPossible, capturesOnly=True)
+            if self.inCheck:
+                return self.getBitboardValidMoves()
+            return self.decodeBitboardMoves(encodedMoves)
+        self.inCheck, pins, self.checks = self.getPinsAndChecks()
+        if self.inCheck:
+            return self.getValidMoves()
+        # getPawnMoves removes the pins it uses, so it gets a copy and the cached list stays whole.
+        self.pins = list(pins)
+        pinDirections: dict = {(pin[0], pin[1]): (pin[2], pin[3]) for pin in pins}
+        sameColor: str = 'w' if self.whiteToMove else 'b'
+        enemyColor: str = 'b' if self.whiteToMove else 'w'
+        moves: List[Move] = []
+        for row in range(8):
+            for column in range(8):
+                square: str = self.board[row][column]
+                if square[0] != sameColor:
+                    continue
+                pinDirection: Tuple[int, int] = pinDirections.get((row, column), ())
+                piece: str = square[1]
+                if piece == "p":
+                    self.getPawnCaptures(row, column, pinDirection, moves)
+                elif piece == "N":
+                    if not pinDirection:
+                        for dr, dc in ((1, 2), (-1, 2), (1, -2), (-1, -2), (2, 1), (-2, 1), (2, -1), (-2, -1)):
+                            endRow, endColumn = row + dr, column + dc
+                            if 0 <= endRow < 8 and 0 <= endColumn < 8 and self.board[endRow][endColumn][0] == enemyColor:
+                                moves.append(Move((row, column), (endRow, endColumn), self.board))
+                elif piece == "K":
+                    # Only the squares of enemy pieces are tested. The king is not in check, so no slider's line runs
+                    # through it and it need not be lifted off the board as in getKingMoves.
+                    for endRow, endColumn in kingSquares[row][column]:
+                        if self.board[endRow][endColumn][0] == enemyColor and not self.isSquareAttacked(endRow, endColumn, not self.whiteToMove):
+                            moves.append(Move((row, column), (endRow, endColumn), self.board))
+                else:
+                    directions: Tuple[Tuple[int, int], ...] = ()
+                    if piece != "B":
+                        directions += ((-1, 0), (1, 0), (0, -1), (0, 1))
+                    if piece != "R":
+                        directions += ((-1, 1), (1, 1), (1, -1), (-1, -1))
+                    for d in directions:
+                        if pinDirection and pinDirection != d and pinDirection != (-d[0], -d[1]):
+                            continue
+                        for i in range(1, 8):
+                            endRow, endColumn = row + d[0] * i, column + d[1] * i
+                            if not (0 <= endRow < 8 and 0 <= endColumn < 8):
+                                break
+                            endPiece: str = self.board[endRow][endColumn]
+                            if endPiece != "--":
+                                if endPiece[0] == enemyColor:
+                                    moves.append(Move((row, column), (endRow, endColumn), self.board))
+                                break
+        return moves
+
+    # Method to get the legal quiet moves (neither captures nor promotions, castling included) when not in check,
+    # the moves getCaptureMoves leaves out, for a search that generates captures first and quiet moves only if needed.
+    # In check, the quiet evasions are returned.
+    def getQuietMoves(self) -> List['Move']:
+        if self.bitboards is not None:
+            encodedMoves, self.inCheck = self.bitboards.generateLegalMoves(self.whiteToMove, self.currentCastlingRights, self.enpassantPossible, quietOnly=True)
+            if self.inCheck:
+                return [move for move in self.decodeBitboardMoves(encodedMoves) if not move.isCapture and not move.isPawnPromotion]
+            return self.decodeBitboardMoves(encodedMoves)
+        self.inCheck, pins, self.checks = self.getPinsAndChecks()
+        if self.inCheck:
+            return [move for move in self.getValidMoves() if not move.isCapture and not move.isPawnPromotion]
+        self.pins = list(pins)
+        pinDirections: dict = {(pin[0], pin[1]): (pin[2], pin[3]) for pin in pins}
+        sameColor: str = 'w' if self.whiteToMove else 'b'
+        moves: List[Move] = []
+        for row in range(8):
+            for column in range(8):
+                square: str = self.board[row][column]
+                if square[0] != sameColor:
+                    continue
+                pinDirection: Tuple[int, int] = pinDirections.get((row, column), ())
+                piece: str = square[1]
+                if piece == "p":
+                    moveAmount: int = -1 if self.whiteToMove else 1
+                    endRow: int = row + moveAmount
+                    if endRow != 0 and endRow != 7 and self.board[endRow][column] == "--" and (not pinDirection or pinDirection[1] == 0):
+                        moves.append(Move((row, column), (endRow, column), self.board))
+                        if row == (6 if self.whiteToMove else 1) and self.board[endRow + moveAmount][column] == "--":
+                            moves.append(Move((row, column), (endRow + moveAmount, column), self.board))
+                elif piece == "N":
+                    if not pinDirection:
+                        for endRow, endColumn in knightSquares[row][column]:
+                            if self.board[endRow][endColumn] == "--":
+                                moves.append(Move((row, column), (endRow, endColumn), self.board))
+                elif piece == "K":
+                    # As in getCaptureMoves, the king is not in check, so it need not be lifted off the board.
+                    for endRow, endColumn in kingSquares[row][column]:
+                        if self.board[endRow][endColumn] == "--" and not self.isSquareAttacked(endRow, endColumn, not self.whiteToMove):
+                            moves.append(Move((row, column), (endRow, endColumn), self.board))
+                    self.getCastleMoves(row, column, moves)
+                else:
+                    directions: Tuple[Tuple[int, int], ...] = ()
+                    if piece != "B":
+                        directions += ((-1, 0), (1, 0), (0, -1), (0, 1))
+                    if piece != "R":
+                        directions += ((-1, 1), (1, 1), (1, -1), (-1, -1))
+                    for d in directions:
+                        if pinDirection and pinDirection != d and pinDirection != (-d[0], -d[1]):
+                            continue
+                        for i in range(1, 8):
+                            endRow, endColumn = row + d[0] * i, column + d[1] * i
+                            if not (0 <= endRow < 8 and 0 <= endColumn < 8) or self.board[endRow][endColumn] != "--":
+                                break
+                            moves.append(Move((row, column), (endRow, endColumn), self.board))
+        return moves
+
+    # Method to get checksForPinsAndChecks for the current position, cached by the length of zobristKeyLog (the ply)
+    # so the capture and quiet stages of a search node share one scan although its children's scans come in between.
+    # The lists returned are shared with the cache and must not be changed.
+    def getPinsAndChecks(self) -> Tuple[bool, List[Tuple[int, int, int, int]], List[Tuple[int, int, int, int]]]:
+        ply: int = len(self.zobristKeyLog)
+        cached = self.pinsAndChecksCache.get(ply)
+        if cached is not None and cached[0] == self.zobristKey:
+            return cached[1]
+        result = self.checksForPinsAndChecks()
+        self.pinsAndChecksCache[ply] = (self.zobristKey, result)
+        return result
+
+    # Method to rebuild a move of the side to move from its moveID (e.g. a hash or killer move remembered from
+    # another position) if the piece can make it on the current board, ignoring pins and checks.
+    # Castling and en passant are not rebuilt. The caller checks legality with kingLeftInCheck after making the move.
+    def pseudoLegalMove(self, moveID: int) -> Optional['Move']:
+        startRow, startColumn, endRow, endColumn = moveID // 1000, moveID // 100 % 10, moveID // 10 % 10, moveID % 10
+        if moveID < 0 or startRow > 7 or endRow > 7 or startColumn > 7 or endColumn > 7:
+            return None
+        sameColor: str = "w" if self.whiteToMove else "b"
+        piece: str = self.board[startRow][startColumn]
+        target: str = self.board[endRow][endColumn]
+        if piece[0] != sameColor or target[0] == sameColor or target[1] == "K":
+            return None
+        dr: int = endRow - startRow
+        dc: int = endColumn - startColumn
+        pieceType: str = piece[1]
+        if pieceType == "p":
+            forward: int = -1 if self.whiteToMove else 1
+            if dc == 0:
+                if target != "--":
+                    return None
+                if dr != forward and not (dr == 2 * forward and startRow == (6 if self.whiteToMove else 1)
+                                          and self.board[startRow + forward][startColumn] == "--"):
+                    return None
+            elif abs(dc) != 1 or dr != forward or target == "--":
+                return None
+        elif pieceType == "N":
+            if (abs(dr), abs(dc)) not in ((1, 2), (2, 1)):
+                return None
+        elif pieceType == "K":
+            if max(abs(dr), abs(dc)) != 1:
+                return None
+        else:
+            straight: bool = dr == 0 or dc == 0
+            diagonal: bool = abs(dr) == abs(dc)
+            if (dr == 0 and dc == 0) or not ((straight and pieceType != "B") or (diagonal and pieceType != "R")):
+                return None
+            stepRow: int = (dr > 0) - (dr < 0)
+            stepColumn: int = (dc > 0) - (dc < 0)
+            for i in range(1, max(abs(dr), abs(dc))):
+                if self.board[startRow + stepRow * i][startColumn + stepColumn * i] != "--":
+                    return None
+        return Move((startRow, startColumn), (endRow, endColumn), self.board)
+
+    # Method to determine if the king of the side to move is attacked, without generating moves.
+    def kingInCheck(self) -> bool:
+        kingRow, kingColumn = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        return self.isSquareAttacked(kingRow, kingColumn, not self.whiteToMove)
+
+    # Method to determine if the move just made left the king of the side that made it attacked, i.e. was illegal.
+    def kingLeftInCheck(self) -> bool:
+        kingRow, kingColumn = self.blackKingLocation if self.whiteToMove else self.whiteKingLocation
+        return self.isSquareAttacked(kingRow, kingColumn, self.whiteToMove)
+
+    # Method to add a pawn's captures, promotions and en passant captures (not in check).
+    def getPawnCaptures(self, row: int, column: int, pinDirection: Tuple[int, int], moves: List['Move']) -> None:
+        moveAmount: int = -1 if self.whiteToMove else 1
+        enemyColor: str = "b" if self.whiteToMove else "w"
+        endRow: int = row + moveAmount
+        if (endRow == 0 or endRow == 7) and self.board[endRow][column] == "--" and (not pinDirection or pinDirection[1] == 0):
+            moves.append(Move((row, column), (endRow, column), self.board))
+        for dc in (-1, 1):
+            endColumn: int = column + dc
+            if 0 <= endColumn < 8 and (not pinDirection or pinDirection == (moveAmount, dc)):
+                if self.board[endRow][endColumn][0] == enemyColor:
+                    moves.append(Move((row, column), (endRow, endColumn), self.board))
+        if self.enpassantPossible and self.enpassantPossible[0] == endRow and abs(self.enpassantPossible[1] - column) == 1:
+            # getPawnMoves already handles the pin and rank-pin rules for en passant, so reuse it for this rare case.
+            pawnMoves: List[Move] = []
+            self.getPawnMoves(row, column, pawnMoves)
+            moves.extend(move for move in pawnMoves if move.isEnpassantMove)
+
     # Method to determine if the current player is in check.
     def inCheck(self) -> bool:
         if self.whiteToMove:
@@ -215,22 +666,81 @@ class GameState:
         else:
             return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
 
-    # Method to determine if a square is under attack.
+    # Method to determine if a square is attacked by the opponent of the side to move.
     def squareUnderAttack(self, row: int, column: int) -> bool:
-        self.whiteToMove = not self.whiteToMove
-        opponentMoves: List[Move] = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
-        for move in opponentMoves:
-            if move.endRow == row and move.endColumn == column:
+        return self.isSquareAttacked(row, column, not self.whiteToMove)
+
+    # Method to determine if a square is attacked by the given side, scanning outward from the square:
+    # knight, pawn and king squares first, then each rook and bishop ray up to its first piece.
+    def isSquareAttacked(self, row: int, column: int, byWhite: bool) -> bool:
+        board: List[List[str]] = self.board
+        color: str = "w" if byWhite else "b"
+        knight: str = color + "N"
+        for r, c in knightSquares[row][column]:
+            if board[r][c] == knight:
                 return True
-        kingRow, kingColumn = self.blackKingLocation if self.whiteToMove else self.whiteKingLocation
-        rowMoves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        columnMoves = (-1, 0, 1, -1, 1, -1, 0, 1)
-        for i in range(8):
-            if row + rowMoves[i] == kingRow and column + columnMoves[i] == kingColumn:
+        # White pawns attack towards row 0, so a white pawn attacking the square stands one row below it.
+        pawnRow: int = row + 1 if byWhite else row - 1
+        if 0 <= pawnRow < 8:
+            pawn: str = color + "p"
+            if (column > 0 and board[pawnRow][column - 1] == pawn) or (column < 7 and board[pawnRow][column + 1] == pawn):
+                return True
+        king: str = color + "K"
+        for r, c in kingSquares[row][column]:
+            if board[r][c] == king:
                 return True
+        queen: str = color + "Q"
+        for rays, slider in ((rookRays, color + "R"), (bishopRays, color + "B")):
+            for ray in rays[row][column]:
+                for r, c in ray:
+                    piece: str = board[r][c]
+                    if piece != "--":
+                        if piece == slider or piece == queen:
+                            return True
+                        break
         return False
 
+    # Method to get the squares attacked by the given side as an 8x8 grid of booleans, built once per position and
+    # cached under its Zobrist key. The king of the other side does not block sliders, so the grid also gives the
+    # squares that king cannot step back to along a checking line.
+    def getAttackMap(self, byWhite: bool) -> List[List[bool]]:
+        cacheKey: Tuple[int, bool] = (self.zobristKey, byWhite)
+        if self.attackMapCache is not None and self.attackMapCache[0] == cacheKey:
+            return self.attackMapCache[1]
+        board: List[List[str]] = self.board
+        color: str = "w" if byWhite else "b"
+        defendingKing: str = ("b" if byWhite else "w") + "K"
+        attacked: List[List[bool]] = [[False] * 8 for _ in range(8)]
+        for row in range(8):
+            for column in range(8):
+                piece: str = board[row][column]
+                if piece[0] != color:
+                    continue
+                pieceType: str = piece[1]
+                if pieceType == "p":
+                    pawnRow: int = row - 1 if byWhite else row + 1
+                    if 0 <= pawnRow < 8:
+                        if column > 0:
+                            attacked[pawnRow][column - 1] = True
+                        if column < 7:
+                            attacked[pawnRow][column + 1] = True
+                elif pieceType == "N" or pieceType == "K":
+                    for r, c in (knightSquares if pieceType == "N" else kingSquares)[row][column]:
+                        attacked[r][c] = True
+                else:
+                    rays: List[List[Tuple[int, int]]] = []
+                    if pieceType != "B":
+                        rays += rookRays[row][column]
+                    if pieceType != "R":
+                        rays += bishopRays[row][column]
+                    for ray in rays:
+                        for r, c in ray:
+                            attacked[r][c] = True
+                            if board[r][c] != "--" and board[r][c] != defendingKing:
+                                break
+        self.attackMapCache = (cacheKey, attacked)
+        return attacked
+
     # Method to check for pins and checks on the king.
     def checksForPinsAndChecks(self) -> Tuple[bool, List[Tuple[int, int, int, int]], List[Tuple[int, int, int, int]]]:
         pins: List[Tuple[int, int, int, int]] = []
@@ -304,7 +814,7 @@ class GameState:
             if self.pins[i][0] == row and self.pins[i][1] == column:
                 piecePinned = True
                 pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
+                del self.pins[i]
                 break
         if self.whiteToMove:
             moveAmount: int = -1
@@ -317,7 +827,7 @@ class GameState:
             enemyColor: str = "w"
             kingRow, kingColumn = self.blackKingLocation
         if self.board[row + moveAmount][column] == "--":
-            if not piecePinned or pinDirection == (moveAmount, 0):
+            if not piecePinned or pinDirection == (moveAmount, 0) or pinDirection == (-moveAmount, 0):
                 moves.append(Move((row, column), (row + moveAmount, column), self.board))
                 if row == startRow and self.board[row + 2*moveAmount][column] == "--":
                     moves.append(Move((row, column), (row + 2*moveAmount, column), self.board))
@@ -341,8 +851,10 @@ class GameState:
                             square = self.board[row][i]
                             if square[0] == enemyColor and (square[1] == "R" or square[1] == "Q"):
                                 attackingPiece = True
+                                break
                             elif square != "--":
                                 blockingPiece = True
+                                break
                     if not attackingPiece or blockingPiece:
                         moves.append(Move((row, column), (row + moveAmount, column - 1), self.board, isEnpassantMove=True))
         if column+1 <= 7:
@@ -365,8 +877,10 @@ class GameState:
                             square = self.board[row][i]
                             if square[0] == enemyColor and (square[1] == "R" or square[1] == "Q"):
                                 attackingPiece = True
+                                break
                             elif square != "--":
                                 blockingPiece = True
+                                break
                     if not attackingPiece or blockingPiece:
                         moves.append(Move((row, column), (row + moveAmount, column + 1), self.board, isEnpassantMove=True))
 
@@ -379,7 +893,7 @@ class GameState:
                 piecePinned = True
                 pinDirection = (self.pins[i][2], self.pins[i][3])
                 if self.board[row][column][1] != "Q":
-                    self.pins.remove(self.pins[i])
+                    del self.pins[i]
                 break
         directions: Tuple[Tuple[int, int]] = ((-1, 0), (1, 0), (0, -1), (0, 1))
         opposite_color: str = 'b' if self.whiteToMove else 'w'
@@ -408,7 +922,7 @@ class GameState:
             if self.pins[i][0] == row and self.pins[i][1] == column:
                 piecePinned = True
                 pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
+                del self.pins[i]
                 break
         NightMoves: Tuple[Tuple[int, int]] = ((1, 2), (-1, 2), (1, -2), (-1, -2), (2, 1), (-2, 1), (2, -1), (-2, -1))
         same_color: str = 'w' if self.whiteToMove else 'b'
@@ -430,7 +944,7 @@ class GameState:
                 piecePinned = True
                 pinDirection = (self.pins[i][2], self.pins[i][3])
                 if self.board[row][column][1] != "Q":
-                    self.pins.remove(self.pins[i])
+                    del self.pins[i]
                 break
         directions: Tuple[Tuple[int, int]] = ((-1, 1), (1, 1), (1, -1), (-1, -1))
         opposite_color: str = 'b' if self.whiteToMove else 'w'
@@ -454,44 +968,66 @@ class GameState:
         rowMoves: Tuple[int, ...] = (-1, -1, -1, 0, 0, 1, 1, 1)
         columnMoves: Tuple[int, ...] = (-1, 0, 1, -1, 1, -1, 0, 1)
         same_color: str = 'w' if self.whiteToMove else 'b'
+        # The king is lifted off the board while its destinations are tested, so it does not shield a square behind it.
+        king: str = self.board[row][column]
+        self.board[row][column] = "--"
+        safeSquares: List[Tuple[int, int]] = []
         for i in range(8):
             end_row: int = row + rowMoves[i]
             end_col: int = column + columnMoves[i]
             if 0 <= end_row < 8 and 0 <= end_col < 8:  
                 end_piece: str = self.board[end_row][end_col]
-                if end_piece[0] != same_color:  
-                    if same_color == "w":
-                        self.whiteKingLocation = (end_row, end_col)
-                    else:
-                        self.blackKingLocation = (end_row, end_col)
-                    inCheck, pins, checks = self.checksForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((row, column), (end_row, end_col), self.board))
-                    if same_color == "w":
-                        self.whiteKingLocation = (row, column)
-                    else:
-                        self.blackKingLocation = (row, column)
+                if end_piece[0] != same_color and not self.isSquareAttacked(end_row, end_col, not self.whiteToMove):
+                    safeSquares.append((end_row, end_col))
+        self.board[row][column] = king
+        for endSquare in safeSquares:
+            moves.append(Move((row, column), endSquare, self.board))
 
-    # Method to get all possible castling moves.
+    # Method to get all possible castling moves. The king is known not to be in check, so only the squares it
+    # passes over and lands on are tested.
     def getCastleMoves(self, row: int, column: int, moves: List['Move']) -> None:
         if self.inCheck:
             return
         if (self.whiteToMove and self.currentCastlingRights.wks) or (not self.whiteToMove and self.currentCastlingRights.bks):
             if self.board[row][column + 1] == "--" and self.board[row][column + 2] == "--":
                 if not self.squareUnderAttack(row, column + 1) and not self.squareUnderAttack(row, column + 2):
-                    if not self.squareUnderAttack(row, column):
-                        moves.append(Move((row, column), (row, column + 2), self.board, isCastleMove=True))
+                    moves.append(Move((row, column), (row, column + 2), self.board, isCastleMove=True))
         if (self.whiteToMove and self.currentCastlingRights.wqs) or (not self.whiteToMove and self.currentCastlingRights.bqs):
             if self.board[row][column - 1] == "--" and self.board[row][column - 2] == "--" and self.board[row][column - 3] == "--":
                 if not self.squareUnderAttack(row, column - 1) and not self.squareUnderAttack(row, column - 2):
-                    if not self.squareUnderAttack(row, column):
-                        moves.append(Move((row, column), (row, column - 2), self.board, isCastleMove=True))
+                    moves.append(Move((row, column), (row, column - 2), self.board, isCastleMove=True))
 
     # Method to get all possible queen moves.
     def getQueenMoves(self, row: int, column: int, moves: List['Move']) -> None:
         self.getRookMoves(row, column, moves)
         self.getBishopMoves(row, column, moves)
 
+# Function to parse one rank of a FEN piece placement into board squares.
+def parseFENRank(rankText: str) -> Tuple[str, ...]:
+    row: List[str] = []
+    for char in rankText:
+        if char in "12345678":
+            row.extend(["--"] * int(char))
+        elif char in "PNBRQK":
+            row.append("w" + (char if char != "P" else "p"))
+        elif char in "pnbrqk":
+            row.append("b" + (char.upper() if char != "p" else "p"))
+        else:
+            raise ValueError(f"Invalid FEN rank: {rankText}")
+    if len(row) != 8:
+        raise ValueError(f"Invalid FEN rank: {rankText}")
+    return tuple(row)
+
+# Cache of parsed FEN ranks. Real positions reuse a small set of rank strings, so batch loading mostly hits it.
+class _FENRankCache(dict):
+    def __missing__(self, rankText: str) -> Tuple[str, ...]:
+        row: Tuple[str, ...] = parseFENRank(rankText)
+        if len(self) < 100000:
+            self[rankText] = row
+        return row
+
+fenRanks: _FENRankCache = _FENRankCache()
+
 # Class to represent castling rights for both players.
 class CastleRights:
     def __init__(self, wks: bool, bks: bool, wqs: bool, bqs: bool):
@@ -500,8 +1036,15 @@ class CastleRights:
         self.wqs: bool = wqs
         self.bqs: bool = bqs
 
+    # Method to pack the four rights into a 4-bit index (used for the Zobrist castling keys).
+    def index(self) -> int:
+        return self.wks | (self.bks << 1) | (self.wqs << 2) | (self.bqs << 3)
+
 # Class to represent a chess move.
+# Slotted, so each of the many moves created during a search carries no per-instance __dict__.
 class Move:
+    __slots__ = ('startRow', 'startColumn', 'endRow', 'endColumn', 'pieceMoved', 'pieceCaptured', 'isPawnPromotion',
+                 'isEnpassantMove', 'isCheck', 'isCheckmate', 'isDraw', 'isCapture', 'moveID', 'isCastleMove')
     ranksToRows: dict = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks: dict = {v: k for k, v in ranksToRows.items()}
     filesToCols: dict = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
@@ -0,0 +1,440 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections import defaultdict
+from itertools import product
+from typing import Dict, List, Optional, Set, Tuple
+import chessEngine
+
+# A table file is a 16-byte header (magic, table name, number of entries) followed by one byte per position:
+# 0 for a draw, otherwise 1 + the number of plies until the side with the material mates.
+MAGIC: bytes = b"CTB1"
+HEADER = struct.Struct("<4s8sI")
+DEFAULT_DIRECTORY: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+
+# Material of the stronger side for each table (the other side has a bare king), in index order.
+TABLES: Dict[str, Tuple[str, ...]] = {"KQK": ("Q",), "KRK": ("R",), "KPK": ("p",), "KBNK": ("B", "N")}
+# Tables a table's positions can move into: a promoting KPK pawn becomes a KQK queen.
+DEPENDENCIES: Dict[str, Tuple[str, ...]] = {"KPK": ("KQK",)}
+# Material left after the bare king captures, none of which can mate.
+DRAWN_MATERIAL: Set[str] = {"KK", "KBK", "KNK"}
+PIECE_ORDER: str = "QRBNp"
+
+# Squares here are rank * 8 + file with rank 0 the first rank, so the stronger side's pawns move up by 8.
+_knightOffsets: Tuple[Tuple[int, int], ...] = ((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+_kingOffsets: Tuple[Tuple[int, int], ...] = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))
+_rookDirections: Tuple[Tuple[int, int], ...] = ((1, 0), (0, 1), (-1, 0), (0, -1))
+_bishopDirections: Tuple[Tuple[int, int], ...] = ((1, 1), (-1, 1), (-1, -1), (1, -1))
+
+
+# Function to list the squares reached from every square by single steps of the given (file, rank) offsets.
+def stepSquares(offsets: Tuple[Tuple[int, int], ...]) -> List[List[int]]:
+    return [[(s // 8 + dr) * 8 + s % 8 + df for df, dr in offsets if 0 <= s % 8 + df < 8 and 0 <= s // 8 + dr < 8] for s in range(64)]
+
+
+# Function to list, for every square, the squares along each direction in order away from it.
+def raySquaresFrom(directions: Tuple[Tuple[int, int], ...]) -> List[List[List[int]]]:
+    rays: List[List[List[int]]] = []
+    for s in range(64):
+        squareRays: List[List[int]] = []
+        for df, dr in directions:
+            ray: List[int] = []
+            f, r = s % 8 + df, s // 8 + dr
+            while 0 <= f < 8 and 0 <= r < 8:
+                ray.append(r * 8 + f)
+                f, r = f + df, r + dr
+            if ray:
+                squareRays.append(ray)
+        rays.append(squareRays)
+    return rays
+
+
+knightSquares: List[List[int]] = stepSquares(_knightOffsets)
+kingSquares: List[List[int]] = stepSquares(_kingOffsets)
+rookRays: List[List[List[int]]] = raySquaresFrom(_rookDirections)
+bishopRays: List[List[List[int]]] = raySquaresFrom(_bishopDirections)
+pieceRays: Dict[str, List[List[List[int]]]] = {"R": rookRays, "B": bishopRays,
+                                               "Q": [rookRays[s] + bishopRays[s] for s in range(64)]}
+knightMasks: List[int] = [sum(1 << t for t in targets) for targets in knightSquares]
+kingMasks: List[int] = [sum(1 << t for t in targets) for targets in kingSquares]
+pawnAttackMasks: List[int] = [sum(1 << t for t in stepSquares(((-1, 1), (1, 1)))[s]) for s in range(64)]
+
+
+# Function to build, for every pair of squares on a common line, the mask of the squares strictly between them
+# and whether the line is a rank/file or a diagonal.
+def buildLines() -> Tuple[List[List[int]], List[List[str]]]:
+    between: List[List[int]] = [[0] * 64 for _ in range(64)]
+    lineType: List[List[str]] = [[""] * 64 for _ in range(64)]
+    for kind, rays in (("R", rookRays), ("B", bishopRays)):
+        for s in range(64):
+            for ray in rays[s]:
+                mask: int = 0
+                for t in ray:
+                    between[s][t] = mask
+                    lineType[s][t] = kind
+                    mask |= 1 << t
+    return between, lineType
+
+
+betweenMasks, lineTypes = buildLines()
+
+
+# Function to build a symmetry of the board as a square mapping: mirror files, mirror ranks, then swap files and ranks.
+def symmetry(flipFiles: bool, flipRanks: bool, transpose: bool) -> List[int]:
+    mapping: List[int] = []
+    for s in range(64):
+        f, r = s % 8, s // 8
+        if flipFiles:
+            f = 7 - f
+        if flipRanks:
+            r = 7 - r
+        if transpose:
+            f, r = r, f
+        mapping.append(r * 8 + f)
+    return mapping
+
+
+allSymmetries: List[List[int]] = [symmetry(*flags) for flags in product((False, True), repeat=3)]
+fileSymmetries: List[List[int]] = [symmetry(False, False, False), symmetry(True, False, False)]
+# Without pawns the stronger king is brought into the a1-d1-d4 triangle, with pawns only onto files a-d.
+triangleSquares: List[int] = [r * 8 + f for r in range(4) for f in range(r, 4)]
+queensideSquares: List[int] = [r * 8 + f for r in range(8) for f in range(4)]
+
+
+# Function to tell whether a square is attacked by the stronger side. pieces are (type, square) pairs and occupied
+# is the occupancy mask that blocks sliders.
+def isAttacked(square: int, king: int, pieces: List[Tuple[str, int]], occupied: int) -> bool:
+    if kingMasks[king] >> square & 1:
+        return True
+    for pieceType, pieceSquare in pieces:
+        if pieceSquare == square:
+            continue
+        if pieceType == "N":
+            if knightMasks[pieceSquare] >> square & 1:
+                return True
+        elif pieceType == "p":
+            if pawnAttackMasks[pieceSquare] >> square & 1:
+                return True
+        else:
+            kind: str = lineTypes[pieceSquare][square]
+            if kind and (pieceType == "Q" or pieceType == kind) and not betweenMasks[pieceSquare][square] & occupied:
+                return True
+    return False
+
+
+# Position indexing for one table. A position is (stronger king, bare king, piece squares, side to move) with
+# side 0 the stronger side; the index is taken after mapping the position onto its canonical symmetric form,
+# so every position and its mirror images share one entry.
+class TableLayout:
+    def __init__(self, name: str):
+        self.name: str = name
+        self.pieces: Tuple[str, ...] = TABLES[name]
+        self.hasPawn: bool = "p" in self.pieces
+        self.kingDomain: List[int] = queensideSquares if self.hasPawn else triangleSquares
+        self.kingIndex: List[int] = [self.kingDomain.index(s) if s in self.kingDomain else -1 for s in range(64)]
+        self.radices: Tuple[int, ...] = tuple(48 if piece == "p" else 64 for piece in self.pieces)
+        self.size: int = len(self.kingDomain) * 64 * 2
+        for radix in self.radices:
+            self.size *= radix
+        # Symmetries taking each square of the stronger king into its domain: one, or two on the diagonal.
+        self.symmetries: List[List[List[int]]] = []
+        for s in range(64):
+            candidates: List[List[int]] = []
+            for mapping in (fileSymmetries if self.hasPawn else allSymmetries):
+                if self.kingIndex[mapping[s]] >= 0 and mapping not in candidates:
+                    candidates.append(mapping)
+            self.symmetries.append(candidates)
+
+    # Method to get the index of a position, in O(1).
+    def index(self, king: int, bareKing: int, squares: Tuple[int, ...], side: int) -> int:
+        mappings: List[List[int]] = self.symmetries[king]
+        mapping: List[int] = mappings[0]
+        if len(mappings) > 1:
+            # The king is on the diagonal: of the position and its reflection, take the one with the smaller squares.
+            other: List[int] = mappings[1]
+            if (other[bareKing],) + tuple(other[s] for s in squares) < (mapping[bareKing],) + tuple(mapping[s] for s in squares):
+                mapping = other
+        index: int = self.kingIndex[mapping[king]] * 64 + mapping[bareKing]
+        for s, radix in zip(squares, self.radices):
+            index = index * radix + (mapping[s] - 8 if radix == 48 else mapping[s])
+        return index * 2 + side
+
+    # Method to get the position stored at an index, in canonical form.
+    def decode(self, index: int) -> Tuple[int, int, Tuple[int, ...], int]:
+        side: int = index & 1
+        index >>= 1
+        squares: List[int] = []
+        for radix in reversed(self.radices):
+            squares.append(index % radix + (8 if radix == 48 else 0))
+            index //= radix
+        bareKing: int = index % 64
+        return self.kingDomain[index // 64], bareKing, tuple(reversed(squares)), side
+
+
+# Generator of one table by retrograde analysis: mates are found first, then positions are resolved backwards
+# one ply at a time, so every position gets its exact distance to mate. Positions never resolved are draws.
+class TableGenerator:
+    def __init__(self, name: str, tablebases: 'Tablebases'):
+        self.layout: TableLayout = TableLayout(name)
+        self.tablebases: Tablebases = tablebases
+        self.values: bytearray = bytearray(self.layout.size)
+        # For positions with the bare king to move: moves not yet known to lose.
+        self.movesLeft: array = array("B", bytes(self.layout.size))
+        # Positions of each distance to mate waiting to be expanded.
+        self.frontier: Dict[int, List[int]] = defaultdict(list)
+
+    # Method to compute the table. Returns the values, one byte per index.
+    def generate(self) -> bytearray:
+        layout: TableLayout = self.layout
+        domain: List[range] = [range(8, 56) if radix == 48 else range(64) for radix in layout.radices]
+        for king in layout.kingDomain:
+            for bareKing in range(64):
+                if bareKing == king or kingMasks[king] >> bareKing & 1:
+                    continue
+                for squares in product(*domain):
+                    if len(set(squares)) < len(squares) or king in squares or bareKing in squares:
+                        continue
+                    # Only canonical positions are analysed; their mirror images share their entries.
+                    if layout.decode(layout.index(king, bareKing, squares, 0))[:3] != (king, bareKing, squares):
+                        continue
+                    self.initialize(king, bareKing, squares)
+
+        distance: int = 0
+        while self.frontier:
+            for index in self.frontier.pop(distance, []):
+                king, bareKing, squares, side = layout.decode(index)
+                if side == 1:
+                    self.expandLoss(king, bareKing, squares, distance)
+                elif self.values[index] == 0:
+                    self.values[index] = distance + 1
+                    self.expandWin(king, bareKing, squares, distance)
+            distance += 1
+        return self.values
+
+    # Method to count the bare king's moves in a position, mark mates, and queue promotions to won KQK positions.
+    def initialize(self, king: int, bareKing: int, squares: Tuple[int, ...]) -> None:
+        layout: TableLayout = self.layout
+        pieces: List[Tuple[str, int]] = list(zip(layout.pieces, squares))
+        occupied: int = 1 << king | 1 << bareKing
+        for s in squares:
+            occupied |= 1 << s
+        inCheck: bool = isAttacked(bareKing, king, pieces, occupied)
+
+        # Bare king to move: count its moves by distinct successor entry. Captures leave a drawn ending and are
+        # counted separately, as they never lose.
+        successors: Set[int] = set()
+        captures: int = 0
+        withoutKing: int = occupied & ~(1 << bareKing)
+        for target in kingSquares[bareKing]:
+            if target in squares:
+                remaining: List[Tuple[str, int]] = [piece for piece in pieces if piece[1] != target]
+                if not isAttacked(target, king, remaining, withoutKing):
+                    captures += 1
+            elif not isAttacked(target, king, pieces, withoutKing):
+                successors.add(layout.index(king, target, squares, 0))
+        index: int = layout.index(king, bareKing, squares, 1)
+        if successors or captures:
+            self.movesLeft[index] = len(successors) + captures
+        elif inCheck:
+            self.values[index] = 1
+            self.frontier[0].append(index)
+
+        # Stronger side to move, legal only if the bare king is not in check.
+        if inCheck or not layout.hasPawn:
+            return
+        pawn: int = squares[layout.pieces.index("p")]
+        if pawn >= 48 and not occupied >> (pawn + 8) & 1:
+            promoted: Tuple[int, int, Tuple[int, ...], int] = (king, bareKing, (pawn + 8,), 1)
+            value: int = self.tablebases.probeIndex("KQK", *promoted)
+            if value:
+                self.frontier[value].append(layout.index(king, bareKing, squares, 0))
+
+    # Method to mark as won, distance + 1 plies from mate, the positions where the stronger side can move into
+    # this lost position of the bare king.
+    def expandLoss(self, king: int, bareKing: int, squares: Tuple[int, ...], distance: int) -> None:
+        layout: TableLayout = self.layout
+        occupied: int = 1 << king | 1 << bareKing
+        for s in squares:
+            occupied |= 1 << s
+        predecessors: List[Tuple[int, Tuple[int, ...]]] = []
+        for origin in kingSquares[king]:
+            if not occupied >> origin & 1 and not kingMasks[origin] >> bareKing & 1:
+                predecessors.append((origin, squares))
+        for i, (pieceType, square) in enumerate(zip(layout.pieces, squares)):
+            origins: List[int] = []
+            if pieceType == "N":
+                origins = [s for s in knightSquares[square] if not occupied >> s & 1]
+            elif pieceType == "p":
+                # Pawns step back one rank, or two to their starting rank, and never back onto the first rank.
+                if square >= 16 and not occupied >> (square - 8) & 1:
+                    origins.append(square - 8)
+                    if 24 <= square < 32 and not occupied >> (square - 16) & 1:
+                        origins.append(square - 16)
+            else:
+                for ray in pieceRays[pieceType][square]:
+                    for s in ray:
+                        if occupied >> s & 1:
+                            break
+                        origins.append(s)
+            for origin in origins:
+                predecessors.append((king, squares[:i] + (origin,) + squares[i + 1:]))
+        for predecessorKing, predecessorSquares in predecessors:
+            pieces: List[Tuple[str, int]] = list(zip(layout.pieces, predecessorSquares))
+            predecessorOccupied: int = 1 << predecessorKing | 1 << bareKing
+            for s in predecessorSquares:
+                predecessorOccupied |= 1 << s
+            # The stronger side cannot be to move while the bare king is in check.
+            if isAttacked(bareKing, predecessorKing, pieces, predecessorOccupied):
+                continue
+            index: int = layout.index(predecessorKing, bareKing, predecessorSquares, 0)
+            if self.values[index] == 0:
+                self.frontier[distance + 1].append(index)
+
+    # Method to take this won position off the move count of every bare king position that can move into it,
+    # marking those left without a saving move as lost, distance + 1 plies from mate.
+    def expandWin(self, king: int, bareKing: int, squares: Tuple[int, ...], distance: int) -> None:
+        layout: TableLayout = self.layout
+        occupied: int = 1 << king | 1 << bareKing
+        for s in squares:
+            occupied |= 1 << s
+        predecessors: Set[int] = set()
+        for origin in kingSquares[bareKing]:
+            if not occupied >> origin & 1 and not kingMasks[king] >> origin & 1:
+                predecessors.add(layout.index(king, origin, squares, 1))
+        for index in predecessors:
+            if self.values[index] == 0 and self.movesLeft[index]:
+                self.movesLeft[index] -= 1
+                if self.movesLeft[index] == 0:
+                    self.values[index] = distance + 2
+                    self.frontier[distance + 1].append(index)
+
+
+# Function to generate a table and write it to directory, generating its dependencies first if they are missing.
+# Returns the path of the table file.
+def generateTable(name: str, directory: str = DEFAULT_DIRECTORY, verbose: bool = False) -> str:
+    os.makedirs(directory, exist_ok=True)
+    for dependency in DEPENDENCIES.get(name, ()):
+        if not os.path.exists(tablePath(dependency, directory)):
+            generateTable(dependency, directory, verbose)
+    tablebases: Tablebases = Tablebases(directory)
+    startTime: float = time.perf_counter()
+    values: bytearray = TableGenerator(name, tablebases).generate()
+    tablebases.close()
+    path: str = tablePath(name, directory)
+    with open(path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, name.encode(), len(values)))
+        out.write(values)
+    if verbose:
+        wins: int = sum(1 for value in values if value)
+        print(f"{name}: {len(values)} entries, {wins} won, longest mate {max(values) - 1} plies, "
+              f"{time.perf_counter() - startTime:.1f}s -> {path}")
+    return path
+
+
+# Function to get the file a table is stored in.
+def tablePath(name: str, directory: str = DEFAULT_DIRECTORY) -> str:
+    return os.path.join(directory, f"{name}.ctb")
+
+
+# Endgame tablebases loaded from a directory. Tables are memory-mapped, so a probe costs one index computation
+# and one byte read, and only the pages probed are read from disk. Missing tables are simply not probed.
+class Tablebases:
+    def __init__(self, directory: str = DEFAULT_DIRECTORY):
+        self.directory: str = directory
+        self.layouts: Dict[str, TableLayout] = {}
+        self.tables: Dict[str, mmap.mmap] = {}
+        self.files: list = []
+        for name in TABLES:
+            path: str = tablePath(name, directory)
+            if not os.path.exists(path):
+                continue
+            file = open(path, "rb")
+            data: mmap.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, tableName, entries = HEADER.unpack_from(data)
+            layout: TableLayout = TableLayout(name)
+            if magic != MAGIC or tableName.rstrip(b"\0").decode() != name or entries != layout.size:
+                data.close()
+                file.close()
+                raise ValueError(f"{path} is not a {name} table")
+            self.files.append(file)
+            self.tables[name] = data
+            self.layouts[name] = layout
+        # Most pieces on the board in any loaded table, 0 if none is loaded, for callers to skip probing early.
+        self.maxPieces: int = max((len(TABLES[name]) + 2 for name in self.tables), default=0)
+
+    # Method to get the stored byte of a position given in table coordinates (see TableLayout).
+    def probeIndex(self, name: str, king: int, bareKing: int, squares: Tuple[int, ...], side: int) -> int:
+        return self.tables[name][HEADER.size + self.layouts[name].index(king, bareKing, squares, side)]
+
+    # Method to look up the position. Returns (result, plies): result 1 if the side to move wins, -1 if it loses
+    # and 0 for a draw, and plies the distance to mate with best play (0 for draws).
+    # Returns None if no loaded table covers the position.
+    def probe(self, gamestate: chessEngine.GameState) -> Optional[Tuple[int, int]]:
+        if gamestate.pieceCount > max(self.maxPieces, 3):
+            return None
+        white: List[Tuple[str, int, int]] = []
+        black: List[Tuple[str, int, int]] = []
+        for row, rank in enumerate(gamestate.board):
+            for column, square in enumerate(rank):
+                if square != "--":
+                    (white if square[0] == "w" else black).append((square[1], row, column))
+        if len(white) == 1:
+            strong, weak, strongIsWhite = black, white, False
+        elif len(black) == 1:
+            strong, weak, strongIsWhite = white, black, True
+        else:
+            return None
+        strong.sort(key=lambda piece: PIECE_ORDER.index(piece[0]) if piece[0] != "K" else -1)
+        name: str = "".join(piece[0] for piece in strong).upper() + "K"
+        if name in DRAWN_MATERIAL:
+            return 0, 0
+        if name not in self.tables:
+            return None
+
+        # Table squares count ranks from the stronger side, which then always plays up the board.
+        def tableSquare(row: int, column: int) -> int:
+            return ((7 - row) if strongIsWhite else row) * 8 + column
+
+        king: int = tableSquare(strong[0][1], strong[0][2])
+        bareKing: int = tableSquare(weak[0][1], weak[0][2])
+        squares: Tuple[int, ...] = tuple(tableSquare(row, column) for _, row, column in strong[1:])
+        side: int = 0 if gamestate.whiteToMove == strongIsWhite else 1
+        value: int = self.probeIndex(name, king, bareKing, squares, side)
+        if value == 0:
+            return 0, 0
+        return (1 if side == 0 else -1), value - 1
+
+    # Method to unmap and close the table files.
+    def close(self) -> None:
+        for data in self.tables.values():
+            data.close()
+        for file in self.files:
+            file.close()
+        self.tables, self.layouts, self.files, self.maxPieces = {}, {}, [], 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate or probe the endgame tablebases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="generate tables by retrograde analysis")
+    generate.add_argument("tables", nargs="*", default=list(TABLES), choices=list(TABLES), help="tables to generate (default: all)")
+    generate.add_argument("-d", "--directory", default=DEFAULT_DIRECTORY, help="directory to write the tables to")
+    probe = commands.add_parser("probe", help="look up a position")
+    probe.add_argument("fen", help="position")
+    probe.add_argument("-d", "--directory", default=DEFAULT_DIRECTORY, help="directory to read the tables from")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for tableName in args.tables:
+            generateTable(tableName, args.directory, verbose=True)
+    else:
+        tablebases = Tablebases(args.directory)
+        entry = tablebases.probe(chessEngine.GameState.fromFEN(args.fen))
+        if entry is None:
+            print("not in the loaded tables")
+        else:
+            print({1: "win", 0: "draw", -1: "loss"}[entry[0]] + (f" in {entry[1]} plies" if entry[0] else ""))
+        tablebases.close()
@@ -0,0 +1,87 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, List, Optional
+import chessEngine
+
+SESSION_TTL_SECONDS: float = 30 * 60  # games untouched for this long are evicted
+MAX_SESSIONS: int = 5000  # least recently used games are evicted beyond this
+
+
+class GameSession:
+    """
+    One game: its GameState, the settings chosen in the menu and the AI status.
+    Slotted so the per-session overhead on top of the GameState stays small and fixed.
+    """
+    __slots__ = ('gameId', 'game_state', 'valid_moves', 'playerOne', 'playerTwo', 'depth', 'timeLimit',
+                 'move_made', 'animate', 'game_over', 'ai_thinking', 'lastAccess')
+
+    def __init__(self, gameId: str, playerOne: bool, playerTwo: bool, depth: Optional[int], timeLimit: Optional[int]):
+        self.gameId: str = gameId
+        self.game_state: chessEngine.GameState = chessEngine.GameState()
+        self.valid_moves: List[chessEngine.Move] = self.game_state.getValidMoves()
+        self.playerOne: bool = playerOne
+        self.playerTwo: bool = playerTwo
+        self.depth: Optional[int] = depth
+        self.timeLimit: Optional[int] = timeLimit
+        self.move_made: bool = False
+        self.animate: bool = False
+        self.game_over: bool = False
+        self.ai_thinking: bool = False
+        self.lastAccess: float = time.monotonic()
+
+
+class GameRegistry:
+    """
+    Games keyed by game ID, which is also the Socket.IO room of the game.
+    Kept in least recently used order so expired and excess games are evicted from the front in O(1) each.
+    onRemove, if given, is called with the game ID of every game that is evicted or removed.
+    """
+
+    def __init__(self, ttlSeconds: float = SESSION_TTL_SECONDS, maxSessions: int = MAX_SESSIONS,
+                 onRemove: Optional[Callable[[str], None]] = None):
+        self.ttlSeconds: float = ttlSeconds
+        self.maxSessions: int = maxSessions
+        self.onRemove: Optional[Callable[[str], None]] = onRemove
+        self.sessions: 'OrderedDict[str, GameSession]' = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+
+    def create(self, playerOne: bool, playerTwo: bool, depth: Optional[int], timeLimit: Optional[int]) -> GameSession:
+        """Start a new game and return its session."""
+        session = GameSession(uuid.uuid4().hex, playerOne, playerTwo, depth, timeLimit)
+        with self.lock:
+            self.sessions[session.gameId] = session
+            self._evict()
+        return session
+
+    def get(self, gameId: Optional[str]) -> Optional[GameSession]:
+        """Return the session for a game ID and mark it as recently used, or None if unknown or evicted."""
+        with self.lock:
+            self._evict()
+            session = self.sessions.get(gameId) if gameId else None
+            if session is not None:
+                session.lastAccess = time.monotonic()
+                self.sessions.move_to_end(gameId)
+            return session
+
+    def remove(self, gameId: str) -> None:
+        """Drop a game."""
+        with self.lock:
+            removed = self.sessions.pop(gameId, None)
+        if removed is not None and self.onRemove is not None:
+            self.onRemove(gameId)
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def _evict(self) -> None:
+        """Drop games past the TTL and, beyond maxSessions, the least recently used ones. Caller holds the lock."""
+        expiry = time.monotonic() - self.ttlSeconds
+        while self.sessions:
+            gameId, oldest = next(iter(self.sessions.items()))
+            if oldest.lastAccess >= expiry and len(self.sessions) <= self.maxSessions:
+                break
+            del self.sessions[gameId]
+            if self.onRemove is not None:
+                self.onRemove(gameId)
@@ -0,0 +1,319 @@
+import argparse
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+import chessEngine, pgn, smartMoveFinder
+import transpositionTable as tt
+
+MAX_PLIES: int = 400  # games still running after this many plies are adjudicated drawn
+# Module switches of smartMoveFinder that an engine configuration may turn on or off.
+SEARCH_FEATURES: Tuple[str, ...] = ("MOVE_ORDERING", "QUIESCENCE", "TABLEBASES", "PVS", "ASPIRATION", "NULL_MOVE", "LMR",
+                                    "STAGED_MOVES")
+
+# Opening positions played when no FEN file is given: the start position and a few main lines after two moves.
+startPositions: List[str] = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "rnbqkbnr/ppp2ppp/4p3/3p4/2PP4/8/PP2PPPP/RNBQKBNR w KQkq - 0 3",
+    "rnbqkbnr/pp2pppp/3p4/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 0 3",
+    "rnbqkbnr/ppp2ppp/4p3/3p4/3PP3/8/PPP2PPP/RNBQKBNR w KQkq - 0 3",
+    "rnbqkb1r/pppppp1p/5np1/8/2PP4/8/PP2PPPP/RNBQKBNR w KQkq - 0 3",
+    "rnbqkb1r/pppp1ppp/5n2/4p3/2P5/2N5/PP1PPPPP/R1BQKBNR w KQkq - 2 3",
+    "rnbqkbnr/pp2pppp/2p5/3p4/3PP3/8/PPP2PPP/RNBQKBNR w KQkq - 0 3",
+    "rnbqkb1r/ppp1pppp/5n2/3p4/8/5NP1/PPPPPP1P/RNBQKB1R w KQkq - 1 3",
+]
+
+
+# An engine configuration: search depth (the depth limit of a timed search), time per move in milliseconds
+# (None for fixed-depth searches), piece values replacing smartMoveFinder.pieceScores, SEARCH_FEATURES switches,
+# and a weights file (see smartMoveFinder.loadWeights) replacing the evaluation the engine starts from.
+class EngineConfig(NamedTuple):
+    name: str
+    depth: Optional[int] = 3
+    timeMs: Optional[int] = None
+    pieceValues: Optional[Dict[str, float]] = None
+    features: Optional[Dict[str, bool]] = None
+    weights: Optional[str] = None
+
+
+# One finished game, as sent back by a worker: SAN moves, result, why it ended, and nodes and search seconds
+# of the white and black engine.
+class GameRecord(NamedTuple):
+    index: int
+    fen: str
+    white: str
+    black: str
+    moves: List[str]
+    result: str
+    termination: str
+    whiteNodes: int
+    blackNodes: int
+    whiteSeconds: float
+    blackSeconds: float
+
+
+defaultFeatures: Dict[str, bool] = {name: getattr(smartMoveFinder, name) for name in SEARCH_FEATURES}
+defaultPieceScores: Dict[str, float] = dict(smartMoveFinder.pieceScores)
+defaultPiecePositionScores: dict = dict(smartMoveFinder.piecePositionScores)
+defaultPositionWeight: float = smartMoveFinder.POSITION_WEIGHT
+# Per worker process: a transposition table for each engine, and the evaluation of each weights file and piece
+# values, (pieceScores, piecePositionScores, POSITION_WEIGHT, pieceSquareValues), kept between games.
+_tables: Dict[str, tt.TranspositionTable] = {}
+_evaluations: Dict[Tuple[Optional[str], Tuple[Tuple[str, float], ...]], Tuple[Dict[str, float], dict, float, dict]] = {}
+
+
+# Function to parse an engine given on the command line as comma-separated key=value pairs, e.g.
+# "name=new,depth=4,time=500,N=3.2,quiescence=off,weights=tuned.json". Keys are name, depth, time (ms), a piece
+# letter of QRBNp for its value, a search feature in lower case, or weights for a weights file.
+def parseEngine(spec: str, defaultName: str) -> EngineConfig:
+    fields: Dict[str, str] = dict(item.split("=", 1) for item in spec.split(",") if item)
+    pieceValues: Dict[str, float] = {}
+    features: Dict[str, bool] = {}
+    for key, value in fields.items():
+        if key in ("name", "depth", "time"):
+            continue
+        if key == "weights":
+            if not os.path.exists(value):
+                raise ValueError(f"Weights file not found: {value}")
+            continue
+        if key in defaultPieceScores and key != "K":
+            pieceValues[key] = float(value)
+        elif key.upper() in SEARCH_FEATURES:
+            features[key.upper()] = value.lower() in ("1", "on", "true", "yes")
+        else:
+            raise ValueError(f"Unknown engine option: {key}")
+    depth: Optional[str] = fields.get("depth")
+    timeMs: Optional[str] = fields.get("time")
+    # Without a depth, timed engines deepen until their time runs out and fixed-depth engines search 3 plies.
+    return EngineConfig(fields.get("name", defaultName), int(depth) if depth else None if timeMs else 3,
+                        int(timeMs) if timeMs else None, pieceValues, features, fields.get("weights"))
+
+
+# Function to switch smartMoveFinder to an engine's evaluation and search features before it moves.
+# Workers play both engines of a game, so this runs before every move. Evaluations are built once per worker for
+# each weights file and set of piece values, whatever the engine's name.
+def applyConfig(config: EngineConfig) -> None:
+    features: Dict[str, bool] = config.features or {}
+    for name in SEARCH_FEATURES:
+        setattr(smartMoveFinder, name, features.get(name, defaultFeatures[name]))
+    key = (config.weights, tuple(sorted((config.pieceValues or {}).items())))
+    if key not in _evaluations:
+        smartMoveFinder.pieceScores.update(defaultPieceScores)
+        smartMoveFinder.piecePositionScores.clear()
+        smartMoveFinder.piecePositionScores.update(defaultPiecePositionScores)
+        smartMoveFinder.POSITION_WEIGHT = defaultPositionWeight
+        if config.weights is not None:
+            smartMoveFinder.loadWeights(config.weights)
+        smartMoveFinder.pieceScores.update(config.pieceValues or {})
+        _evaluations[key] = (dict(smartMoveFinder.pieceScores), dict(smartMoveFinder.piecePositionScores),
+                             smartMoveFinder.POSITION_WEIGHT, smartMoveFinder.buildPieceSquareValues())
+    pieceScores, piecePositionScores, positionWeight, pieceSquareValues = _evaluations[key]
+    smartMoveFinder.pieceScores.update(pieceScores)
+    smartMoveFinder.piecePositionScores.clear()
+    smartMoveFinder.piecePositionScores.update(piecePositionScores)
+    smartMoveFinder.POSITION_WEIGHT = positionWeight
+    smartMoveFinder.pieceSquareValues = pieceSquareValues
+
+
+# Function to tell whether neither side can mate: bare kings, or a single bishop or knight left.
+def insufficientMaterial(gamestate: chessEngine.GameState) -> bool:
+    if gamestate.pieceCount > 3:
+        return False
+    return all(square == "--" or square[1] in "KBN" for rank in gamestate.board for square in rank)
+
+
+# Function to play one game between two engines from a start position. Runs in a worker process.
+# With a searchLog path, the statistics of every search iteration are appended to it as JSON lines.
+def playGame(index: int, fen: str, white: EngineConfig, black: EngineConfig, seed: int, maxPlies: int = MAX_PLIES,
+             searchLog: Optional[str] = None) -> GameRecord:
+    random.seed(seed)
+    gamestate: chessEngine.GameState = chessEngine.GameState.fromFEN(fen)
+    searchers: Dict[bool, smartMoveFinder.Searcher] = {}
+    for isWhite, config in ((True, white), (False, black)):
+        if config.name not in _tables:
+            _tables[config.name] = tt.TranspositionTable(smartMoveFinder.TT_SIZE_MB)
+        _tables[config.name].clear()
+        onInfo = smartMoveFinder.searchInfoLogger(searchLog, game=index, engine=config.name) if searchLog else None
+        searchers[isWhite] = smartMoveFinder.Searcher(_tables[config.name], onInfo=onInfo)
+    nodes: Dict[bool, int] = {True: 0, False: 0}
+    seconds: Dict[bool, float] = {True: 0.0, False: 0.0}
+    sanMoves: List[str] = []
+
+    while True:
+        validMoves: List[chessEngine.Move] = gamestate.getValidMoves()
+        if gamestate.checkmate:
+            result, termination = ("0-1" if gamestate.whiteToMove else "1-0"), "checkmate"
+            break
+        if gamestate.stalemate:
+            result, termination = "1/2-1/2", "stalemate"
+            break
+        if gamestate.halfmoveClock >= 100:
+            result, termination = "1/2-1/2", "fifty-move rule"
+            break
+        if gamestate.zobristKeyLog.count(gamestate.zobristKey) >= 3:
+            result, termination = "1/2-1/2", "threefold repetition"
+            break
+        if insufficientMaterial(gamestate):
+            result, termination = "1/2-1/2", "insufficient material"
+            break
+        if len(sanMoves) >= maxPlies:
+            result, termination = "1/2-1/2", "move limit"
+            break
+
+        side: bool = gamestate.whiteToMove
+        config: EngineConfig = white if side else black
+        searcher: smartMoveFinder.Searcher = searchers[side]
+        applyConfig(config)
+        startTime: float = time.perf_counter()
+        # The searcher shuffles and reorders the list it is given, so it gets a copy.
+        if config.timeMs is not None:
+            move, _ = searcher.findBestMoveTimed(gamestate, list(validMoves), config.timeMs, config.depth or smartMoveFinder.MAX_DEPTH)
+        else:
+            move = searcher.findBestMove(gamestate, list(validMoves), config.depth)
+        seconds[side] += time.perf_counter() - startTime
+        nodes[side] += searcher.nodes
+        if move is None:
+            move = smartMoveFinder.findRandomMove(validMoves)
+        sanMoves.append(pgn.moveToSAN(gamestate, move, validMoves))
+        gamestate.makeMove(move)
+
+    return GameRecord(index, fen, white.name, black.name, sanMoves, result, termination,
+                      nodes[True], nodes[False], seconds[True], seconds[False])
+
+
+# Function to get the Elo difference that an expected score stands for.
+def eloFromScore(score: float) -> float:
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1) + 0.0  # + 0.0 turns -0.0 into 0.0
+
+
+# Function to summarise wins, draws and losses: score, Elo difference with its 95% interval and the
+# likelihood of superiority (the chance the first engine is the stronger).
+def matchStatistics(wins: int, draws: int, losses: int) -> Dict[str, float]:
+    games: int = wins + draws + losses
+    score: float = (wins + draws / 2) / games if games else 0.5
+    variance: float = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games if games else 0.0
+    margin: float = 1.96 * math.sqrt(variance / games) if games else 0.0
+    decisive: int = wins + losses
+    return {
+        'score': score,
+        'elo': eloFromScore(score),
+        'eloLow': eloFromScore(score - margin),
+        'eloHigh': eloFromScore(score + margin),
+        'los': 0.5 * (1 + math.erf((wins - losses) / math.sqrt(2 * decisive))) if decisive else 0.5,
+    }
+
+
+# Function to run a sequential probability ratio test of H0: Elo difference elo0 against H1: elo1, with the
+# normal approximation of the game score. Returns the log-likelihood ratio, its lower and upper bounds and the
+# decision: "H1" (the difference is at least elo1), "H0" (at most elo0) or "continue".
+def sprt(wins: float, draws: float, losses: float, elo0: float, elo1: float,
+         alpha: float = 0.05, beta: float = 0.05) -> Tuple[float, float, float, str]:
+    lower: float = math.log(beta / (1 - alpha))
+    upper: float = math.log((1 - beta) / alpha)
+    games: float = wins + draws + losses
+    if games == 0:
+        return 0.0, lower, upper, "continue"
+    score: float = (wins + draws / 2) / games
+    variance: float = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance == 0:
+        # Games that all ended alike (e.g. a clean sweep) give no variance; count half a win and half a loss more.
+        return sprt(wins + 0.5, draws, losses + 0.5, elo0, elo1, alpha, beta)
+    score0: float = 1 / (1 + 10 ** (-elo0 / 400))
+    score1: float = 1 / (1 + 10 ** (-elo1 / 400))
+    llr: float = games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+    decision: str = "H1" if llr >= upper else "H0" if llr <= lower else "continue"
+    return llr, lower, upper, decision
+
+
+# Function to play a match of numGames games between engines a and b across worker processes. Every start
+# position is played twice with colours swapped. Prints each result as it comes in and the statistics at the
+# end, and writes the games to pgnPath if given. With sprtBounds (elo0, elo1) the match stops early once the
+# test is decided. searchLog is passed on to playGame. Returns the games played, in order.
+def runMatch(a: EngineConfig, b: EngineConfig, numGames: int, fens: List[str], processes: Optional[int] = None,
+             pgnPath: Optional[str] = None, seed: int = 0, sprtBounds: Optional[Tuple[float, float]] = None,
+             maxPlies: int = MAX_PLIES, searchLog: Optional[str] = None) -> List[GameRecord]:
+    wins = draws = losses = 0
+    records: List[GameRecord] = []
+    startTime: float = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending: Set[Future] = set()
+        for i in range(numGames):
+            fen: str = fens[(i // 2) % len(fens)]
+            white, black = (a, b) if i % 2 == 0 else (b, a)
+            pending.add(executor.submit(playGame, i, fen, white, black, seed + i, maxPlies, searchLog))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.cancelled():
+                    continue
+                record: GameRecord = future.result()
+                records.append(record)
+                points: str = record.result if record.white == a.name else {"1-0": "0-1", "0-1": "1-0"}.get(record.result, record.result)
+                wins += points == "1-0"
+                losses += points == "0-1"
+                draws += points == "1/2-1/2"
+                print(f"game {len(records):>4}/{numGames}  {record.white} vs {record.black}  {record.result:<7} "
+                      f"({record.termination}, {len(record.moves)} plies)  W {wins} D {draws} L {losses}", flush=True)
+            if sprtBounds is not None and sprt(wins, draws, losses, *sprtBounds)[3] != "continue":
+                for future in pending:
+                    future.cancel()
+    elapsed: float = time.perf_counter() - startTime
+    records.sort(key=lambda record: record.index)
+
+    if pgnPath is not None:
+        with open(pgnPath, "w", encoding="utf-8") as out:
+            for record in records:
+                headers: Dict[str, str] = {"Event": f"{a.name} vs {b.name}", "Site": "matchRunner", "Date": time.strftime("%Y.%m.%d"),
+                                           "Round": str(record.index + 1), "White": record.white, "Black": record.black,
+                                           "Result": record.result, "Termination": record.termination}
+                if record.fen != startPositions[0]:
+                    headers["SetUp"] = "1"
+                    headers["FEN"] = record.fen
+                pgn.writeGame(out, headers, record.moves)
+
+    statistics: Dict[str, float] = matchStatistics(wins, draws, losses)
+    print(f"Score of {a.name} vs {b.name}: W {wins} D {draws} L {losses}  [{statistics['score']:.3f}]  {len(records)} games in {elapsed:.1f}s")
+    print(f"Elo difference {statistics['elo']:+.1f} (95% {statistics['eloLow']:+.1f} to {statistics['eloHigh']:+.1f}), "
+          f"LOS {100 * statistics['los']:.1f}%")
+    if sprtBounds is not None:
+        llr, lower, upper, decision = sprt(wins, draws, losses, *sprtBounds)
+        print(f"SPRT elo0 {sprtBounds[0]:g} elo1 {sprtBounds[1]:g}: LLR {llr:.2f} [{lower:.2f}, {upper:.2f}] {decision}")
+    for config in (a, b):
+        nodes: int = sum(r.whiteNodes if r.white == config.name else r.blackNodes for r in records)
+        seconds: float = sum(r.whiteSeconds if r.white == config.name else r.blackSeconds for r in records)
+        print(f"{config.name}: {nodes} nodes in {seconds:.1f}s search, {nodes / max(seconds, 1e-9):.0f} nps")
+    totalNodes: int = sum(r.whiteNodes + r.blackNodes for r in records)
+    print(f"total: {totalNodes} nodes, {totalNodes / max(elapsed, 1e-9):.0f} nodes/s over {processes or os.cpu_count()} processes")
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play a match between two engine configurations without the web server.")
+    parser.add_argument("-a", "--engine-a", default="name=A", help='first engine, e.g. "name=new,depth=4,quiescence=off,N=3.2,weights=tuned.json"')
+    parser.add_argument("-b", "--engine-b", default="name=B", help="second engine, same format")
+    parser.add_argument("-n", "--games", type=int, default=20, help="number of games (each opening is played with both colours)")
+    parser.add_argument("-p", "--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--fens", help="file with one start FEN per line (default: built-in openings)")
+    parser.add_argument("--pgn", help="file to write the games to")
+    parser.add_argument("--seed", type=int, default=0, help="random seed; game i uses seed + i")
+    parser.add_argument("--sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"), help="stop once an SPRT of ELO0 against ELO1 is decided")
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES, help="adjudicate a draw after this many plies")
+    parser.add_argument("--search-log", help="JSON lines file to append the statistics of every search iteration to")
+    args = parser.parse_args()
+
+    engineA = parseEngine(args.engine_a, "A")
+    engineB = parseEngine(args.engine_b, "B")
+    if engineA.name == engineB.name:
+        parser.error("the two engines need different names")
+    if args.fens:
+        with open(args.fens) as fenFile:
+            openings = [line.strip() for line in fenFile if line.strip() and not line.startswith("#")]
+    else:
+        openings = startPositions
+    runMatch(engineA, engineB, args.games, openings, args.processes, args.pgn, args.seed,
+             tuple(args.sprt) if args.sprt else None, args.max_plies, args.search_log)
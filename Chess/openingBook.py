@@ -0,0 +1,144 @@
+import argparse
+import mmap
+import random
+import struct
+from typing import Dict, List, Optional, Tuple
+import chessEngine, pgn
+
+# Book entries use the Polyglot record layout: 16 bytes, big-endian, sorted by key:
+# key (8), move (2), weight (2), learn (4). The key is GameState.zobristKey rather than the Polyglot hash,
+# so books are built from PGN with buildBook below instead of taken from other programs.
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+MAX_PLY: int = 20  # positions deeper than this many plies into the game are not looked up
+MAX_WEIGHT: int = 0xFFFF
+
+
+# Function to encode a move the Polyglot way: to file, to rank, from file, from rank (3 bits each, rank 0 is the
+# first rank) and promotion piece (4 is a queen). Castling is written as the king capturing its own rook.
+def encodeBookMove(move: chessEngine.Move) -> int:
+    endColumn: int = move.endColumn
+    if move.isCastleMove:
+        endColumn = 7 if move.endColumn == 6 else 0
+    promotion: int = 4 if move.isPawnPromotion else 0
+    return endColumn | (7 - move.endRow) << 3 | move.startColumn << 6 | (7 - move.startRow) << 9 | promotion << 12
+
+
+# Function to get the number of plies played since the start position, from the FEN move counters.
+def gamePly(gamestate: chessEngine.GameState) -> int:
+    return 2 * (gamestate.fullmoveNumber - 1) + (0 if gamestate.whiteToMove else 1)
+
+
+# Read-only opening book memory-mapped from a .bin file; the OS pages in only the records a probe touches.
+class OpeningBook:
+    def __init__(self, path: str, maxPly: int = MAX_PLY):
+        self.path: str = path
+        self.maxPly: int = maxPly
+        self.file = open(path, "rb")
+        size: int = self.file.seek(0, 2)
+        self.numEntries: int = size // ENTRY.size
+        self.data: Optional[mmap.mmap] = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    # Method to get the (move, weight) entries of a position, with moves in book encoding.
+    def entries(self, key: int) -> List[Tuple[int, int]]:
+        if self.data is None:
+            return []
+        low: int = 0
+        high: int = self.numEntries
+        while low < high:
+            middle: int = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found: List[Tuple[int, int]] = []
+        for i in range(low, self.numEntries):
+            entryKey, move, weight, _ = ENTRY.unpack_from(self.data, i * ENTRY.size)
+            if entryKey != key:
+                break
+            found.append((move, weight))
+        return found
+
+    # Method to pick a book move for the position, at random in proportion to the entry weights.
+    # Returns one of validMoves, or None if the position is past maxPly or not in the book.
+    def chooseMove(self, gamestate: chessEngine.GameState, validMoves: List[chessEngine.Move],
+                   rng: random.Random = random) -> Optional[chessEngine.Move]:
+        if gamePly(gamestate) >= self.maxPly:
+            return None
+        movesByCode: Dict[int, chessEngine.Move] = {encodeBookMove(move): move for move in validMoves}
+        candidates: List[Tuple[chessEngine.Move, int]] = [(movesByCode[code], weight) for code, weight in self.entries(gamestate.zobristKey)
+                                                           if code in movesByCode and weight > 0]
+        if not candidates:
+            return None
+        return rng.choices([move for move, _ in candidates], weights=[weight for _, weight in candidates])[0]
+
+    # Method to unmap and close the book file.
+    def close(self) -> None:
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+
+# Function to build a book from PGN files. Every move of the first maxPly plies of each game is counted for its
+# position, weighted 2 for a win of the side that played it, 1 for a draw and 0 for a loss (unfinished games count
+# as draws). Games are followed until a move the engine cannot play, e.g. an under-promotion.
+# Returns the number of games read and the number of entries written.
+def buildBook(pgnPaths: List[str], outPath: str, maxPly: int = MAX_PLY) -> Tuple[int, int]:
+    weights: Dict[int, Dict[int, int]] = {}
+    games: int = 0
+    for path in pgnPaths:
+        with open(path, encoding="utf-8", errors="replace") as stream:
+            for headers, sanMoves in pgn.readGames(stream):
+                games += 1
+                result: str = headers.get("Result", "*")
+                points: Dict[bool, int] = {True: 2 if result == "1-0" else 0 if result == "0-1" else 1,
+                                           False: 2 if result == "0-1" else 0 if result == "1-0" else 1}
+                gamestate: chessEngine.GameState = chessEngine.GameState()
+                if "FEN" in headers:
+                    gamestate.loadFEN(headers["FEN"])
+                for san in sanMoves[:maxPly]:
+                    move: Optional[chessEngine.Move] = pgn.moveFromSAN(san, gamestate.getValidMoves())
+                    if move is None:
+                        break
+                    positionWeights: Dict[int, int] = weights.setdefault(gamestate.zobristKey, {})
+                    code: int = encodeBookMove(move)
+                    positionWeights[code] = positionWeights.get(code, 0) + points[gamestate.whiteToMove]
+                    gamestate.makeMove(move)
+
+    entries: List[Tuple[int, int, int]] = []
+    for key, moveWeights in weights.items():
+        # Weights of a position are scaled down together if the largest does not fit in 16 bits.
+        largest: int = max(moveWeights.values())
+        for code, weight in moveWeights.items():
+            if weight > 0:
+                entries.append((key, code, max(1, weight * MAX_WEIGHT // largest) if largest > MAX_WEIGHT else weight))
+    entries.sort(key=lambda entry: (entry[0], -entry[2]))
+    with open(outPath, "wb") as out:
+        for key, code, weight in entries:
+            out.write(ENTRY.pack(key, code, weight, 0))
+    return games, len(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or probe an opening book.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("pgn", nargs="+", help="PGN files to read")
+    build.add_argument("-o", "--output", default="book.bin", help="book file to write (default: book.bin)")
+    build.add_argument("--max-ply", type=int, default=MAX_PLY, help="plies of each game to include")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book", help="book file")
+    probe.add_argument("fen", nargs="?", default="rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", help="position (default: start position)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        numGames, numEntries = buildBook(args.pgn, args.output, args.max_ply)
+        print(f"{numGames} games, {numEntries} entries written to {args.output}")
+    else:
+        book = OpeningBook(args.book)
+        gamestate = chessEngine.GameState.fromFEN(args.fen)
+        movesByCode = {encodeBookMove(move): move for move in gamestate.getValidMoves()}
+        for code, weight in book.entries(gamestate.zobristKey):
+            move = movesByCode.get(code)
+            print(f"{move.getChessNotation() if move is not None else hex(code)}  {weight}")
+        book.close()
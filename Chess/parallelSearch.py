@@ -0,0 +1,163 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+import chessEngine, smartMoveFinder
+import transpositionTable as tt
+
+# Positions timed by the speedup benchmark: the start position, two middlegames and an endgame.
+benchmarkPositions: List[str] = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+
+
+# Function run by each worker process: attach to the shared transposition table, then search every job it is
+# sent until it gets None. Completed iterations are reported as (jobID, worker, depth, move, score) and the end of
+# a job as (jobID, worker, None, None, nodes); job 0 is the report that the worker is ready.
+def workerLoop(workerIndex: int, tableName: str, tableSizeMb: float, jobs: multiprocessing.Queue,
+               results: multiprocessing.Queue, stopEvent) -> None:
+    sharedMemory = shared_memory.SharedMemory(name=tableName)
+    searcher = smartMoveFinder.Searcher(tt.TranspositionTable(tableSizeMb, sharedMemory.buf), stopEvent)
+    results.put((0, workerIndex, None, None, 0))
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        jobID, fen, backend, timeLimitMs, maxDepth = job
+        gamestate = chessEngine.GameState.fromFEN(fen, backend)
+        validMoves = gamestate.getValidMoves()
+
+        def report(depth, move, score):
+            results.put((jobID, workerIndex, depth, move.getChessNotation() if move is not None else None, score))
+
+        # Odd workers start one ply deeper, so half of them are always an iteration ahead of the others.
+        startDepth = min(1 + workerIndex % 2, maxDepth)
+        searcher.findBestMoveTimed(gamestate, validMoves, timeLimitMs, maxDepth, startDepth, report)
+        results.put((jobID, workerIndex, None, None, searcher.nodes))
+    searcher.transpositionTable.release()
+    sharedMemory.close()
+
+
+# Lazy SMP search: every worker process searches the same root with iterative deepening, sharing one
+# transposition table in shared memory. Workers differ only in their shuffled root order and staggered depths,
+# and speed each other up through the table. The move of the deepest iteration any worker completed is played.
+# The workers and the table persist between searches, like the table of the single-process search.
+class ParallelSearch:
+    def __init__(self, numWorkers: Optional[int] = None, tableSizeMb: float = smartMoveFinder.TT_SIZE_MB):
+        context = multiprocessing.get_context("spawn")
+        self.numWorkers: int = numWorkers or os.cpu_count() or 1
+        self.sharedMemory = shared_memory.SharedMemory(create=True, size=tt.bufferSize(tableSizeMb))
+        self.transpositionTable: tt.TranspositionTable = tt.TranspositionTable(tableSizeMb, self.sharedMemory.buf)
+        self.transpositionTable.clear()
+        self.stopEvent = context.Event()
+        self.results: multiprocessing.Queue = context.Queue()
+        self.jobQueues: List[multiprocessing.Queue] = [context.Queue() for _ in range(self.numWorkers)]
+        self.workers = [context.Process(target=workerLoop, daemon=True,
+                                        args=(i, self.sharedMemory.name, tableSizeMb, self.jobQueues[i], self.results, self.stopEvent))
+                        for i in range(self.numWorkers)]
+        for worker in self.workers:
+            worker.start()
+        # Wait for the workers to import the engine, so the first search does not spend its time budget on start-up.
+        for _ in self.workers:
+            self.results.get()
+        self.jobID: int = 0
+        self.lastNodes: int = 0
+        self.lastSeconds: float = 0.0
+
+    # Method to search the position until timeLimitMs runs out (None for no limit) or a worker completes maxDepth.
+    # Returns the best move, one of gamestate.getValidMoves(), and the depth it was found at, like findBestMoveTimed.
+    def search(self, gamestate: chessEngine.GameState, timeLimitMs: Optional[float] = None,
+               maxDepth: int = smartMoveFinder.MAX_DEPTH) -> Tuple[Optional[chessEngine.Move], int]:
+        self.jobID += 1
+        self.stopEvent.clear()
+        startTime: float = time.perf_counter()
+        job = (self.jobID, gamestate.boardToFEN(), gamestate.backend, timeLimitMs, maxDepth)
+        for jobs in self.jobQueues:
+            jobs.put(job)
+
+        bestMoveText: Optional[str] = None
+        depthReached: int = 0
+        running: int = self.numWorkers
+        nodes: int = 0
+        endTime: Optional[float] = startTime + timeLimitMs / 1000 if timeLimitMs is not None else None
+        outOfTime: bool = False
+        while running:
+            timeout = max(0.0, endTime - time.perf_counter()) if endTime is not None and not outOfTime else None
+            try:
+                jobID, _, depth, moveText, value = self.results.get(timeout=timeout)
+            except queue.Empty:
+                # Helpers whose first iteration is still running have no deadline of their own, so they are stopped
+                # here, but only once there is a move: until then the first iteration is allowed to finish.
+                outOfTime = True
+                if depthReached:
+                    self.stopEvent.set()
+                continue
+            if jobID != self.jobID:
+                continue
+            if depth is None:
+                # The first worker to finish (maxDepth reached, mate found or out of time) stops the others.
+                running -= 1
+                nodes += value
+                self.stopEvent.set()
+            elif depth > depthReached and moveText is not None:
+                depthReached = depth
+                bestMoveText = moveText
+                if outOfTime:
+                    self.stopEvent.set()
+
+        self.lastNodes = nodes
+        self.lastSeconds = time.perf_counter() - startTime
+        bestMove = next((move for move in gamestate.getValidMoves() if move.getChessNotation() == bestMoveText), None)
+        return bestMove, depthReached
+
+    # Method to empty the shared transposition table, e.g. between benchmark runs.
+    def clear(self) -> None:
+        self.transpositionTable.clear()
+
+    # Method to stop the workers and free the shared memory.
+    def close(self) -> None:
+        for jobs in self.jobQueues:
+            jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.transpositionTable.release()
+        self.sharedMemory.close()
+        self.sharedMemory.unlink()
+
+    def __enter__(self) -> 'ParallelSearch':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# Function to time a fixed-depth search of every benchmark position with each worker count, starting from an
+# empty table each time. Prints time to depth, speedup over the first worker count, and nodes per second.
+def runBenchmark(workerCounts: List[int], depth: int) -> None:
+    baseline: Optional[float] = None
+    for numWorkers in workerCounts:
+        with ParallelSearch(numWorkers) as search:
+            totalSeconds: float = 0.0
+            totalNodes: int = 0
+            for fen in benchmarkPositions:
+                search.clear()
+                search.search(chessEngine.GameState.fromFEN(fen), maxDepth=depth)
+                totalSeconds += search.lastSeconds
+                totalNodes += search.lastNodes
+        baseline = baseline or totalSeconds
+        print(f"workers {numWorkers:>2}  time {totalSeconds:7.2f}s  speedup {baseline / totalSeconds:5.2f}x"
+              f"  nodes {totalNodes:>9}  nps {totalNodes / max(totalSeconds, 1e-9):>8.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Lazy SMP search: time to depth versus number of worker processes.")
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to compare")
+    parser.add_argument("-d", "--depth", type=int, default=4, help="search depth")
+    args = parser.parse_args()
+    runBenchmark(args.workers, args.depth)
@@ -0,0 +1,175 @@
+import argparse
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+import chessEngine
+
+START_FEN: str = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# Reference positions with published leaf counts: (name, FEN, {depth: nodes}).
+# The engine only promotes to a queen, so depths are limited to those where no promotion is reachable, except
+# the two illegal en passant positions: their promotions only happen on the last ply, so the published counts
+# (1134888 and 1015133) minus three under-promotions per promoting leaf give the queen-only counts below.
+referencePositions: List[Tuple[str, str, Dict[int, int]]] = [
+    ("start", START_FEN, {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", {1: 48, 2: 2039, 3: 97862}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ("illegal ep move 1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", {6: 1134888 - 3 * 951}),
+    ("illegal ep move 2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", {6: 1015133 - 3 * 461}),
+    ("short castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", {6: 661072}),
+    ("long castling gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", {6: 803711}),
+    ("castle rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", {4: 1274206}),
+    ("castling prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", {4: 1720476}),
+    ("double check", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", {4: 23527}),
+]
+
+# FEN strings loadFEN must reject: (what is wrong, FEN).
+invalidFENs: List[Tuple[str, str]] = [
+    ("en passant square on rank 3 with white to move", "rnbqkbnr/pppp1ppp/8/8/4Pp2/8/PPPP1PPP/RNBQKBNR w KQkq e3 0 3"),
+    ("en passant square on rank 6 with black to move", "rnbqkbnr/pppp1ppp/8/3Pp3/8/8/PPP1PPPP/RNBQKBNR b KQkq e6 0 3"),
+    ("en passant square on rank 4", "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e4 0 1"),
+    ("seven ranks", "rnbqkbnr/pppppppp/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"),
+    ("side to move", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1"),
+    ("castling rights", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KX - 0 1"),
+    ("move clocks", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - x 1"),
+]
+
+
+# Function to count the leaf nodes of the legal move tree to the given depth.
+def perft(gamestate: chessEngine.GameState, depth: int) -> int:
+    if depth == 0:
+        return 1
+    moves: List[chessEngine.Move] = gamestate.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes: int = 0
+    for move in moves:
+        gamestate.makeMove(move)
+        nodes += perft(gamestate, depth - 1)
+        gamestate.undoMove()
+    return nodes
+
+
+# Function to count the leaf nodes below each root move, keyed by the move in coordinate notation.
+def divide(gamestate: chessEngine.GameState, depth: int) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for move in gamestate.getValidMoves():
+        gamestate.makeMove(move)
+        counts[move.getChessNotation()] = perft(gamestate, depth - 1)
+        gamestate.undoMove()
+    return counts
+
+
+# Function to run perft from a FEN and time it. Returns (nodes, seconds).
+def runPerft(fen: str, depth: int, backend: str = "mailbox") -> Tuple[int, float]:
+    gamestate: chessEngine.GameState = chessEngine.GameState(backend)
+    gamestate.loadFEN(fen)
+    startTime: float = time.perf_counter()
+    nodes: int = perft(gamestate, depth)
+    return nodes, time.perf_counter() - startTime
+
+
+# Function to measure the memory behind move generation, to compare move representations.
+# Returns (bytes per Move object, peak traced bytes during perft to depth). Tracing slows perft down, so time it separately.
+def measureMemory(fen: str, depth: int, backend: str = "mailbox") -> Tuple[float, int]:
+    gamestate: chessEngine.GameState = chessEngine.GameState(backend)
+    gamestate.loadFEN(fen)
+    move: chessEngine.Move = gamestate.getValidMoves()[0]
+    tracemalloc.start()
+    before: int = tracemalloc.get_traced_memory()[0]
+    sample: List[chessEngine.Move] = [chessEngine.Move((move.startRow, move.startColumn), (move.endRow, move.endColumn), gamestate.board) for _ in range(1000)]
+    moveBytes: float = (tracemalloc.get_traced_memory()[0] - before) / len(sample)
+    del sample
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    perft(gamestate, depth)
+    peak: int = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return moveBytes, peak
+
+
+# Function to run the reference positions up to maxDepth and compare against the expected counts.
+# Returns True if every count matched.
+def runSuite(maxDepth: int, backend: str = "mailbox") -> bool:
+    allPassed: bool = True
+    totalNodes: int = 0
+    totalTime: float = 0.0
+    for name, fen, expected in referencePositions:
+        for depth, expectedNodes in sorted(expected.items()):
+            if depth > maxDepth:
+                continue
+            nodes, seconds = runPerft(fen, depth, backend)
+            totalNodes += nodes
+            totalTime += seconds
+            passed: bool = nodes == expectedNodes
+            allPassed = allPassed and passed
+            print(f"{'ok  ' if passed else 'FAIL'} {name:<28} depth {depth}  {nodes:>9} / {expectedNodes:<9} {seconds:8.2f}s {nodes / max(seconds, 1e-9):>10.0f} nps")
+    print(f"total {totalNodes} nodes in {totalTime:.2f}s, {totalNodes / max(totalTime, 1e-9):.0f} nps ({backend})")
+    return allPassed
+
+
+# Function to check FEN import and export: every position of the move trees of the reference positions to depth
+# must load back from its FEN with the same FEN, board and Zobrist key, and every invalid FEN must be rejected.
+# Returns True if all passed.
+def checkFENs(depth: int, backend: str = "mailbox") -> bool:
+    failures: int = 0
+    positions: int = 0
+
+    def visit(gamestate: chessEngine.GameState, remaining: int) -> None:
+        nonlocal failures, positions
+        fen: str = gamestate.boardToFEN()
+        loaded: chessEngine.GameState = chessEngine.GameState.fromFEN(fen, backend)
+        positions += 1
+        if loaded.boardToFEN() != fen or loaded.board != gamestate.board or loaded.zobristKey != gamestate.zobristKey:
+            failures += 1
+            print(f"FAIL round trip {fen}")
+        if remaining > 0:
+            for move in gamestate.getValidMoves():
+                gamestate.makeMove(move)
+                visit(gamestate, remaining - 1)
+                gamestate.undoMove()
+
+    for _, fen, _ in referencePositions:
+        visit(chessEngine.GameState.fromFEN(fen, backend), depth)
+    for problem, fen in invalidFENs:
+        try:
+            chessEngine.GameState.fromFEN(fen, backend)
+        except ValueError:
+            continue
+        failures += 1
+        print(f"FAIL accepted invalid FEN ({problem}): {fen}")
+    print(f"{positions} positions round-tripped, {len(invalidFENs)} invalid FENs tried, {failures} failures ({backend})")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count move generation leaf nodes (perft) to validate and benchmark GameState.")
+    parser.add_argument("fen", nargs="?", default=START_FEN, help="position to search (default: start position)")
+    parser.add_argument("-d", "--depth", type=int, default=3, help="search depth, or the maximum depth with --suite")
+    parser.add_argument("--divide", action="store_true", help="print the node count below each root move")
+    parser.add_argument("--backend", choices=("mailbox", "bitboard"), default="mailbox", help="move generator to use")
+    parser.add_argument("--suite", action="store_true", help="run the reference positions and check the expected counts")
+    parser.add_argument("--memory", action="store_true", help="also report bytes per Move and peak memory during perft")
+    parser.add_argument("--fen-check", action="store_true", help="round-trip the FENs of the reference positions' move trees to depth and try invalid FENs")
+    args = parser.parse_args()
+
+    if args.fen_check:
+        raise SystemExit(0 if checkFENs(args.depth, args.backend) else 1)
+    if args.suite:
+        raise SystemExit(0 if runSuite(args.depth, args.backend) else 1)
+    gamestate = chessEngine.GameState(args.backend)
+    gamestate.loadFEN(args.fen)
+    startTime = time.perf_counter()
+    if args.divide:
+        counts = divide(gamestate, args.depth)
+        for moveText, count in sorted(counts.items()):
+            print(f"{moveText}: {count}")
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(gamestate, args.depth)
+    seconds = time.perf_counter() - startTime
+    print(f"nodes {nodes}  time {seconds:.2f}s  nps {nodes / max(seconds, 1e-9):.0f}  {1e6 * seconds / max(nodes, 1):.2f} us/node")
+    if args.memory:
+        moveBytes, peak = measureMemory(args.fen, args.depth, args.backend)
+        print(f"{moveBytes:.0f} bytes per Move  peak {peak / 1024:.0f} KiB during perft")
@@ -0,0 +1,145 @@
+import re
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+import chessEngine
+
+RESULTS: Tuple[str, ...] = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER: Tuple[str, ...] = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+LINE_LENGTH: int = 80
+
+_headerPattern = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+# Comments, NAGs and move numbers are dropped from the movetext; variations are removed separately since they nest.
+_noisePattern = re.compile(r"\{[^}]*\}|;[^\n]*|\$\d+|\d+\.(?:\.\.)?")
+_sanPattern = re.compile(r"^([KQRBN])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([QRBN]))?$")
+
+
+# Function to read the games of a PGN file one at a time. Yields (headers, SAN moves) with the result token,
+# comments, variations, NAGs and move numbers removed from the moves.
+def readGames(stream: TextIO) -> Iterator[Tuple[Dict[str, str], List[str]]]:
+    headers: Dict[str, str] = {}
+    movetext: List[str] = []
+    for line in stream:
+        line = line.strip()
+        if line.startswith("[") and not movetext:
+            match = _headerPattern.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+            continue
+        if not line:
+            continue
+        movetext.append(line)
+        if any(token in RESULTS for token in line.split()):
+            yield headers, parseMovetext("\n".join(movetext))
+            headers, movetext = {}, []
+    if movetext:
+        yield headers, parseMovetext("\n".join(movetext))
+
+
+# Function to split PGN movetext into SAN moves.
+def parseMovetext(movetext: str) -> List[str]:
+    text: str = _noisePattern.sub(" ", movetext)
+    withoutVariations: List[str] = []
+    nesting: int = 0
+    for char in text:
+        if char == "(":
+            nesting += 1
+        elif char == ")":
+            nesting = max(0, nesting - 1)
+        elif nesting == 0:
+            withoutVariations.append(char)
+    return [token for token in "".join(withoutVariations).split() if token not in RESULTS]
+
+
+# Function to find the move a SAN string (e.g. "Nbd7", "exd6", "O-O", "e8=Q+") stands for among the valid moves.
+# Returns None if it matches none of them, including under-promotions, which the engine does not generate.
+def moveFromSAN(san: str, validMoves: List[chessEngine.Move]) -> Optional[chessEngine.Move]:
+    san = san.rstrip("+#!?")
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endColumn: int = 6 if len(san) == 3 else 2
+        return next((move for move in validMoves if move.isCastleMove and move.endColumn == endColumn), None)
+    match = _sanPattern.match(san)
+    if match is None:
+        return None
+    piece, fromFile, fromRank, target, promotion = match.groups()
+    if promotion is not None and promotion != "Q":
+        return None
+    pieceType: str = piece or "p"
+    endRow: int = chessEngine.Move.ranksToRows[target[1]]
+    endColumn = chessEngine.Move.filesToCols[target[0]]
+    for move in validMoves:
+        if (move.pieceMoved[1] == pieceType and move.endRow == endRow and move.endColumn == endColumn and not move.isCastleMove
+                and (fromFile is None or move.startColumn == chessEngine.Move.filesToCols[fromFile])
+                and (fromRank is None or move.startRow == chessEngine.Move.ranksToRows[fromRank])):
+            return move
+    return None
+
+
+# Function to write a move of the current position in SAN, with "+" or "#" if it gives check or mate.
+# validMoves are the valid moves of the position, which decide whether the piece has to be disambiguated.
+def moveToSAN(gamestate: chessEngine.GameState, move: chessEngine.Move, validMoves: List[chessEngine.Move]) -> str:
+    if move.isCastleMove:
+        san: str = "O-O" if move.endColumn == 6 else "O-O-O"
+    else:
+        pieceType: str = move.pieceMoved[1]
+        target: str = move.getRankFile(move.endRow, move.endColumn)
+        capture: str = "x" if move.isCapture else ""
+        if pieceType == "p":
+            san = (chessEngine.Move.colsToFiles[move.startColumn] + "x" if move.isCapture else "") + target + ("=Q" if move.isPawnPromotion else "")
+        else:
+            rivals: List[chessEngine.Move] = [other for other in validMoves if other.pieceMoved == move.pieceMoved and other != move
+                                              and other.endRow == move.endRow and other.endColumn == move.endColumn]
+            origin: str = ""
+            if rivals:
+                if all(other.startColumn != move.startColumn for other in rivals):
+                    origin = chessEngine.Move.colsToFiles[move.startColumn]
+                elif all(other.startRow != move.startRow for other in rivals):
+                    origin = chessEngine.Move.rowsToRanks[move.startRow]
+                else:
+                    origin = move.getRankFile(move.startRow, move.startColumn)
+            san = pieceType + origin + capture + target
+    gamestate.makeMove(move)
+    gamestate.getValidMoves()
+    if gamestate.checkmate:
+        san += "#"
+    elif gamestate.inCheck:
+        san += "+"
+    gamestate.undoMove()
+    return san
+
+
+# Function to write one game in PGN: the Seven Tag Roster, the other headers, then the movetext wrapped to
+# LINE_LENGTH columns and ended by the result. Move numbers start from the FEN header if there is one.
+def writeGame(stream: TextIO, headers: Dict[str, str], sanMoves: List[str]) -> None:
+    result: str = headers.get("Result", "*")
+    names: List[str] = list(SEVEN_TAG_ROSTER) + [name for name in headers if name not in SEVEN_TAG_ROSTER]
+    for name in names:
+        value: str = headers.get(name, "?" if name != "Result" else result)
+        value = value.replace("\\", "\\\\").replace('"', '\\"')
+        stream.write(f'[{name} "{value}"]\n')
+    stream.write("\n")
+
+    moveNumber: int = 1
+    whiteToMove: bool = True
+    if "FEN" in headers:
+        fields: List[str] = headers["FEN"].split()
+        whiteToMove = fields[1] == "w"
+        moveNumber = int(fields[5]) if len(fields) > 5 else 1
+    tokens: List[str] = []
+    for i, san in enumerate(sanMoves):
+        if whiteToMove:
+            tokens.append(f"{moveNumber}.")
+        elif i == 0:
+            tokens.append(f"{moveNumber}...")
+        tokens.append(san)
+        if not whiteToMove:
+            moveNumber += 1
+        whiteToMove = not whiteToMove
+    tokens.append(result)
+
+    line: str = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            stream.write(line + "\n")
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    stream.write(line + "\n\n")
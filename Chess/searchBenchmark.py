@@ -0,0 +1,126 @@
+import argparse
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import chessEngine, parallelSearch, smartMoveFinder
+
+# Search techniques compared by the benchmark, by their switch in smartMoveFinder.
+TECHNIQUES: Tuple[str, ...] = ("PVS", "ASPIRATION", "NULL_MOVE", "LMR", "STAGED_MOVES")
+
+# The first ten positions of the Win At Chess test suite with their best moves, then the Lazy SMP benchmark
+# positions, which have no single best move and only count towards nodes and time.
+suitePositions: List[Tuple[str, Optional[str]]] = [
+    ("2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1", "g3g6"),
+    ("8/7p/5k2/5p2/p1p2P2/Pr1pPK2/1P1R3P/8 b - - 0 1", "b3b2"),
+    ("5rk1/1ppb3p/p1pb4/6q1/3P1p1r/2P1R2P/PP1BQ1P1/5RKN w - - 0 1", "e3g3"),
+    ("r1bq2rk/pp3pbp/2p1p1pQ/7P/3P4/2PB1N2/PP3PPR/2KR4 w - - 0 1", "h6h7"),
+    ("5k2/6pp/p1qN4/1p1p4/3P4/2PKP2Q/PP3r2/3R4 b - - 0 1", "c6c4"),
+    ("7k/p7/1R5K/6r1/6p1/6P1/8/8 w - - 0 1", "b6b7"),
+    ("rnbqkb1r/pppp1ppp/8/4P3/6n1/7P/PPPNPPP1/R1BQKBNR b KQkq - 0 1", "g4e3"),
+    ("r4q1k/p2bR1rp/2p2Q1N/5p2/5p2/2P5/PP3PPP/R5K1 w - - 0 1", "e7f7"),
+    ("3q1rk1/p4pp1/2pb3p/3p4/6Pr/1PNQ4/P1PB1PP1/4RRK1 b - - 0 1", "d6h2"),
+    ("2br2k1/2q3rn/p2NppQ1/2p1P3/Pp5R/4P3/1P3PPP/3R2K1 w - - 0 1", "h4h7"),
+] + [(fen, None) for fen in parallelSearch.benchmarkPositions]
+
+
+# The outcome of searching one suite position.
+class PositionResult(NamedTuple):
+    move: Optional[str]
+    nodes: int
+    seconds: float
+    researches: int
+    movesGenerated: int
+    solved: Optional[bool]  # None for positions without a best move
+
+
+# Function to list the configurations to compare: everything on, each technique off on its own, and everything off.
+def configurations() -> List[Tuple[str, Dict[str, bool]]]:
+    configs: List[Tuple[str, Dict[str, bool]]] = [("all", {name: True for name in TECHNIQUES})]
+    for name in TECHNIQUES:
+        configs.append((f"no {name}", {other: other != name for other in TECHNIQUES}))
+    configs.append(("none", {name: False for name in TECHNIQUES}))
+    return configs
+
+
+# Function to search every suite position to depth with the given technique switches, each from an empty
+# transposition table. The switches are restored afterwards.
+def runSuite(features: Dict[str, bool], depth: int, backend: str = "mailbox") -> List[PositionResult]:
+    saved: Dict[str, bool] = {name: getattr(smartMoveFinder, name) for name in features}
+    searcher = smartMoveFinder.Searcher()
+    results: List[PositionResult] = []
+    try:
+        for name, enabled in features.items():
+            setattr(smartMoveFinder, name, enabled)
+        for fen, bestMove in suitePositions:
+            gamestate = chessEngine.GameState.fromFEN(fen, backend)
+            searcher.transpositionTable.clear()
+            start: float = time.perf_counter()
+            move, _ = searcher.findBestMoveTimed(gamestate, gamestate.getValidMoves(), None, depth)
+            notation: Optional[str] = move.getChessNotation() if move is not None else None
+            results.append(PositionResult(notation, searcher.nodes, time.perf_counter() - start, searcher.researches,
+                                          searcher.movesGenerated, notation == bestMove if bestMove is not None else None))
+    finally:
+        for name, enabled in saved.items():
+            setattr(smartMoveFinder, name, enabled)
+    return results
+
+
+# Function to run the suite with every configuration and print, per configuration, the nodes searched (and their
+# share of the nodes with every technique off), time, speed, re-searches, moves generated, test positions solved,
+# and how many positions got the same move as the search with every technique off.
+def runBenchmark(depth: int, verbose: bool = False, backend: str = "mailbox") -> None:
+    configs: List[Tuple[str, Dict[str, bool]]] = configurations()
+    # The search with everything off goes first, as the reference the others are compared to.
+    reference: List[PositionResult] = runSuite(configs[-1][1], depth, backend)
+    referenceNodes: int = sum(result.nodes for result in reference)
+    numTests: int = sum(1 for _, bestMove in suitePositions if bestMove is not None)
+    for name, features in configs:
+        results: List[PositionResult] = reference if name == "none" else runSuite(features, depth, backend)
+        nodes: int = sum(result.nodes for result in results)
+        seconds: float = sum(result.seconds for result in results)
+        solved: int = sum(1 for result in results if result.solved)
+        sameMove: int = sum(1 for result, base in zip(results, reference) if result.move == base.move)
+        print(f"{name:<16}  nodes {nodes:>9} ({100 * nodes / max(referenceNodes, 1):5.1f}%)  time {seconds:7.2f}s"
+              f"  nps {nodes / max(seconds, 1e-9):>7.0f}  researches {sum(result.researches for result in results):>6}"
+              f"  generated {sum(result.movesGenerated for result in results):>8}"
+              f"  solved {solved}/{numTests}  same move {sameMove}/{len(results)}")
+        if verbose:
+            for (fen, bestMove), result in zip(suitePositions, results):
+                print(f"    {result.move or '-':<6} {bestMove or '':<6} {result.nodes:>9}  {fen}")
+
+
+# Function to check that searches stopped by their time limit leave the position as it was: side to move, Zobrist
+# key, move log and the Zobrist and en passant logs. Each suite position is searched with every budget in
+# timeLimitsMs. Returns the (FEN, budget) pairs that failed, printing each.
+def checkTimeouts(timeLimitsMs: List[int], backend: str = "mailbox") -> List[Tuple[str, int]]:
+    failures: List[Tuple[str, int]] = []
+    for fen, _ in suitePositions:
+        for timeLimitMs in timeLimitsMs:
+            gamestate = chessEngine.GameState.fromFEN(fen, backend)
+            before = (gamestate.whiteToMove, gamestate.zobristKey, len(gamestate.moveLog), len(gamestate.zobristKeyLog),
+                      len(gamestate.enpassantPossibleLog))
+            try:
+                smartMoveFinder.Searcher().findBestMoveTimed(gamestate, gamestate.getValidMoves(), timeLimitMs)
+                after = (gamestate.whiteToMove, gamestate.zobristKey, len(gamestate.moveLog), len(gamestate.zobristKeyLog),
+                         len(gamestate.enpassantPossibleLog))
+                passed: bool = after == before
+            except RuntimeError:
+                passed = False
+            if not passed:
+                failures.append((fen, timeLimitMs))
+                print(f"position changed by a {timeLimitMs} ms search: {fen}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare node counts and test positions solved with each search technique switched off.")
+    parser.add_argument("-d", "--depth", type=int, default=4, help="search depth")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the result of every position")
+    parser.add_argument("--backend", choices=["mailbox", "bitboard"], default="mailbox", help="move generator")
+    parser.add_argument("--check-timeouts", type=int, nargs="+", metavar="MS",
+                        help="instead of benchmarking, check that searches stopped after MS milliseconds restore the position")
+    args = parser.parse_args()
+    if args.check_timeouts:
+        failed = checkTimeouts(args.check_timeouts, args.backend)
+        print(f"{len(failed)} of {len(suitePositions) * len(args.check_timeouts)} timed-out searches changed the position")
+    else:
+        runBenchmark(args.depth, args.verbose, args.backend)
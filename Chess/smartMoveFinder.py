@@ -1,8 +1,55 @@
+import hashlib
+import json
+import os
 import random
+import time
+from contextlib import contextmanager
 import numpy as np
+import endgameTablebase
+import transpositionTable as tt
 
 CHECKMATE = 1000
 STALEMATE = 0
+TT_SIZE_MB = 16
+MAX_DEPTH = 64  # deepest iteration of a time-limited search
+TIME_CHECK_INTERVAL = 256  # nodes between deadline checks
+MOVE_ORDERING = True  # set to False to search moves in generation order, e.g. to compare node counts
+STAGED_MOVES = True  # set to False to generate every legal move of a node up front instead of stage by stage
+QUIESCENCE = True  # set to False to score depth 0 nodes statically instead of resolving captures
+DELTA_MARGIN = 2  # material margin for delta pruning in the quiescence search
+EVAL_CONSISTENCY_CHECK = False  # set to True to assert the incremental evaluation matches a full rescan at every leaf
+TABLEBASES = True  # set to False to search endgames covered by the tablebases instead of looking them up
+TABLEBASE_WIN = CHECKMATE // 2  # score of a tablebase win, less the plies to mate; above any material score
+# Selective search techniques, each with its own switch so they can be compared with searchBenchmark or matchRunner.
+PVS = True  # set to False to search every move with the full window instead of proving later moves worse with a null window
+ASPIRATION = True  # set to False to start every iteration with the full window instead of one around the previous score
+NULL_MOVE = True  # set to False to stop pruning nodes where passing the turn still fails high
+LMR = True  # set to False to search late quiet moves to full depth instead of first to a reduced depth
+NULL_WINDOW = 0.01  # width of the windows used to test a move, below the smallest difference between two evaluations
+ASPIRATION_WINDOW = 0.5  # half width of the first aspiration window, in pawns; quadrupled after every fail
+NULL_MOVE_REDUCTION = 2  # extra plies taken off the search after a null move
+LMR_MIN_DEPTH = 3  # shallowest depth at which late moves are reduced
+LMR_FULL_MOVES = 3  # moves searched to full depth at a node before the rest are reduced
+LMR_REDUCTION = 1  # plies taken off a late move, unless it beats alpha and is searched again
+# Settings above that change search results, fingerprinted with the evaluation weights by settingsVersion.
+SEARCH_SETTINGS = ("MOVE_ORDERING", "STAGED_MOVES", "QUIESCENCE", "DELTA_MARGIN", "TABLEBASES", "PVS", "ASPIRATION", "NULL_MOVE",
+                   "LMR", "NULL_WINDOW", "ASPIRATION_WINDOW", "NULL_MOVE_REDUCTION", "LMR_MIN_DEPTH", "LMR_FULL_MOVES", "LMR_REDUCTION")
+
+# Move ordering score bands: hash move, then captures and promotions by MVV-LVA, then killers, then history.
+HASH_MOVE_SCORE = 10**9
+CAPTURE_SCORE = 10**8
+KILLER_SCORE = 10**7
+
+
+# Raised inside the search when the deadline passes, to unwind to the iterative deepening loop.
+class SearchTimeout(Exception):
+    pass
+
+# Shared between searches so later moves of a game reuse earlier work; counters are reset per search.
+transpositionTable = tt.TranspositionTable(TT_SIZE_MB)
+
+# Endgame tables found in endgameTablebase.DEFAULT_DIRECTORY, shared by all searches (none if not generated).
+endgameTablebases = endgameTablebase.Tablebases()
 
 pieceScores = {"K": 0, "Q": 8, "R": 5, "N": 3, "B": 3, "p": 1}
 
@@ -61,6 +108,52 @@ blackPawnScores = np.array([[0, 0, 0, 0, 0, 0, 0, 0],
                             [8, 8, 8, 8, 8, 8, 8, 8]])
 
 piecePositionScores = {"N": knightScores, "Q": queenScores, "B": bishopScores, "R": rookScores, "bp": blackPawnScores, "wp": whitePawnScores}
+POSITION_WEIGHT = 0.2  # pawns per point of the position tables
+WEIGHTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "evalWeights.json")  # loaded at startup if present
+
+# Function to find the position table of a piece such as "wN": its own table if it has one, else the table
+# shared by both colors, or None (kings have no table unless the weights file gives one)
+def positionScores(piece):
+    table = piecePositionScores.get(piece)
+    return table if table is not None else piecePositionScores.get(piece[1])
+
+# Function to combine material and position scores into one signed value per piece and square (index row * 8 + column)
+# GameState.setEvaluation sums these incrementally, which is what scoreBoard returns during a search
+def buildPieceSquareValues():
+    values = {}
+    for color, sign in (("w", 1), ("b", -1)):
+        for piece in pieceScores:
+            table = positionScores(color + piece)
+            values[color + piece] = [sign * (pieceScores[piece] + (float(table[row][column]) * POSITION_WEIGHT if table is not None else 0))
+                                     for row in range(8) for column in range(8)]
+    return values
+
+# Function to load evaluation weights written by texelTuning.py: piece values, the position tables by piece
+# ("wN", or "N" for both colors) and the position weight. Tables given replace the built-in ones
+def loadWeights(path):
+    global POSITION_WEIGHT, pieceSquareValues
+    with open(path) as file:
+        weights = json.load(file)
+    pieceScores.update({piece: float(value) for piece, value in weights.get("pieceScores", {}).items()})
+    tables = weights.get("piecePositionScores")
+    if tables:
+        piecePositionScores.clear()
+        piecePositionScores.update({piece: np.array(table, dtype=float).reshape(8, 8) for piece, table in tables.items()})
+    POSITION_WEIGHT = float(weights.get("positionWeight", POSITION_WEIGHT))
+    pieceSquareValues = buildPieceSquareValues()
+
+pieceSquareValues = buildPieceSquareValues()
+if os.path.exists(WEIGHTS_PATH):
+    loadWeights(WEIGHTS_PATH)
+
+# Function to fingerprint the current evaluation weights and SEARCH_SETTINGS, so results stored under other
+# weights or settings (e.g. before texelTuning.py wrote a weights file) can be told apart and dropped
+def settingsVersion():
+    settings = {name: globals()[name] for name in SEARCH_SETTINGS}
+    settings["pieceScores"] = pieceScores
+    settings["positionWeight"] = POSITION_WEIGHT
+    settings["piecePositionScores"] = {piece: np.asarray(table, dtype=float).tolist() for piece, table in piecePositionScores.items()}
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
 
 # Function to find a random move from a list of valid moves
 def findRandomMove(validMoves):
@@ -90,7 +183,7 @@ def findMove(gamestate, validMoves):
                 elif gamestate.stalemate: 
                     score = STALEMATE
                 else:
-                    score = -turnMultiplier * scoreBoard(gamestate.board)
+                    score = -turnMultiplier * scoreBoard(gamestate)
                 if score > opponentMaxScore:
                     opponentMaxScore = score
                 gamestate.undoMove()
@@ -102,92 +195,599 @@ def findMove(gamestate, validMoves):
     return bestPlayerMove
 
 # Function to find the best move using a minimax algorithm with a given depth
+# Thin wrapper around a new Searcher using the shared transposition table
 def findBestMove(gamestate, validMoves, DEPTH):
-    global nextMove, counter
-    counter = 0
-    random.shuffle(validMoves)
-    nextMove = None
-    findMoveNegaMaxAlphaBeta(gamestate, validMoves, DEPTH, DEPTH, -2*CHECKMATE, 2*CHECKMATE, 1 if gamestate.whiteToMove else -1)
-    return nextMove
+    return Searcher(transpositionTable).findBestMove(gamestate, validMoves, DEPTH)
+
+# Function to find the best move within a time budget using iterative deepening
+# Thin wrapper around a new Searcher using the shared transposition table, see Searcher.findBestMoveTimed
+def findBestMoveTimed(gamestate, validMoves, timeLimitMs, maxDepth=MAX_DEPTH, startDepth=1, onIteration=None):
+    return Searcher(transpositionTable).findBestMoveTimed(gamestate, validMoves, timeLimitMs, maxDepth, startDepth, onIteration)
+
+# Function to make the game state keep the evaluation incrementally from now on
+def attachEvaluation(gamestate):
+    if gamestate.pieceSquareValues is not pieceSquareValues:
+        gamestate.setEvaluation(pieceSquareValues)
+
+# Function to make an onInfo callback for Searcher that appends each report to a JSON lines file, for offline analysis
+# Extra fields (e.g. a game ID) are added to every line
+def searchInfoLogger(path, **fields):
+    def log(info):
+        with open(path, "a") as out:
+            out.write(json.dumps(dict(info, **fields)) + "\n")
+    return log
+
+# Function to turn a tablebase (result, plies) for the side to move into a search score
+# Shorter wins and longer losses score higher
+def tablebaseScore(entry):
+    result, plies = entry
+    return result * (TABLEBASE_WIN - plies) if result else STALEMATE
+
+
+# The state of a search: best move, principal variation, node counts and statistics, transposition table, killer
+# moves and history scores, deadline and stop event. Searchers share nothing but the transposition table and the read-only
+# tablebases they are given, so each game or thread can search with its own Searcher at the same time.
+# The results of the last search stay readable on the Searcher until the next one starts; statistics() sums them up.
+# onInfo, if given, is called with statistics() after every completed iteration.
+# With timePhases, the time spent in move generation, evaluation and make/undo is measured too, at some cost in speed.
+class Searcher:
+    def __init__(self, transpositionTable=None, stopEvent=None, tablebases=None, onInfo=None, timePhases=False):
+        self.transpositionTable = transpositionTable if transpositionTable is not None else tt.TranspositionTable(TT_SIZE_MB)
+        self.tablebases = tablebases if tablebases is not None else endgameTablebases
+        # Event (e.g. a multiprocessing.Event) that stops the running search when set, used by parallelSearch.
+        self.stopEvent = stopEvent
+        self.onInfo = onInfo
+        self.timePhases = timePhases
+        # Static evaluation, swapped for a timed wrapper while phases are timed.
+        self.evaluate = scoreBoard
+        self.reset()
+
+    # Method to clear the results, node counts, statistics and move ordering tables before a new search
+    def reset(self):
+        # Deadline (time.perf_counter() seconds) of the running time-limited search, None for fixed-depth searches.
+        self.deadline = None
+        self.startTime = time.perf_counter()
+        self.bestMove = None
+        self.bestScore = 0
+        self.principalVariation = []
+        self.nodes = 0
+        self.qNodes = 0
+        self.tablebaseHits = 0
+        self.depthReached = 0
+        # Deepest ply reached, quiescence included, beta cutoffs and how many came from the first move searched,
+        # nodes counted at the end of each iteration, and seconds per phase when timePhases is set.
+        self.selDepth = 0
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.iterationNodes = []
+        # Null moves that failed high, late moves searched to a reduced depth, and searches repeated with a wider
+        # window or to full depth because a null window, a reduction or an aspiration window turned out wrong.
+        self.nullMoveCutoffs = 0
+        # Moves generated (or rebuilt from a hash or killer move ID) by interior nodes and the quiescence search.
+        self.movesGenerated = 0
+        self.reductions = 0
+        self.researches = 0
+        self.phaseTimes = {"moveGen": 0.0, "eval": 0.0, "makeUndo": 0.0}
+        self.transpositionTable.resetStatistics()
+        self.resetMoveOrdering()
+
+    # Method to clear the killer moves and history scores
+    # Two killer move IDs per ply (quiet moves that caused a beta cutoff) and history scores per (piece, end square)
+    # The principal variation of each ply is kept in a triangular table: pvTable[ply] is the best line from that ply
+    def resetMoveOrdering(self):
+        self.killerMoves = [[-1, -1] for _ in range(MAX_DEPTH + 1)]
+        self.historyScores = {}
+        self.pvTable = [[] for _ in range(MAX_DEPTH + 2)]
+
+    # Method to find the best move searching to a fixed depth
+    def findBestMove(self, gamestate, validMoves, DEPTH):
+        self.reset()
+        random.shuffle(validMoves)
+        if self.useTablebaseMove(gamestate, validMoves, DEPTH):
+            self.reportInfo()
+            return self.bestMove
+        attachEvaluation(gamestate)
+        with self.phaseTimer(gamestate):
+            self.bestScore = self.findMoveNegaMaxAlphaBeta(gamestate, validMoves, DEPTH, DEPTH, -2*CHECKMATE, 2*CHECKMATE, 1 if gamestate.whiteToMove else -1)
+        self.principalVariation = self.pvTable[0]
+        self.depthReached = DEPTH
+        self.iterationNodes.append(self.nodes)
+        self.reportInfo()
+        return self.bestMove
+
+    # Method to find the best move within a time budget using iterative deepening
+    # Searches depth startDepth, startDepth + 1, ... until timeLimitMs runs out (None for no limit), maxDepth is done or
+    # stopEvent is set, starting each iteration from the previous best move
+    # onIteration, if given, is called with (depth, move, score) after every completed iteration
+    # Returns the best move of the deepest fully searched iteration and that depth
+    def findBestMoveTimed(self, gamestate, validMoves, timeLimitMs, maxDepth=MAX_DEPTH, startDepth=1, onIteration=None):
+        self.reset()
+        random.shuffle(validMoves)
+        if self.useTablebaseMove(gamestate, validMoves, maxDepth):
+            if onIteration is not None:
+                onIteration(self.depthReached, self.bestMove, self.bestScore)
+            self.reportInfo()
+            return self.bestMove, self.depthReached
+        attachEvaluation(gamestate)
+        with self.phaseTimer(gamestate):
+            self.iterativeDeepening(gamestate, validMoves, timeLimitMs, maxDepth, startDepth, onIteration)
+        return self.bestMove, self.depthReached
+
+    # Method to run the iterations of findBestMoveTimed
+    def iterativeDeepening(self, gamestate, validMoves, timeLimitMs, maxDepth, startDepth, onIteration):
+        startTime = self.startTime
+        moveLogLength = len(gamestate.moveLog)
+        zobristKey = gamestate.zobristKey
+        whiteToMove = gamestate.whiteToMove
+        turnMultiplier = 1 if gamestate.whiteToMove else -1
+
+        for depth in range(startDepth, maxDepth + 1):
+            # The first iteration always completes so there is a move to return even with a tiny budget.
+            self.deadline = startTime + timeLimitMs / 1000 if depth > startDepth and timeLimitMs is not None else None
+            if self.bestMove is not None:
+                validMoves.remove(self.bestMove)
+                validMoves.insert(0, self.bestMove)
+            previousBestMove = self.bestMove
+            try:
+                score = self.aspirationSearch(gamestate, validMoves, depth, turnMultiplier)
+            except SearchTimeout:
+                while len(gamestate.moveLog) > moveLogLength:
+                    gamestate.undoMove()
+                if gamestate.zobristKey != zobristKey or gamestate.whiteToMove != whiteToMove:
+                    raise RuntimeError("Search timeout left the position changed")
+                self.bestMove = previousBestMove
+                break
+            self.bestScore = score
+            self.principalVariation = self.pvTable[0]
+            self.depthReached = depth
+            self.iterationNodes.append(self.nodes)
+            if onIteration is not None:
+                onIteration(depth, self.bestMove, score)
+            self.reportInfo()
+            if abs(score) >= CHECKMATE or (timeLimitMs is not None and time.perf_counter() - startTime >= timeLimitMs / 1000):
+                break
+
+        self.deadline = None
+
+    # Method to search the root to depth with a window around the previous iteration's score, if ASPIRATION is set
+    # A score outside the window is only a bound, so the root is searched again with the window widened on that side
+    def aspirationSearch(self, gamestate, validMoves, depth, turnMultiplier):
+        alpha, beta = -2*CHECKMATE, 2*CHECKMATE
+        window = ASPIRATION_WINDOW
+        if ASPIRATION and self.depthReached and abs(self.bestScore) < TABLEBASE_WIN:
+            alpha, beta = self.bestScore - window, self.bestScore + window
+        while True:
+            score = self.findMoveNegaMaxAlphaBeta(gamestate, validMoves, depth, depth, alpha, beta, turnMultiplier)
+            if score <= alpha and alpha > -2*CHECKMATE:
+                window *= 4
+                alpha = max(score - window, -2*CHECKMATE)
+            elif score >= beta and beta < 2*CHECKMATE:
+                window *= 4
+                beta = min(score + window, 2*CHECKMATE)
+            else:
+                return score
+            self.researches += 1
+
+    # Method to sum up the running or last search: depth and selective depth, node counts and speed,
+    # transposition table hit rate, share of beta cutoffs made by the first move searched (a measure of move
+    # ordering), effective branching factor (nodes of the last iteration over those of the one before, or the
+    # depth-th root of all nodes for a single iteration), the best move, score and principal variation,
+    # and with timePhases the milliseconds spent per phase
+    def statistics(self):
+        elapsed = max(time.perf_counter() - self.startTime, 1e-9)
+        iterations = [nodes - previous for previous, nodes in zip([0] + self.iterationNodes, self.iterationNodes)]
+        if len(iterations) > 1 and iterations[-2]:
+            branchingFactor = iterations[-1] / iterations[-2]
+        else:
+            branchingFactor = self.nodes ** (1 / self.depthReached) if self.depthReached else 0.0
+        info = {
+            "depth": self.depthReached,
+            "selDepth": self.selDepth,
+            "nodes": self.nodes,
+            "qNodes": self.qNodes,
+            "timeMs": 1000 * elapsed,
+            "nps": self.nodes / elapsed,
+            "ttHitRate": self.transpositionTable.statistics()["hitRate"],
+            "firstMoveCutoffRate": self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs else 0.0,
+            "branchingFactor": branchingFactor,
+            "tablebaseHits": self.tablebaseHits,
+            "nullMoveCutoffs": self.nullMoveCutoffs,
+            "reductions": self.reductions,
+            "researches": self.researches,
+            "movesGenerated": self.movesGenerated,
+            "score": float(self.bestScore),
+            "move": self.bestMove.getChessNotation() if self.bestMove is not None else None,
+            "pv": [move.getChessNotation() for move in self.principalVariation],
+        }
+        if self.timePhases:
+            info["phaseMs"] = {phase: 1000 * seconds for phase, seconds in self.phaseTimes.items()}
+        return info
+
+    # Method to pass the statistics to the onInfo callback, if there is one
+    def reportInfo(self):
+        if self.onInfo is not None:
+            self.onInfo(self.statistics())
+
+    # Method to time move generation, evaluation and make/undo while the search runs, if timePhases is set
+    # The game state's methods are shadowed by timed wrappers on the instance and restored afterwards
+    @contextmanager
+    def phaseTimer(self, gamestate):
+        if not self.timePhases:
+            yield
+            return
+        phaseTimes = self.phaseTimes
+        running = set()
+
+        # Calls made from within a timed call of the same phase (e.g. getCaptureMoves using getValidMoves) are not counted twice.
+        def timed(function, phase):
+            def wrapper(*args):
+                if phase in running:
+                    return function(*args)
+                running.add(phase)
+                start = time.perf_counter()
+                try:
+                    return function(*args)
+                finally:
+                    phaseTimes[phase] += time.perf_counter() - start
+                    running.discard(phase)
+            return wrapper
+
+        wrapped = {"getValidMoves": "moveGen", "getCaptureMoves": "moveGen", "getQuietMoves": "moveGen", "pseudoLegalMove": "moveGen",
+                   "makeMove": "makeUndo", "undoMove": "makeUndo"}
+        for name, phase in wrapped.items():
+            setattr(gamestate, name, timed(getattr(gamestate, name), phase))
+        self.evaluate = timed(scoreBoard, "eval")
+        try:
+            yield
+        finally:
+            for name in wrapped:
+                delattr(gamestate, name)
+            self.evaluate = scoreBoard
+
+    # Method to play the root position from the tablebases when they cover it and every position it leads to
+    # Picks the fastest win, else a draw, else the slowest loss, and records it as the result of a search to depth
+    # Returns False, leaving the results alone, if the position has to be searched
+    def useTablebaseMove(self, gamestate, validMoves, depth):
+        if not TABLEBASES or not validMoves or gamestate.pieceCount > self.tablebases.maxPieces or self.tablebases.probe(gamestate) is None:
+            return False
+        bestMove = None
+        bestScore = -2*CHECKMATE
+        for move in validMoves:
+            gamestate.makeMove(move)
+            entry = self.tablebases.probe(gamestate)
+            gamestate.undoMove()
+            if entry is None:
+                return False
+            # The result after the move is the opponent's, one ply closer to the end.
+            score = tablebaseScore((-entry[0], entry[1] + 1))
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+        self.tablebaseHits += len(validMoves) + 1
+        self.bestMove = bestMove
+        self.bestScore = bestScore
+        self.principalVariation = [bestMove]
+        self.depthReached = depth
+        return True
+
+    # Method to check whether the running search has to stop: its deadline passed or its stop event was set
+    def searchStopped(self):
+        return (self.deadline is not None and time.perf_counter() > self.deadline) or (self.stopEvent is not None and self.stopEvent.is_set())
+
+    # Method to sort moves so the likeliest cutoffs are searched first
+    # Order: hash move, captures and promotions by MVV-LVA, killer moves for this ply, then quiet moves by history score
+    def orderMoves(self, moves, ply, hashMoveID):
+        killers = self.killerMoves[ply]
+        historyScores = self.historyScores
+
+        def moveOrderScore(move):
+            if move.moveID == hashMoveID:
+                return HASH_MOVE_SCORE
+            if move.isCapture or move.isPawnPromotion:
+                victimScore = pieceScores[move.pieceCaptured[1]] if move.isCapture else 0
+                if move.isPawnPromotion:
+                    victimScore += pieceScores["Q"]
+                return CAPTURE_SCORE + 10 * victimScore - pieceScores[move.pieceMoved[1]]
+            if move.moveID == killers[0]:
+                return KILLER_SCORE + 1
+            if move.moveID == killers[1]:
+                return KILLER_SCORE
+            return historyScores.get((move.pieceMoved, move.endRow, move.endColumn), 0)
+
+        moves.sort(key=moveOrderScore, reverse=True)
+
+    # Method to yield the moves of a node one stage at a time, generating each stage only when the one before it is
+    # used up without a cutoff: the hash move, captures and promotions by MVV-LVA, the killer moves of the ply, then the
+    # other quiet moves by history score (all legal evasions, ordered, when in check)
+    # Yields (move, verified) pairs; hash and killer moves are only checked to be pseudo-legal, so unverified moves
+    # must be tested with kingLeftInCheck once made
+    def stagedMoves(self, gamestate, ply, hashMoveID, inCheck):
+        if inCheck:
+            moves = gamestate.getValidMoves()
+            self.movesGenerated += len(moves)
+            self.orderMoves(moves, ply, hashMoveID)
+            for move in moves:
+                yield move, True
+            return
 
-# Function to find the best move using a minimax algorithm with a given depth (no alpha-beta pruning)
-def findMoveMinMax(gamestate, validMoves, depth, ttl_depth, whiteToMove):
-    global nextMove
-    if depth == 0:
-        return scoreBoard(gamestate)
+        tried = set()
+        if hashMoveID != -1:
+            move = gamestate.pseudoLegalMove(hashMoveID)
+            self.movesGenerated += 1
+            if move is not None:
+                tried.add(hashMoveID)
+                yield move, False
 
-    if whiteToMove:
+        moves = gamestate.getCaptureMoves()
+        self.movesGenerated += len(moves)
+        self.orderMoves(moves, ply, -1)
+        for move in moves:
+            if move.moveID not in tried:
+                yield move, True
+
+        for killerID in self.killerMoves[ply]:
+            if killerID != -1 and killerID not in tried:
+                move = gamestate.pseudoLegalMove(killerID)
+                self.movesGenerated += 1
+                # Killers are quiet moves; a capture on the killer's squares was searched with the captures.
+                if move is not None and not move.isCapture and not move.isPawnPromotion:
+                    tried.add(killerID)
+                    yield move, False
+
+        moves = gamestate.getQuietMoves()
+        self.movesGenerated += len(moves)
+        self.orderMoves(moves, ply, -1)
+        for move in moves:
+            if move.moveID not in tried:
+                yield move, True
+
+    # Method to remember a quiet move that caused a beta cutoff as a killer for its ply and in the history table
+    def recordCutoff(self, move, ply, depth):
+        if move.isCapture or move.isPawnPromotion:
+            return
+        killers = self.killerMoves[ply]
+        if killers[0] != move.moveID:
+            killers[1] = killers[0]
+            killers[0] = move.moveID
+        historyKey = (move.pieceMoved, move.endRow, move.endColumn)
+        self.historyScores[historyKey] = min(self.historyScores.get(historyKey, 0) + depth * depth, KILLER_SCORE - 1)
+
+    # Method to find the best move using a minimax algorithm with a given depth (no alpha-beta pruning)
+    def findMoveMinMax(self, gamestate, validMoves, depth, ttl_depth, whiteToMove):
+        if depth == 0:
+            return self.evaluate(gamestate)
+
+        if whiteToMove:
+            maxScore = -CHECKMATE
+            for move in validMoves:
+                gamestate.makeMove(move)
+                nextMoves = gamestate.getValidMoves()
+                score = self.findMoveMinMax(gamestate, nextMoves, depth - 1, ttl_depth, False)
+                if score > maxScore:
+                    maxScore = score
+                    if depth == ttl_depth:
+                        self.bestMove = move
+                gamestate.undoMove()
+            return maxScore
+
+        else:
+            minScore = CHECKMATE
+            for move in validMoves:
+                gamestate.makeMove(move)
+                nextMoves = gamestate.getValidMoves()
+                score = self.findMoveMinMax(gamestate, nextMoves, depth - 1, ttl_depth, True)
+                if score < minScore:
+                    minScore = score
+                    if depth == ttl_depth:
+                        self.bestMove = move
+                gamestate.undoMove()
+            return minScore
+
+    # Method to find the best move using a negamax algorithm with a given depth (no alpha-beta pruning)
+    def findMoveNegaMax(self, gamestate, validMoves, depth, ttl_depth, turnMultiplier):
+        self.nodes += 1
+        if depth == 0:
+            return turnMultiplier * self.evaluate(gamestate)
         maxScore = -CHECKMATE
+
         for move in validMoves:
             gamestate.makeMove(move)
             nextMoves = gamestate.getValidMoves()
-            score = findMoveMinMax(gamestate, nextMoves, depth - 1, ttl_depth, False)
+            score = -self.findMoveNegaMax(gamestate, nextMoves, depth - 1, ttl_depth, -turnMultiplier)
             if score > maxScore:
                 maxScore = score
                 if depth == ttl_depth:
-                    nextMove = move
+                    self.bestMove = move
             gamestate.undoMove()
         return maxScore
 
-    else:
-        minScore = CHECKMATE
-        for move in validMoves:
+    # Method to find the best move using a negamax algorithm with alpha-beta pruning
+    # Results are stored in the transposition table, and interior nodes return early when a deep enough entry bounds the score
+    # ply is the distance from the root, which reductions keep from being ttl_depth - depth, and allowNullMove is
+    # False right after a null move so two are never made in a row
+    # With PVS, moves after the first are searched with a null window and again with the full window only if they
+    # beat alpha; with LMR, late quiet moves are searched to a reduced depth first; with NULL_MOVE, a node is pruned
+    # if passing the turn and searching less deep still fails high
+    def findMoveNegaMaxAlphaBeta(self, gamestate, validMoves, depth, ttl_depth, alpha, beta, turnMultiplier, ply=0, allowNullMove=True):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_INTERVAL == 0 and self.searchStopped():
+            raise SearchTimeout()
+        self.pvTable[ply] = []
+        if ply > self.selDepth:
+            self.selDepth = ply
+        if TABLEBASES and depth != ttl_depth and gamestate.pieceCount <= self.tablebases.maxPieces:
+            entry = self.tablebases.probe(gamestate)
+            if entry is not None:
+                self.tablebaseHits += 1
+                return tablebaseScore(entry)
+        if depth == 0:
+            if QUIESCENCE:
+                return self.quiescenceSearch(gamestate, alpha, beta, turnMultiplier, ply)
+            return turnMultiplier * self.evaluate(gamestate)
+        # Interior nodes are called without moves and generate their own, stage by stage with STAGED_MOVES, so a node
+        # cut off by the transposition table, a null move or its first few moves never generates the rest.
+        staged = validMoves is None and STAGED_MOVES and MOVE_ORDERING
+        if staged:
+            inCheck = gamestate.kingInCheck()
+        else:
+            if validMoves is None:
+                validMoves = gamestate.getValidMoves()
+                self.movesGenerated += len(validMoves)
+            if not validMoves:
+                return STALEMATE if gamestate.stalemate else -CHECKMATE
+            # Set by the getValidMoves call that produced validMoves, before any child search overwrites it.
+            inCheck = gamestate.inCheck
+
+        key = gamestate.zobristKey
+        alphaOriginal = alpha
+        entry = self.transpositionTable.probe(key)
+        hashMoveID = -1
+        if entry is not None:
+            entryDepth, entryScore, entryBound, hashMoveID = entry
+            if entryDepth >= depth and depth != ttl_depth:
+                if entryBound == tt.EXACT:
+                    return entryScore
+                if entryBound == tt.LOWERBOUND and entryScore > alpha:
+                    alpha = entryScore
+                elif entryBound == tt.UPPERBOUND and entryScore < beta:
+                    beta = entryScore
+                if alpha >= beta:
+                    return entryScore
+
+        # Null move: if the opponent cannot reach beta even given a free move, a real move will not let them either.
+        # Not tried in check, near mate scores or with only king and pawns, where zugzwang makes passing the best move.
+        if (NULL_MOVE and allowNullMove and depth != ttl_depth and depth > NULL_MOVE_REDUCTION and not inCheck and beta < TABLEBASE_WIN
+                and turnMultiplier * self.evaluate(gamestate) >= beta and hasPiecesBesidesPawns(gamestate)):
+            nullDepth = depth - 1 - NULL_MOVE_REDUCTION
+            moveLogLength = len(gamestate.moveLog)
+            gamestate.makeNullMove()
+            try:
+                score = -self.findMoveNegaMaxAlphaBeta(gamestate, None, nullDepth, ttl_depth, -beta, -beta + NULL_WINDOW, -turnMultiplier, ply + 1, False)
+            finally:
+                # A timeout leaves the moves below the null move made; they are undone first so the logs unwind in order
+                while len(gamestate.moveLog) > moveLogLength:
+                    gamestate.undoMove()
+                gamestate.undoNullMove()
+            if score >= beta:
+                self.nullMoveCutoffs += 1
+                return beta
+
+        if staged:
+            moves = self.stagedMoves(gamestate, ply, hashMoveID, inCheck)
+        else:
+            if MOVE_ORDERING:
+                self.orderMoves(validMoves, ply, hashMoveID)
+            moves = ((move, True) for move in validMoves)
+
+        killers = self.killerMoves[ply]
+        maxScore = -CHECKMATE
+        bestMove = None
+        moveIndex = -1
+        for move, verified in moves:
             gamestate.makeMove(move)
-            nextMoves = gamestate.getValidMoves()
-            score = findMoveMinMax(gamestate, nextMoves, depth - 1, ttl_depth, True)
-            if score < minScore:
-                minScore = score
+            if not verified and gamestate.kingLeftInCheck():
+                gamestate.undoMove()
+                continue
+            moveIndex += 1
+            # Without quiescence, a depth 0 node is scored statically, which needs checkmate and stalemate set.
+            nextMoves = gamestate.getValidMoves() if depth == 1 and not QUIESCENCE else None
+            if moveIndex == 0:
+                score = -self.findMoveNegaMaxAlphaBeta(gamestate, nextMoves, depth - 1, ttl_depth, -beta, -alpha, -turnMultiplier, ply + 1)
+            else:
+                # Captures, promotions, killers, checks and check evasions are never reduced.
+                reduction = 0
+                if (LMR and depth >= LMR_MIN_DEPTH and moveIndex >= LMR_FULL_MOVES and depth != ttl_depth and not inCheck
+                        and not move.isCapture and not move.isPawnPromotion and move.moveID not in killers and not gamestate.kingInCheck()):
+                    reduction = LMR_REDUCTION
+                    self.reductions += 1
+                window = min(alpha + NULL_WINDOW, beta) if PVS else beta
+                score = -self.findMoveNegaMaxAlphaBeta(gamestate, nextMoves, depth - 1 - reduction, ttl_depth, -window, -alpha, -turnMultiplier, ply + 1)
+                if reduction and score > alpha:
+                    self.researches += 1
+                    score = -self.findMoveNegaMaxAlphaBeta(gamestate, nextMoves, depth - 1, ttl_depth, -window, -alpha, -turnMultiplier, ply + 1)
+                if window < beta and alpha < score < beta:
+                    self.researches += 1
+                    score = -self.findMoveNegaMaxAlphaBeta(gamestate, nextMoves, depth - 1, ttl_depth, -beta, -alpha, -turnMultiplier, ply + 1)
+            if score > maxScore:
+                maxScore = score
+                bestMove = move
                 if depth == ttl_depth:
-                    nextMove = move
+                    self.bestMove = move
             gamestate.undoMove()
-        return minScore
-
-# Function to find the best move using a negamax algorithm with a given depth (no alpha-beta pruning)
-def findMoveNegaMax(gamestate, validMoves, depth, ttl_depth, turnMultiplier):
-    global nextMove, counter
-    counter += 1
-    if depth == 0:
-        return turnMultiplier * scoreBoard(gamestate)
-    maxScore = -CHECKMATE
-
-    for move in validMoves:
-        gamestate.makeMove(move)
-        nextMoves = gamestate.getValidMoves()
-        score = -findMoveNegaMax(gamestate, nextMoves, depth - 1, ttl_depth, -turnMultiplier)
-        if score > maxScore:
-            maxScore = score
-            if depth == ttl_depth:
-                nextMove = move
-                print(move, score)
-        gamestate.undoMove()
-    return maxScore
-
-# Function to find the best move using a negamax algorithm with alpha-beta pruning
-def findMoveNegaMaxAlphaBeta(gamestate, validMoves, depth, ttl_depth, alpha, beta, turnMultiplier):
-    global nextMove, counter
-    counter += 1
-    if depth == 0:
-        return turnMultiplier * scoreBoard(gamestate)
-    maxScore = -CHECKMATE
-
-    for move in validMoves:
-        gamestate.makeMove(move)
-        nextMoves = gamestate.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gamestate, nextMoves, depth - 1, ttl_depth, -beta, -alpha, -turnMultiplier)
-        if score > maxScore:
-            maxScore = score
-            if depth == ttl_depth:
-                nextMove = move
-                print(move, score)
-        gamestate.undoMove()
-        if maxScore > alpha:
-            alpha = maxScore
-        if alpha >= beta:
-            break
-    return maxScore
+            if maxScore > alpha:
+                alpha = maxScore
+                self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+            if alpha >= beta:
+                self.betaCutoffs += 1
+                if moveIndex == 0:
+                    self.firstMoveCutoffs += 1
+                if MOVE_ORDERING:
+                    self.recordCutoff(move, ply, depth)
+                break
+
+        if moveIndex == -1:
+            return -CHECKMATE if inCheck else STALEMATE
+        if maxScore <= alphaOriginal:
+            bound = tt.UPPERBOUND
+        elif maxScore >= beta:
+            bound = tt.LOWERBOUND
+        else:
+            bound = tt.EXACT
+        self.transpositionTable.store(key, depth, maxScore, bound, bestMove.moveID if bestMove is not None else -1)
+        return maxScore
+
+    # Method to resolve captures at the horizon so the static score is not taken in the middle of an exchange
+    # Only captures and promotions are searched (all evasions when in check), with stand-pat and delta pruning
+    def quiescenceSearch(self, gamestate, alpha, beta, turnMultiplier, ply):
+        self.nodes += 1
+        self.qNodes += 1
+        if ply > self.selDepth:
+            self.selDepth = ply
+        if self.nodes % TIME_CHECK_INTERVAL == 0 and self.searchStopped():
+            raise SearchTimeout()
+
+        moves = gamestate.getCaptureMoves()
+        self.movesGenerated += len(moves)
+        inCheck = gamestate.inCheck
+        if inCheck:
+            if not moves:
+                return -CHECKMATE
+            standPat = -CHECKMATE
+        else:
+            standPat = turnMultiplier * self.evaluate(gamestate)
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+
+        if MOVE_ORDERING:
+            self.orderMoves(moves, MAX_DEPTH, -1)  # no killers are recorded for the slot past the last ply
+        maxScore = standPat
+        for move in moves:
+            # Delta pruning: skip captures that cannot raise the score to alpha even if the piece is won for free.
+            if not inCheck and not move.isPawnPromotion and standPat + pieceScores[move.pieceCaptured[1]] + DELTA_MARGIN <= alpha:
+                continue
+            gamestate.makeMove(move)
+            score = -self.quiescenceSearch(gamestate, -beta, -alpha, -turnMultiplier, ply + 1)
+            gamestate.undoMove()
+            if score > maxScore:
+                maxScore = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return maxScore
+
+
+# Function to check whether the side to move has a piece other than its king and pawns
+# Null moves are not tried without one, since such endings are where zugzwang is common
+def hasPiecesBesidesPawns(gamestate):
+    color = "w" if gamestate.whiteToMove else "b"
+    return any(square[0] == color and square[1] in "QRBN" for row in gamestate.board for square in row)
 
 # Function to score the board based on piece positions and checkmate/stalemate conditions
 # Positive score is good for white, negative is good for black
+# Uses the incrementally kept evaluation when the game state has one, otherwise rescans the board
 def scoreBoard(gamestate):
     if gamestate.checkmate:
         if gamestate.whiteToMove:
@@ -197,19 +797,23 @@ def scoreBoard(gamestate):
     if gamestate.stalemate:
         return STALEMATE
 
+    if gamestate.pieceSquareValues is pieceSquareValues:
+        if EVAL_CONSISTENCY_CHECK:
+            assert abs(gamestate.evaluation - scoreBoardFull(gamestate)) < 1e-6, (gamestate.evaluation, scoreBoardFull(gamestate))
+        return gamestate.evaluation
+    return scoreBoardFull(gamestate)
+
+# Function to score the material and piece positions by scanning all 64 squares
+def scoreBoardFull(gamestate):
     score = 0
     for row in range(len(gamestate.board)):
         for column in range(len(gamestate.board[row])):
             square = gamestate.board[row][column]
             if square != "--":
-                piecePositionScore = 0
-                if square[1] != "K":
-                    if square[1] == "p":
-                        piecePositionScore = piecePositionScores[square][row][column]
-                    else:
-                        piecePositionScore = piecePositionScores[square[1]][row][column]
+                table = positionScores(square)
+                piecePositionScore = table[row][column] if table is not None else 0
                 if square[0] == "w":
-                    score += pieceScores[square[1]] + piecePositionScore * 0.2
+                    score += pieceScores[square[1]] + piecePositionScore * POSITION_WEIGHT
                 elif square[0] == "b":
-                    score -= pieceScores[square[1]] + piecePositionScore * 0.2
+                    score -= pieceScores[square[1]] + piecePositionScore * POSITION_WEIGHT
     return score
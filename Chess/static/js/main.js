@@ -1,5 +1,6 @@
 document.addEventListener("DOMContentLoaded", () => {
-    const socket = io(); 
+    const gameId = new URLSearchParams(window.location.search).get('gameId');
+    const socket = io({ query: { gameId } });
 
     const chessBoard = document.getElementById('chessBoard');
     const moveLogElement = document.getElementById('moveLog');
@@ -228,10 +229,21 @@ document.addEventListener("DOMContentLoaded", () => {
         moveLogElement.appendChild(table);
     };
 
+    // The game expired or was never started, so go back to the menu to start a new one
+    socket.on('gameNotFound', () => {
+        window.location.href = '/';
+    });
+
     socket.on('aiThinking', (data) => {
         aiThinking = data.thinking;
     });
 
+    // Statistics of each completed AI search iteration, for the browser console
+    socket.on('searchInfo', (data) => {
+        console.debug(`depth ${data.depth}/${data.selDepth} score ${data.score.toFixed(2)} nodes ${data.nodes} ` +
+                      `nps ${Math.round(data.nps)} tt ${(100 * data.ttHitRate).toFixed(0)}% pv ${data.pv.join(' ')}`);
+    });
+
     // Display game over message
     socket.on('gameOver', async (data) => {
         await delay(ANIMATION_DURATION);
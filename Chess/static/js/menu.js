@@ -43,7 +43,7 @@ document.addEventListener("DOMContentLoaded", () => {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                window.location.href = '/game';
+                window.location.href = `/game?gameId=${data.gameId}`;
             }
         });
     });
@@ -0,0 +1,355 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import chessEngine, pgn, smartMoveFinder
+from batchEvaluation import PIECES, SQUARES, packFENs
+
+# Texel tuning: the evaluation is linear in the piece values and position table entries, so they are fitted to
+# game results by gradient descent on the logistic loss of sigmoid(scale * evaluation) against the result.
+TUNED_PIECES: Tuple[str, ...] = ("p", "N", "B", "R", "Q", "K")  # in the order of their codes in batchEvaluation.PIECES
+NUM_MATERIAL: int = 5  # the king's value is not tuned
+# Each colour has its own position tables, in the order of PIECES[1:13], as in smartMoveFinder.
+NUM_PARAMETERS: int = NUM_MATERIAL + 2 * 64 * len(TUNED_PIECES)
+# The square a square is mirrored to between the colours' points of view, used by symmetrize.
+MIRROR: np.ndarray = (7 - SQUARES // 8) * 8 + SQUARES % 8
+RESULT_SCORES: Dict[str, float] = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5, "1": 1.0, "0": 0.0,
+                                   "1.0": 1.0, "0.0": 0.0, "0.5": 0.5}
+BATCH_SIZE: int = 65536
+CHUNK_LINES: int = 65536
+
+assert PIECES[1:] == tuple(color + piece for color in "wb" for piece in TUNED_PIECES)
+
+
+# Function to split a labeled position line into its FEN and the result for white (1, 0.5 or 0).
+# The result is the last field, e.g. "<fen> 1-0", "<fen> [0.5]" or the EPD style '<fen> c9 "1/2-1/2";'.
+# Returns None for blank lines, comments and lines without a result.
+def parseLine(line: str) -> Optional[Tuple[str, float]]:
+    fields: List[str] = line.translate(str.maketrans('[]";', "    ")).split()
+    if len(fields) < 2 or fields[0].startswith("#"):
+        return None
+    result: Optional[float] = RESULT_SCORES.get(fields[-1])
+    if result is None:
+        return None
+    return " ".join(field for field in fields[:-1] if field != "c9"), result
+
+
+# Function to split a file into byte ranges of about equal size that start and end on line boundaries.
+def shardRanges(path: str, numShards: int) -> List[Tuple[int, int]]:
+    size: int = os.path.getsize(path)
+    offsets: List[int] = [0]
+    with open(path, "rb") as file:
+        for i in range(1, numShards):
+            file.seek(max(size * i // numShards, offsets[-1]))
+            if file.tell() > 0:
+                file.readline()
+            offsets.append(min(file.tell(), size))
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
+
+
+# Function to read the lines of a byte range of a file in chunks.
+def readChunks(file: BinaryIO, start: int, end: int, chunkLines: int) -> Iterator[List[str]]:
+    file.seek(start)
+    lines: List[str] = []
+    while file.tell() < end:
+        line: bytes = file.readline()
+        if not line:
+            break
+        lines.append(line.decode("ascii", "replace"))
+        if len(lines) == chunkLines:
+            yield lines
+            lines = []
+    if lines:
+        yield lines
+
+
+# Function to stream the labeled positions of a byte range of a dataset file into a shard on disk: the packed
+# boards (int8 piece codes, see batchEvaluation.packFENs) in prefix.codes and the results (float32) in prefix.results.
+# Lines that do not parse are skipped. Returns the number of positions written.
+def packShard(path: str, start: int, end: int, prefix: str, chunkLines: int = CHUNK_LINES) -> int:
+    count: int = 0
+    with open(path, "rb") as file, open(prefix + ".codes", "wb") as codesFile, open(prefix + ".results", "wb") as resultsFile:
+        for lines in readChunks(file, start, end, chunkLines):
+            fens: List[str] = []
+            results: List[float] = []
+            for line in lines:
+                parsed: Optional[Tuple[str, float]] = parseLine(line)
+                if parsed is not None:
+                    fens.append(parsed[0])
+                    results.append(parsed[1])
+            if not fens:
+                continue
+            codesFile.write(packFENs(fens)[0].tobytes())
+            resultsFile.write(np.array(results, dtype=np.float32).tobytes())
+            count += len(fens)
+    return count
+
+
+# Function to memory-map a shard written by packShard, as its (N, 64) codes and (N,) results.
+def loadShard(prefix: str) -> Tuple[np.ndarray, np.ndarray]:
+    results: np.ndarray = np.memmap(prefix + ".results", dtype=np.float32, mode="r")
+    codes: np.ndarray = np.memmap(prefix + ".codes", dtype=np.int8, mode="r", shape=(len(results), 64))
+    return codes, results
+
+
+# Function to read the current evaluation (smartMoveFinder's piece values and position tables) as tuning parameters:
+# the values of pawn to queen, then the 64 position entries of each piece in PIECES[1:13], in pawns. The parameters
+# evaluate every position exactly as scoreBoard does.
+def initialParameters() -> np.ndarray:
+    theta: np.ndarray = np.zeros(NUM_PARAMETERS)
+    theta[:NUM_MATERIAL] = [smartMoveFinder.pieceScores[piece] for piece in TUNED_PIECES[:NUM_MATERIAL]]
+    for code, piece in enumerate(PIECES[1:]):
+        table = smartMoveFinder.positionScores(piece)
+        if table is not None:
+            theta[NUM_MATERIAL + 64 * code:NUM_MATERIAL + 64 * (code + 1)] = np.asarray(table, dtype=float).ravel() * smartMoveFinder.POSITION_WEIGHT
+    return theta
+
+
+# Function to split parameters into the piece values (including the king's 0) and the (12, 64) position tables.
+def splitParameters(theta: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return np.append(theta[:NUM_MATERIAL], 0.0), theta[NUM_MATERIAL:].reshape(2 * len(TUNED_PIECES), 64)
+
+
+# Function to make the black position tables the mirror images of the white ones, by averaging each white entry
+# with the black entry of the mirrored square. Applied to the starting parameters and every gradient, it keeps the
+# tuned tables colour-symmetric.
+def symmetrize(theta: np.ndarray) -> np.ndarray:
+    theta = theta.copy()
+    _, positions = splitParameters(theta)
+    numPieces: int = len(TUNED_PIECES)
+    white: np.ndarray = (positions[:numPieces] + positions[numPieces:, MIRROR]) / 2
+    theta[NUM_MATERIAL:] = np.concatenate((white, white[:, MIRROR])).ravel()
+    return theta
+
+
+# Function to build the (13, 64) value table of the parameters, indexed by piece code and square like
+# batchEvaluation.valueTable, so a position evaluates to the sum of its squares' entries.
+def parameterTable(theta: np.ndarray) -> np.ndarray:
+    material, positions = splitParameters(theta)
+    table: np.ndarray = np.zeros((len(PIECES), 64))
+    table[1:7] = material[:, None] + positions[:6]
+    table[7:13] = -(material[:, None] + positions[6:])
+    return table
+
+
+# Function to turn the gradient of the loss with respect to the value table into one with respect to the parameters.
+def parameterGradient(tableGradient: np.ndarray) -> np.ndarray:
+    white: np.ndarray = tableGradient[1:7]
+    black: np.ndarray = tableGradient[7:13]
+    gradient: np.ndarray = np.empty(NUM_PARAMETERS)
+    gradient[:NUM_MATERIAL] = (white.sum(axis=1) - black.sum(axis=1))[:NUM_MATERIAL]
+    gradient[NUM_MATERIAL:] = np.concatenate((white, -black)).ravel()
+    return gradient
+
+
+# Function to sum the logistic loss of a shard, and its gradient with respect to the parameters unless withGradient
+# is False, going through the shard in batches. Returns (gradient or None, loss sum, positions).
+def shardGradient(prefix: str, theta: np.ndarray, scale: float, batchSize: int = BATCH_SIZE,
+                  withGradient: bool = True) -> Tuple[Optional[np.ndarray], float, int]:
+    codes, results = loadShard(prefix)
+    table: np.ndarray = parameterTable(theta)
+    tableGradient: np.ndarray = np.zeros(len(PIECES) * 64)
+    loss: float = 0.0
+    for start in range(0, len(results), batchSize):
+        indices: np.ndarray = np.asarray(codes[start:start + batchSize], dtype=np.intp) * 64 + SQUARES
+        result: np.ndarray = np.asarray(results[start:start + batchSize], dtype=float)
+        logit: np.ndarray = scale * table.ravel()[indices].sum(axis=1)
+        # -(r * log(sigmoid(x)) + (1 - r) * log(1 - sigmoid(x))), without overflow for large |x|
+        loss += float(np.sum(result * np.logaddexp(0, -logit) + (1 - result) * np.logaddexp(0, logit)))
+        if withGradient:
+            residual: np.ndarray = scale * (1 / (1 + np.exp(-logit)) - result)
+            tableGradient += np.bincount(indices.ravel(), weights=np.repeat(residual, 64), minlength=tableGradient.size)
+    gradient: Optional[np.ndarray] = parameterGradient(tableGradient.reshape(len(PIECES), 64)) if withGradient else None
+    return gradient, loss, len(results)
+
+
+# Class to tune the evaluation on a dataset split into shards, with a process per shard.
+class TexelTuner:
+    # Method to split the dataset files into shards, one per process and file, and pack them in parallel.
+    def __init__(self, paths: Sequence[str], processes: Optional[int] = None, batchSize: int = BATCH_SIZE,
+                 workDir: Optional[str] = None) -> None:
+        self.processes: int = processes or os.cpu_count() or 1
+        self.batchSize: int = batchSize
+        self.workDir: str = workDir or tempfile.mkdtemp(prefix="texel-")
+        self.ownsWorkDir: bool = workDir is None
+        self.executor: ProcessPoolExecutor = ProcessPoolExecutor(max_workers=self.processes,
+                                                                 mp_context=multiprocessing.get_context("spawn"))
+        self.shards: List[str] = []
+        self.positions: int = 0
+        self.positionsEvaluated: int = 0
+        self.evaluationSeconds: float = 0.0
+        start: float = time.perf_counter()
+        jobs = []
+        for path in paths:
+            for rangeStart, rangeEnd in shardRanges(path, self.processes):
+                prefix: str = os.path.join(self.workDir, f"shard{len(jobs)}")
+                jobs.append((prefix, self.executor.submit(packShard, path, rangeStart, rangeEnd, prefix)))
+        for prefix, job in jobs:
+            count: int = job.result()
+            if count:
+                self.shards.append(prefix)
+                self.positions += count
+        self.packSeconds: float = time.perf_counter() - start
+
+    # Method to sum the loss and gradient over all shards. Returns (mean gradient or None, mean loss).
+    def evaluate(self, theta: np.ndarray, scale: float, withGradient: bool = True) -> Tuple[Optional[np.ndarray], float]:
+        start: float = time.perf_counter()
+        jobs = [self.executor.submit(shardGradient, prefix, theta, scale, self.batchSize, withGradient) for prefix in self.shards]
+        gradient: Optional[np.ndarray] = np.zeros(NUM_PARAMETERS) if withGradient else None
+        loss: float = 0.0
+        for job in jobs:
+            shardGrad, shardLoss, _ = job.result()
+            loss += shardLoss
+            if gradient is not None:
+                gradient += shardGrad
+        self.evaluationSeconds += time.perf_counter() - start
+        self.positionsEvaluated += self.positions
+        count: int = max(self.positions, 1)
+        return (gradient / count if gradient is not None else None), loss / count
+
+    # Method to find the scale of the sigmoid that fits the results best with the given parameters, by golden
+    # section search on its logarithm. It turns evaluations in pawns into expected scores and stays fixed while tuning.
+    def fitScale(self, theta: np.ndarray, low: float = 0.05, high: float = 5.0, iterations: int = 20) -> float:
+        ratio: float = (np.sqrt(5) - 1) / 2
+        a, b = np.log(low), np.log(high)
+        c, d = b - ratio * (b - a), a + ratio * (b - a)
+        lossC: float = self.evaluate(theta, float(np.exp(c)), False)[1]
+        lossD: float = self.evaluate(theta, float(np.exp(d)), False)[1]
+        for _ in range(iterations):
+            if lossC < lossD:
+                b, d, lossD = d, c, lossC
+                c = b - ratio * (b - a)
+                lossC = self.evaluate(theta, float(np.exp(c)), False)[1]
+            else:
+                a, c, lossC = c, d, lossD
+                d = a + ratio * (b - a)
+                lossD = self.evaluate(theta, float(np.exp(d)), False)[1]
+        return float(np.exp((a + b) / 2))
+
+    # Method to tune the parameters with Adam on the full-dataset gradient for the given number of epochs,
+    # printing the loss and throughput every reportEvery epochs. With symmetric, the gradients are symmetrized so
+    # mirrored entries of the two colours' tables, if equal to start with, stay equal.
+    # Returns the tuned parameters and the final loss.
+    def tune(self, theta: np.ndarray, scale: float, epochs: int, learningRate: float = 0.002,
+             reportEvery: int = 10, symmetric: bool = False) -> Tuple[np.ndarray, float]:
+        theta = theta.copy()
+        firstMoment: np.ndarray = np.zeros_like(theta)
+        secondMoment: np.ndarray = np.zeros_like(theta)
+        beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+        loss: float = self.evaluate(theta, scale, False)[1]
+        print(f"epoch {0:>5}  loss {loss:.6f}", flush=True)
+        for epoch in range(1, epochs + 1):
+            gradient, loss = self.evaluate(theta, scale)
+            if symmetric:
+                gradient = symmetrize(gradient)
+            firstMoment = beta1 * firstMoment + (1 - beta1) * gradient
+            secondMoment = beta2 * secondMoment + (1 - beta2) * gradient ** 2
+            step: np.ndarray = firstMoment / (1 - beta1 ** epoch) / (np.sqrt(secondMoment / (1 - beta2 ** epoch)) + epsilon)
+            theta -= learningRate * step
+            if epoch % reportEvery == 0 or epoch == epochs:
+                # The loss is that of the parameters before this epoch's step.
+                print(f"epoch {epoch:>5}  loss {loss:.6f}  {self.throughput():,.0f} positions/s", flush=True)
+        return theta, self.evaluate(theta, scale, False)[1]
+
+    # Method to return the positions evaluated per second so far, counting every pass over the dataset.
+    def throughput(self) -> float:
+        return self.positionsEvaluated / max(self.evaluationSeconds, 1e-9)
+
+    # Method to stop the worker processes and remove the shards unless the work directory was given.
+    def close(self) -> None:
+        self.executor.shutdown()
+        if self.ownsWorkDir:
+            shutil.rmtree(self.workDir, ignore_errors=True)
+
+
+# Function to write tuned parameters as a weights file for smartMoveFinder.loadWeights. The tables are in pawns
+# (position weight 1).
+def writeWeights(path: str, theta: np.ndarray, scale: Optional[float] = None, loss: Optional[float] = None,
+                 positions: Optional[int] = None) -> None:
+    material, positionTables = splitParameters(theta)
+    tables: Dict[str, List[List[float]]] = {}
+    for code, piece in enumerate(PIECES[1:]):
+        tables[piece] = np.round(positionTables[code], 4).reshape(8, 8).tolist()
+    weights = {"pieceScores": {piece: round(float(value), 4) for piece, value in zip(TUNED_PIECES, material)},
+               "positionWeight": 1.0, "piecePositionScores": tables,
+               "scale": scale, "loss": loss, "positions": positions}
+    with open(path, "w") as file:
+        json.dump(weights, file, indent=1)
+
+
+# Function to write labeled positions from PGN games: the FEN of each position from skipPlies on, followed by the
+# game's result. Positions in check and those where the move played captures or promotes are left out, as their
+# static evaluation says little about the result. Returns (games read, positions written).
+def extractPositions(pgnPaths: Sequence[str], outPath: str, skipPlies: int = 8) -> Tuple[int, int]:
+    numGames = numPositions = 0
+    with open(outPath, "w") as out:
+        for pgnPath in pgnPaths:
+            with open(pgnPath) as stream:
+                for headers, sanMoves in pgn.readGames(stream):
+                    result: str = headers.get("Result", "*")
+                    if result not in ("1-0", "0-1", "1/2-1/2"):
+                        continue
+                    numGames += 1
+                    gamestate = chessEngine.GameState.fromFEN(headers["FEN"]) if "FEN" in headers else chessEngine.GameState()
+                    for ply, san in enumerate(sanMoves):
+                        move: Optional[chessEngine.Move] = pgn.moveFromSAN(san, gamestate.getValidMoves())
+                        if move is None:
+                            break
+                        if ply >= skipPlies and not move.isCapture and not move.isPawnPromotion and not gamestate.inCheck:
+                            out.write(f"{gamestate.boardToFEN()} {result}\n")
+                            numPositions += 1
+                        gamestate.makeMove(move)
+    return numGames, numPositions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune the evaluation on positions labeled with game results.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    extract = commands.add_parser("extract", help="write labeled positions from PGN files")
+    extract.add_argument("pgn", nargs="+", help="PGN files to read")
+    extract.add_argument("-o", "--output", default="positions.txt", help="positions file to write (default: positions.txt)")
+    extract.add_argument("--skip-plies", type=int, default=8, help="opening plies of each game to leave out")
+    tune = commands.add_parser("tune", help="fit the piece values and position tables to labeled positions")
+    tune.add_argument("positions", nargs="+", help='files with one "<FEN> <result>" per line, result 1-0, 0-1, 1/2-1/2 or 1, 0.5, 0')
+    tune.add_argument("-o", "--output", default=smartMoveFinder.WEIGHTS_PATH, help="weights file to write (default: the one smartMoveFinder loads)")
+    tune.add_argument("-e", "--epochs", type=int, default=200, help="passes over the dataset")
+    tune.add_argument("--learning-rate", type=float, default=0.002, help="Adam step size, in pawns")
+    tune.add_argument("--scale", type=float, help="sigmoid scale per pawn (default: fitted to the starting evaluation)")
+    tune.add_argument("-p", "--processes", type=int, default=None, help="worker processes and shards per file (default: one per CPU)")
+    tune.add_argument("--batch", type=int, default=BATCH_SIZE, help="positions per NumPy batch")
+    tune.add_argument("--symmetric", action="store_true",
+                      help="mirror the black position tables from the white ones before tuning and keep them so")
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        games, written = extractPositions(args.pgn, args.output, args.skip_plies)
+        print(f"{games} games, {written} positions written to {args.output}")
+    else:
+        tuner = TexelTuner(args.positions, args.processes, args.batch)
+        try:
+            print(f"{tuner.positions} positions in {len(tuner.shards)} shards, packed in {tuner.packSeconds:.2f}s "
+                  f"({tuner.positions / max(tuner.packSeconds, 1e-9):,.0f} positions/s)", flush=True)
+            if not tuner.positions:
+                parser.error("no labeled positions found")
+            start = initialParameters()
+            scale = args.scale if args.scale is not None else tuner.fitScale(start)
+            print(f"sigmoid scale {scale:.4f} per pawn", flush=True)
+            if args.symmetric:
+                engineLoss = tuner.evaluate(start, scale, False)[1]
+                start = symmetrize(start)
+                symmetricLoss = tuner.evaluate(start, scale, False)[1]
+                print(f"symmetrized tables: loss {engineLoss:.6f} -> {symmetricLoss:.6f} ({symmetricLoss - engineLoss:+.6f})", flush=True)
+            tuned, finalLoss = tuner.tune(start, scale, args.epochs, args.learning_rate, symmetric=args.symmetric)
+            writeWeights(args.output, tuned, scale, finalLoss, tuner.positions)
+            material = ", ".join(f"{piece} {value:.3f}" for piece, value in zip(TUNED_PIECES, tuned[:NUM_MATERIAL]))
+            print(f"loss {finalLoss:.6f}, {material}; {tuner.throughput():,.0f} positions/s evaluated; "
+                  f"weights written to {args.output}")
+        finally:
+            tuner.close()
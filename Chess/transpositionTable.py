@@ -0,0 +1,108 @@
+from array import array
+from typing import Dict, Optional, Tuple, Union
+
+# Bound types stored with a score.
+EXACT: int = 0
+LOWERBOUND: int = 1  # the search failed high, the true score is at least the stored score
+UPPERBOUND: int = 2  # the search failed low, the true score is at most the stored score
+
+# Bytes used by one entry in the typed arrays below: key (8) + score (8) + move (4) + depth (1) + bound (1).
+ENTRY_BYTES: int = 22
+# Each bucket holds a depth-preferred slot followed by an always-replace slot.
+BUCKET_SIZE: int = 2
+
+
+# Function to get the number of buckets a table of sizeMb holds, rounded down to a power of two
+# so the bucket index is a mask of the key.
+def bucketCount(sizeMb: float) -> int:
+    maxBuckets: int = max(1, int(sizeMb * 1024 * 1024) // (ENTRY_BYTES * BUCKET_SIZE))
+    return 1 << (maxBuckets.bit_length() - 1)
+
+
+# Function to get the size in bytes of the buffer a table of sizeMb needs, e.g. to allocate shared memory for it.
+def bufferSize(sizeMb: float) -> int:
+    return bucketCount(sizeMb) * BUCKET_SIZE * ENTRY_BYTES
+
+
+# Fixed-size transposition table keyed by GameState.zobristKey.
+# Entries live in flat typed arrays rather than Python objects, so the memory cap in MB is the real footprint.
+# Given a buffer of bufferSize(sizeMb) bytes (e.g. multiprocessing shared memory), the arrays are views into it,
+# so processes attaching to the same buffer share one table. Entries are written without locking, so a probe
+# racing a store in another process can rarely see a mix of two entries; the search tolerates that like any
+# other hash collision. A shared buffer is not initialised here: one process calls clear() before use.
+class TranspositionTable:
+    def __init__(self, sizeMb: float = 16, buffer: Optional[memoryview] = None):
+        self.numBuckets: int = bucketCount(sizeMb)
+        self.mask: int = self.numBuckets - 1
+        size: int = self.numBuckets * BUCKET_SIZE
+        if buffer is None:
+            self.keys: Union[array, memoryview] = array('Q', bytes(8 * size))
+            self.scores: Union[array, memoryview] = array('d', bytes(8 * size))
+            self.moves: Union[array, memoryview] = array('i', bytes(4 * size))
+            self.depths: Union[array, memoryview] = array('b', [-1]) * size  # depth -1 marks an empty slot
+            self.bounds: Union[array, memoryview] = array('b', bytes(size))
+        else:
+            view: memoryview = memoryview(buffer).cast('B')
+            self.keys = view[:8 * size].cast('Q')
+            self.scores = view[8 * size:16 * size].cast('d')
+            self.moves = view[16 * size:20 * size].cast('i')
+            self.depths = view[20 * size:21 * size].cast('b')
+            self.bounds = view[21 * size:22 * size].cast('b')
+        self.hits: int = 0
+        self.misses: int = 0
+        self.collisions: int = 0
+        self.stores: int = 0
+
+    # Method to look up a position. Returns (depth, score, bound, moveID) or None.
+    def probe(self, key: int) -> Optional[Tuple[int, float, int, int]]:
+        slot: int = (key & self.mask) * BUCKET_SIZE
+        for i in (slot, slot + 1):
+            if self.keys[i] == key and self.depths[i] >= 0:
+                self.hits += 1
+                return self.depths[i], self.scores[i], self.bounds[i], self.moves[i]
+        self.misses += 1
+        if self.depths[slot] >= 0 or self.depths[slot + 1] >= 0:
+            self.collisions += 1
+        return None
+
+    # Method to store a search result. The depth-preferred slot is only replaced by an equal or deeper search
+    # (or the same position); anything else goes to the always-replace slot.
+    def store(self, key: int, depth: int, score: float, bound: int, moveID: int = -1) -> None:
+        slot: int = (key & self.mask) * BUCKET_SIZE
+        if self.keys[slot] == key or depth >= self.depths[slot]:
+            i: int = slot
+        else:
+            i = slot + 1
+        self.keys[i] = key
+        self.depths[i] = min(depth, 127)
+        self.scores[i] = score
+        self.bounds[i] = bound
+        self.moves[i] = moveID
+        self.stores += 1
+
+    # Method to empty the table.
+    def clear(self) -> None:
+        self.depths[:] = array('b', [-1]) * len(self.depths)
+
+    # Method to drop the views into a shared buffer, which must happen before the shared memory is closed.
+    def release(self) -> None:
+        for view in (self.keys, self.scores, self.moves, self.depths, self.bounds):
+            if isinstance(view, memoryview):
+                view.release()
+
+    # Method to reset the hit/miss/collision counters, e.g. at the start of each search.
+    def resetStatistics(self) -> None:
+        self.hits = self.misses = self.collisions = self.stores = 0
+
+    # Method to get the counters and occupancy of the table.
+    def statistics(self) -> Dict[str, float]:
+        probes: int = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'collisions': self.collisions,
+            'stores': self.stores,
+            'hitRate': self.hits / probes if probes else 0.0,
+            'entries': len(self.depths),
+            'sizeMb': len(self.depths) * ENTRY_BYTES / (1024 * 1024),
+        }